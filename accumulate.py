@@ -0,0 +1,114 @@
+"""This code contains functions called by get_image.py.
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+class FrameAccumulator():
+    """Running average of grayscale frames.
+
+    Frames are added one at a time.  Only a running sum of the whole frame is
+    kept, plus a running mean and sum of squared differences (Welford's
+    algorithm) for the pixels in the region of interest.  All of the memory is
+    allocated once, so it doesn't grow with the number of frames.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The (rows, columns) of each frame.
+    roi : tuple of slices, optional
+        Index into a frame that selects the pixels whose noise is tracked.
+        Usually the rectangle around the spectrum; see
+        roi.SpectrumROI.bounding_slices().  If None, the whole frame
+        is used.
+    pool : buffers.BufferPool, optional
+        If given, the arrays are taken from the pool, and release() gives them
+        back.
+
+    """
+
+    def __init__(self, shape, roi=None, pool=None):
+        self.shape = tuple(shape)
+        self.roi = roi if roi is not None else (slice(None), slice(None))
+        self.pool = pool
+        roi_shape = np.empty(self.shape, dtype=np.uint8)[self.roi].shape
+        if pool is None:
+            self.frame_sum = np.zeros(self.shape, dtype=np.uint32)
+            # [0] is the running mean and [1] is the running sum of squared
+            # differences from the mean, in the shape of the region of interest.
+            self._stats = np.zeros((2,) + roi_shape)
+            self._delta = np.empty(roi_shape)
+            self._scratch = np.empty(roi_shape)
+        else:
+            self.frame_sum = pool.zeros(self.shape, dtype=np.uint32)
+            self._stats = pool.zeros((2,) + roi_shape, dtype=np.float64)
+            self._delta = pool.acquire(roi_shape, dtype=np.float64)
+            self._scratch = pool.acquire(roi_shape, dtype=np.float64)
+        self.count = 0
+
+    def reset(self):
+        """Forget all of the frames that were added."""
+
+        self.frame_sum.fill(0)
+        self._stats.fill(0)
+        self.count = 0
+
+    def add(self, frame):
+        """Add a 2D uint8 frame to the running sum and statistics."""
+
+        self.frame_sum += frame
+        self.count += 1
+        # [0, ...] is a view even when the region is a single pixel.
+        mean, m2 = self._stats[0, ...], self._stats[1, ...]
+        roi_values = frame[self.roi]
+        # Every step writes into the arrays that already exist, so adding a
+        # frame allocates nothing.
+        np.subtract(roi_values, mean, out=self._delta)
+        np.divide(self._delta, self.count, out=self._scratch)
+        mean += self._scratch
+        # m2 += delta * (x - new_mean)
+        np.subtract(roi_values, mean, out=self._scratch)
+        self._scratch *= self._delta
+        m2 += self._scratch
+
+    def variance(self):
+        """Return the sample variance of each pixel in the region of interest."""
+
+        if self.count < 2:
+            return np.full(self._stats[1].shape, np.inf)
+        return self._stats[1] / (self.count - 1)
+
+    def noise(self):
+        """Return the RMS standard error of the mean over the region of
+        interest, in grey levels.  This is how noisy the averaged spectrum is,
+        and it shrinks as more frames are added."""
+
+        if self.count < 2:
+            return np.inf
+        return np.sqrt(self.variance().mean() / self.count)
+
+    def average(self, out=None):
+        """Return the averaged frame as a 2D uint8 array.  If out is given,
+        the average is written into it."""
+
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint8)
+        # The average of uint8 frames always fits in a uint8.
+        return np.floor_divide(self.frame_sum, max(self.count, 1), out=out,
+                               casting="unsafe")
+
+    def release(self):
+        """Give the arrays back to the pool.  The accumulator mustn't be used
+        afterwards."""
+
+        if self.pool is not None:
+            for array in (self.frame_sum, self._stats, self._delta, self._scratch):
+                self.pool.release(array)
+            self.pool = None
@@ -0,0 +1,331 @@
+"""This code keeps every measurement in an append-only archive.  It is used
+by gui.py and measure.py, and it can be run from the command line to look up
+and export old measurements.  Usage:
+
+    python3 archive.py list --title "olive*"
+    python3 archive.py export --since 2019-06-01 --out june.npz
+
+The archive is a directory (by default "archive") holding two files:
+
+* measurements.bin: the records, one after the other.  Each record is a
+  fixed header (see RECORD_HEADER), then the absorbance, blank and sample
+  arrays as little-endian float64, then a JSON object with the title, time,
+  calibration, location and any other metadata.  Records are never changed
+  after they are written.
+* index.sqlite: one row per record with its title, time, calibration version
+  and position in measurements.bin.  It can be rebuilt from measurements.bin
+  with rebuild_index().
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+import numpy as np
+
+from metrics import span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+RECORD_MAGIC = b"SPEC"
+RECORD_VERSION = 1
+# magic, format version, number of points, length of the JSON metadata.
+RECORD_HEADER = struct.Struct("<4sHIxxI")
+NUM_ARRAYS = 3
+DEFAULT_ARCHIVE_DIR = "archive"
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    cal_version INTEGER,
+    offset INTEGER NOT NULL UNIQUE,
+    num_points INTEGER NOT NULL,
+    meta_length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_title ON measurements (title);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements (timestamp);
+CREATE INDEX IF NOT EXISTS measurements_cal_version ON measurements (cal_version);
+"""
+
+
+class Archive():
+    """An append-only archive of measurements with an SQLite index.
+
+    Parameters
+    ----------
+    directory : string
+        The directory containing measurements.bin and index.sqlite.  It is
+        created if necessary.
+
+    """
+
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.data_loc = os.path.join(directory, "measurements.bin")
+        if not os.path.exists(self.data_loc):
+            open(self.data_loc, "wb").close()
+        # Appends may come from worker threads while the GUI or the service
+        # reads, so the connection and the memory map are shared and every
+        # method that uses them holds this lock.
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"),
+                                   check_same_thread=False)
+        self._db.executescript(_INDEX_SCHEMA)
+        self._map = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def append(self, title, absorbance, blank_row, sample_row, cal, metadata=None):
+        """Add a measurement to the archive and return its id.
+
+        Parameters
+        ----------
+        title : string
+            The title of the measurement.
+        absorbance : 1D numpy array
+            The absorbance spectrum.
+        blank_row, sample_row : 1D numpy arrays
+            The data points from the blank and the sample, in the same order as
+            the absorbance (low to high wavelength).
+        cal : dictionary
+            The calibration used, as stored in cal.json.
+        metadata : dictionary, optional
+            Anything else to keep with the measurement (must be JSON
+            serializable).
+
+        """
+
+        absorbance = np.asarray(absorbance, dtype="<f8")
+        arrays = np.stack((absorbance, np.asarray(blank_row, dtype="<f8"),
+                           np.asarray(sample_row, dtype="<f8")))
+        timestamp = time.time()
+        meta = dict(metadata or {})
+        meta.update({"title" : title, "timestamp" : timestamp, "cal" : cal})
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        record = b"".join((RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION,
+                                              len(absorbance), len(meta_bytes)),
+                           arrays.tobytes(), meta_bytes))
+        with self._lock, span("persist_archive"):
+            with open(self.data_loc, "ab") as data_file:
+                offset = data_file.tell()
+                data_file.write(record)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            cursor = self._db.execute(
+                "INSERT INTO measurements (title, timestamp, cal_version, offset, "
+                "num_points, meta_length) VALUES (?, ?, ?, ?, ?, ?)",
+                (title, timestamp, cal.get("version"), offset, len(absorbance),
+                 len(meta_bytes)))
+            self._db.commit()
+            return cursor.lastrowid
+
+    def _data(self, end):
+        """Return a read-only memory map of measurements.bin that extends at
+        least to byte end.  The caller holds the lock."""
+
+        if self._map is None or len(self._map) < end:
+            self._map = np.memmap(self.data_loc, dtype=np.uint8, mode="r")
+        return self._map
+
+    def _read_arrays(self, offset, num_points):
+        start = offset + RECORD_HEADER.size
+        end = start + NUM_ARRAYS * num_points * 8
+        data = self._data(end)
+        return np.frombuffer(data[start:end], dtype="<f8").reshape(NUM_ARRAYS, num_points)
+
+    def get(self, measurement_id):
+        """Return a measurement as a dictionary with the keys "id", "absorbance",
+        "blank_row" and "sample_row" (numpy arrays) plus its metadata."""
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT offset, num_points, meta_length FROM measurements WHERE id = ?",
+                (measurement_id,)).fetchone()
+            if row is None:
+                raise KeyError(measurement_id)
+            offset, num_points, meta_length = row
+            arrays = self._read_arrays(offset, num_points)
+            meta_start = offset + RECORD_HEADER.size + arrays.nbytes
+            meta_bytes = self._data(meta_start + meta_length)[meta_start:
+                                                              meta_start+meta_length]
+        measurement = json.loads(meta_bytes.tobytes().decode("utf-8"))
+        measurement.update({"id" : measurement_id, "absorbance" : arrays[0],
+                            "blank_row" : arrays[1], "sample_row" : arrays[2]})
+        return measurement
+
+    def query(self, title=None, since=None, until=None, cal_version=None):
+        """Return a list of (id, title, timestamp, cal_version) for the matching
+        measurements, oldest first.
+
+        Parameters
+        ----------
+        title : string, optional
+            A pattern for the title; "*" matches anything.
+        since, until : float, optional
+            Only measurements taken at or after since, and before until (as
+            time.time() values).
+        cal_version : int, optional
+            Only measurements that used this calibration version.
+
+        """
+
+        conditions = []
+        values = []
+        if title is not None:
+            conditions.append("title GLOB ?")
+            values.append(title)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            values.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            values.append(until)
+        if cal_version is not None:
+            conditions.append("cal_version = ?")
+            values.append(cal_version)
+        sql = "SELECT id, title, timestamp, cal_version FROM measurements"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return self._db.execute(sql + " ORDER BY timestamp, id", values).fetchall()
+
+    def _select_ids(self, columns, ids):
+        """Return {id : (columns...)} for the measurements with the given ids,
+        looked up 500 at a time.  The caller holds the lock."""
+
+        found = {}
+        ids = [int(measurement_id) for measurement_id in ids]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start+500]
+            rows = self._db.execute(
+                "SELECT id, %s FROM measurements WHERE id IN (%s)"
+                % (columns, ",".join("?" * len(chunk))), chunk).fetchall()
+            for row in rows:
+                found[row[0]] = row[1:]
+        return found
+
+    def absorbance_matrix(self, ids):
+        """Return the absorbance spectra of the measurements with the given ids
+        as one (len(ids), points) array.  Shorter spectra are padded with NaN."""
+
+        if len(ids) == 0:
+            return np.empty((0, 0))
+        with self._lock:
+            locations = self._select_ids("offset, num_points", ids)
+            max_points = max(num_points for _, num_points in locations.values())
+            matrix = np.full((len(ids), max_points), np.nan)
+            for i, measurement_id in enumerate(ids):
+                offset, num_points = locations[measurement_id]
+                start = offset + RECORD_HEADER.size
+                matrix[i, :num_points] = np.frombuffer(
+                    self._data(start + num_points * 8)[start:start + num_points * 8],
+                    dtype="<f8")
+        return matrix
+
+    def export_npz(self, ids, out_file_loc):
+        """Save the absorbance spectra, titles, times and calibration versions
+        of the measurements with the given ids to a numpy .npz file."""
+
+        with self._lock:
+            rows = self._select_ids("title, timestamp, cal_version", ids)
+        np.savez_compressed(out_file_loc, ids=np.asarray(ids),
+                            absorbance=self.absorbance_matrix(ids),
+                            titles=np.array([rows[i][0] for i in ids]),
+                            timestamps=np.array([rows[i][1] for i in ids]),
+                            cal_versions=np.array([rows[i][2] if rows[i][2] is not None
+                                                   else -1 for i in ids]))
+
+    def rebuild_index(self):
+        """Rebuild index.sqlite from measurements.bin, for example after a
+        crash between writing a record and indexing it.  Return the number of
+        records found."""
+
+        with self._lock:
+            self._map = None
+            size = os.path.getsize(self.data_loc)
+            data = self._data(size) if size > 0 else b""
+            entries = []
+            offset = 0
+            while offset + RECORD_HEADER.size <= size:
+                magic, _, num_points, meta_length = RECORD_HEADER.unpack(
+                    bytes(data[offset:offset + RECORD_HEADER.size]))
+                end = (offset + RECORD_HEADER.size + NUM_ARRAYS * num_points * 8 +
+                       meta_length)
+                if magic != RECORD_MAGIC or end > size:
+                    # A partly written record at the end of the file.
+                    break
+                meta = json.loads(bytes(data[end - meta_length:end]).decode("utf-8"))
+                entries.append((meta["title"], meta["timestamp"],
+                                meta["cal"].get("version"), offset, num_points,
+                                meta_length))
+                offset = end
+            self._db.execute("DELETE FROM measurements")
+            self._db.executemany(
+                "INSERT INTO measurements (title, timestamp, cal_version, offset, "
+                "num_points, meta_length) VALUES (?, ?, ?, ?, ?, ?)", entries)
+            self._db.commit()
+            return len(entries)
+
+
+_archive = None
+
+
+def get_archive():
+    """Return the default Archive, opening it the first time."""
+
+    global _archive
+    if _archive is None:
+        _archive = Archive()
+    return _archive
+
+
+def _parse_date(date_string):
+    return datetime.datetime.strptime(date_string, "%Y-%m-%d").timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up and export archived "
+                                                 "measurements.")
+    parser.add_argument("command", choices=["list", "export", "reindex"])
+    parser.add_argument("--dir", default=DEFAULT_ARCHIVE_DIR,
+                        help="the archive directory")
+    parser.add_argument("--title", help="title pattern, e.g. 'olive*'")
+    parser.add_argument("--since", type=_parse_date, help="YYYY-MM-DD")
+    parser.add_argument("--until", type=_parse_date, help="YYYY-MM-DD")
+    parser.add_argument("--cal-version", type=int)
+    parser.add_argument("--out", default="export.npz", help="file to export to")
+    args = parser.parse_args(argv)
+
+    archive = Archive(args.dir)
+    if args.command == "reindex":
+        print("%d measurements indexed." % archive.rebuild_index())
+        return
+    rows = archive.query(args.title, args.since, args.until, args.cal_version)
+    if args.command == "list":
+        for measurement_id, title, timestamp, cal_version in rows:
+            print("%6d  %s  cal v%s  %s" % (
+                measurement_id,
+                datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+                cal_version, title))
+    else:
+        archive.export_npz([row[0] for row in rows], args.out)
+        print("Exported %d measurements to %s." % (len(rows), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""This code measures a queue of labelled samples against one blank.  It is
+used by gui.py and measure.py.
+
+Capturing is the only step that needs the camera, so it is done one sample
+at a time in the calling thread.  Everything after that (the absorbance
+calculation, post-processing, the graph, the archive and the csv file) is
+handed to a pool of worker threads, so sample k is processed while sample k+1
+is being captured.
+
+This software is licensed under the MIT license.
+
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from measure import capture_row, compute_absorbance, archive_result, write_csv
+from postprocess import process
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+_thread_state = threading.local()
+
+
+def _thread_renderer():
+    """Return a SpectrumRenderer owned by the current thread.  Figures aren't
+    safe to share between threads."""
+
+    renderer = getattr(_thread_state, "renderer", None)
+    if renderer is None:
+        from plot import SpectrumRenderer
+        renderer = SpectrumRenderer()
+        _thread_state.renderer = renderer
+    return renderer
+
+
+def label_filename(label):
+    """Return label made safe to use as a file name: anything but letters,
+    digits, ".", "-" and "_" becomes "_", and leading and trailing dots are
+    dropped, so a label can't point outside the output directory."""
+
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", label.strip()).strip(".")
+    return name or "sample"
+
+
+def process_sample(label, blank_row, sample_row, cal, loc, out_dir=None,
+                   save_graph=False, resample=False, render=False):
+    """Turn a captured sample into a result: compute the absorbance, archive
+    it, post-process it (see postprocess.py), and optionally write a csv file
+    and a graph of the processed spectrum into out_dir.  The files are named
+    after the label (see label_filename()).
+
+    Returns
+    -------
+    dictionary
+        "label", "absorbance" (processed), "peaks", "id" (in the archive), and
+        "graph" (a PIL image, only if render is True).
+
+    """
+
+    data = compute_absorbance(blank_row, sample_row)
+    result = {"label" : label}
+    result["id"] = archive_result(label, data, blank_row, sample_row, cal, loc)
+    data, result["peaks"] = process(data, cal)
+    result["absorbance"] = data
+    if out_dir is not None:
+        file_base = os.path.join(out_dir, label_filename(label))
+        write_csv(file_base + ".csv", data, cal, resample)
+    if save_graph or render:
+        renderer = _thread_renderer()
+        renderer.update(data, cal, label)
+        if save_graph and out_dir is not None:
+            renderer.save(file_base + ".png")
+        if render:
+            result["graph"] = renderer.render()
+    return result
+
+
+class SampleQueue():
+    """Pipelined measurement of several samples against one blank.
+
+    Call capture() for each sample, in order; it returns as soon as the
+    camera is free again, and the processing continues in the background.
+
+    Parameters
+    ----------
+    blank_row : numpy array
+        The blank.
+    cal : dictionary
+        The calibration.
+    loc : dictionary
+        The location of the spectrum.
+    workers : int
+        The number of worker threads for processing.
+    max_pending : int, optional
+        capture() waits if this many samples are still being processed, so
+        memory use stays bounded.  By default it is twice the number of
+        workers.
+    Other keyword arguments are passed to process_sample().
+
+    """
+
+    def __init__(self, blank_row, cal, loc, workers=2, max_pending=None,
+                 **process_options):
+        self.blank_row = blank_row
+        self.cal = cal
+        self.loc = loc
+        self.process_options = process_options
+        self.futures = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * workers)
+
+    def capture(self, label, progress=None, cancel=None):
+        """Capture a sample and queue it for processing.  Return a
+        concurrent.futures.Future of its result (see process_sample()).
+        progress and cancel are passed to capture_row()."""
+
+        self._slots.acquire()
+        try:
+            sample_row = capture_row(self.loc, progress, cancel)
+            future = self._executor.submit(process_sample, label, self.blank_row,
+                                           sample_row, self.cal, self.loc,
+                                           **self.process_options)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        """Wait for all of the processing to finish.  Return the results in
+        the order the samples were captured."""
+
+        self._executor.shutdown(wait=True)
+        return [future.result() for future in self.futures]
+
+
+def run_queue(labels, blank_row, cal, loc, before_capture=None, workers=2,
+              **process_options):
+    """Measure the samples in labels, in order, against blank_row.
+
+    before_capture(label), if given, is called before each capture; for
+    example, it can wait for a robot to load the sample.  Return the list of
+    results (see process_sample()).
+
+    """
+
+    queue = SampleQueue(blank_row, cal, loc, workers, **process_options)
+    try:
+        for label in labels:
+            if before_capture is not None:
+                before_capture(label)
+            queue.capture(label)
+    except BaseException:
+        # Let the samples that were captured finish, but report why capturing
+        # stopped rather than any processing error.
+        try:
+            queue.close()
+        except Exception:
+            pass
+        raise
+    return queue.close()
@@ -0,0 +1,251 @@
+"""This code measures how long each stage of a measurement takes, using the
+simulated camera, so it runs on any computer.  The stages are:
+
+* capture: averaging frames with get_bw_image()
+* capture_window: the same, for only the window around the spectrum (see
+  roi.get_cropped_roi()), as measurements do
+* roi: extracting the spectrum from an image (and building the ROI once)
+* absorbance: log10(blank / sample)
+* plot: plot_fig() rendering a PNG
+* config: reading loc.json and cal.json
+* csv: write_csv()
+
+Each stage is timed for several resolutions (and, for capture, several frame
+counts).  For each one, the throughput, the 50th/90th/99th percentile
+latencies and the peak memory allocated (from tracemalloc) are reported.
+
+The results can be saved as a JSON baseline and compared with a later run;
+stages whose median latency grew by more than --threshold are reported as
+regressions, and the exit status is 1.
+
+The exposure of the simulated camera is locked (see exposure.py), so the
+captures don't include the 0.1 s pauses used on automatic exposure.
+Everything is run in a temporary directory, so the real loc.json, cal.json
+and dark frame are untouched.
+
+Usage:
+"python3 bench.py --save baseline.json"
+"python3 bench.py --compare baseline.json"
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from cal import get_cal
+from buffers import release_buffer
+from config import write_json_atomic
+from get_image import get_bw_image, set_backend
+from loc import get_loc
+from measure import compute_absorbance, write_csv
+from plot import plot_fig
+from roi import SpectrumROI, get_cropped_roi, get_roi
+from sim_camera import SimulatedCamera, gaussian_absorbance
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 380.0, "max" : 660.0}
+
+
+def parse_resolution(text):
+    """Turn "640x480" into (640, 480)."""
+
+    width, height = text.lower().split("x")
+    return (int(width), int(height))
+
+
+def capture(num_frames, window=None):
+    """Average num_frames frames, then give the image back to the buffer pool
+    the way measurements do."""
+
+    release_buffer(get_bw_image(num_frames, window=window))
+
+
+def measure(function, repeats, work=1):
+    """Time repeats calls of function, then call it once more under
+    tracemalloc.
+
+    Parameters
+    ----------
+    function : function
+        Called with no arguments.
+    repeats : int
+        The number of timed calls.
+    work : int
+        How many items (e.g. frames) one call processes, for the throughput.
+
+    Returns
+    -------
+    dictionary
+        Latency percentiles and mean (ms), throughput (items per second) and
+        peak memory (MB).
+
+    """
+
+    function()  # Warm up caches.
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        latencies[i] = time.perf_counter() - start
+
+    # tracemalloc slows Python down, so memory is measured separately.
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p90, p99 = 1000 * np.percentile(latencies, [50, 90, 99])
+    return {"repeats" : repeats,
+            "mean_ms" : 1000 * float(latencies.mean()),
+            "p50_ms" : float(p50), "p90_ms" : float(p90), "p99_ms" : float(p99),
+            "throughput_per_s" : work / float(latencies.mean()),
+            "peak_mb" : peak / 1e6}
+
+
+def bench_resolution(resolution, frame_counts, repeats, temp_dir):
+    """Run every stage at one resolution.  Return a dictionary of results
+    keyed by "stage/resolution[/frames=N]"."""
+
+    backend = SimulatedCamera(resolution=resolution, realtime=False)
+    backend.lock_exposure(backend.measure_exposure())
+    set_backend(backend)
+    loc = dict(backend.loc)
+    write_json_atomic("loc.json", loc)
+    write_json_atomic("cal.json", CAL)
+    name = "%dx%d" % resolution
+    results = {}
+
+    window, _ = get_cropped_roi(loc, backend.frame_shape)
+    for num_frames in frame_counts:
+        results["capture/%s/frames=%d" % (name, num_frames)] = measure(
+            lambda: capture(num_frames), max(repeats // num_frames, 3),
+            work=num_frames)
+        results["capture_window/%s/frames=%d" % (name, num_frames)] = measure(
+            lambda: capture(num_frames, window), max(repeats // num_frames, 3),
+            work=num_frames)
+
+    blank_image = get_bw_image()
+    backend.set_sample(gaussian_absorbance(550.0, 40.0, 0.8))
+    sample_image = get_bw_image()
+    roi = get_roi(loc, backend.frame_shape)
+    results["roi/%s" % name] = measure(lambda: roi.extract(sample_image), repeats)
+    results["roi_build/%s" % name] = measure(
+        lambda: SpectrumROI(loc, backend.frame_shape), repeats)
+
+    blank_row = roi.extract(blank_image)
+    sample_row = roi.extract(sample_image)
+    results["absorbance/%s" % name] = measure(
+        lambda: compute_absorbance(blank_row, sample_row), repeats)
+    data = compute_absorbance(blank_row, sample_row)
+
+    png_loc = os.path.join(temp_dir, "bench.png")
+    results["plot/%s" % name] = measure(
+        lambda: plot_fig(data, png_loc, CAL, "Benchmark"), max(repeats // 5, 3))
+    results["config/%s" % name] = measure(lambda: (get_loc(), get_cal()), repeats)
+    csv_loc = os.path.join(temp_dir, "bench.csv")
+    results["csv/%s" % name] = measure(lambda: write_csv(csv_loc, data, CAL), repeats)
+    return results
+
+
+def compare(results, baseline, threshold, min_change_ms):
+    """Print how each result changed from baseline.  Return the keys of the
+    results whose median latency grew by more than threshold (a fraction)
+    and by more than min_change_ms.  The second test keeps timer noise in the
+    stages that take microseconds from counting as regressions."""
+
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old = baseline[key]["p50_ms"]
+        new = results[key]["p50_ms"]
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > threshold and new - old > min_change_ms:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print("%-34s %9.3f -> %9.3f ms  %+6.1f%%%s" %
+              (key, old, new, 100 * change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time each stage of a measurement with the simulated camera.")
+    parser.add_argument("--resolutions", default="320x240,640x480,1280x960",
+                        help="comma-separated WIDTHxHEIGHT list")
+    parser.add_argument("--frames", default="1,5,20",
+                        help="comma-separated frame counts for the capture stage")
+    parser.add_argument("--repeats", type=int, default=50,
+                        help="timed calls per stage")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the results with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="median slowdown (fraction) counted as a regression")
+    parser.add_argument("--min-change-ms", type=float, default=0.05,
+                        help="smaller median slowdowns (ms) are never regressions")
+    args = parser.parse_args(argv)
+
+    resolutions = [parse_resolution(text) for text in args.resolutions.split(",")]
+    frame_counts = [int(text) for text in args.frames.split(",")]
+    # Baselines are read and written relative to where the script was started.
+    save_loc = os.path.abspath(args.save) if args.save else None
+    compare_loc = os.path.abspath(args.compare) if args.compare else None
+
+    results = {}
+    start_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            for resolution in resolutions:
+                results.update(bench_resolution(resolution, frame_counts,
+                                                args.repeats, temp_dir))
+        finally:
+            os.chdir(start_dir)
+
+    print("%-34s %9s %9s %9s %12s %9s" %
+          ("stage", "p50 ms", "p90 ms", "p99 ms", "per second", "peak MB"))
+    for key in sorted(results):
+        result = results[key]
+        print("%-34s %9.3f %9.3f %9.3f %12.1f %9.2f" %
+              (key, result["p50_ms"], result["p90_ms"], result["p99_ms"],
+               result["throughput_per_s"], result["peak_mb"]))
+
+    if save_loc is not None:
+        write_json_atomic(save_loc, {
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+            "machine" : platform.machine(),
+            "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results" : results})
+        print("Saved %s" % save_loc)
+
+    if compare_loc is not None:
+        with open(compare_loc) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        print()
+        regressions = compare(results, baseline, args.threshold,
+                              args.min_change_ms)
+        if regressions:
+            print("%d regression(s)." % len(regressions))
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
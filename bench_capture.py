@@ -0,0 +1,58 @@
+"""This code compares the speed of the two grayscale capture paths in
+get_image.py: the original one that saves bw.png and reads it back, and the
+in-memory YUV one.  It must be run on the Pi.  Usage:
+"python3 bench_capture.py [repeats]".
+
+This software is licensed under the MIT license.
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from get_image import get_bw_image, get_bw_image_png
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def time_function(function, repeats):
+    """Call function repeats times.  Return the last result and a numpy array
+    of the durations in seconds."""
+
+    durations = np.empty(repeats)
+    result = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        durations[i] = time.perf_counter() - start
+    return result, durations
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    # The first capture of each kind pays for the camera switching modes.
+    get_bw_image_png()
+    get_bw_image()
+
+    image_png, durations_png = time_function(get_bw_image_png, repeats)
+    image_yuv, durations_yuv = time_function(get_bw_image, repeats)
+
+    for name, durations in (("png round-trip", durations_png),
+                            ("in-memory yuv", durations_yuv)):
+        print("%-15s mean %.3f s  min %.3f s  max %.3f s" %
+              (name, durations.mean(), durations.min(), durations.max()))
+    print("speedup: %.1fx" % (durations_png.mean() / durations_yuv.mean()))
+
+    # The two paths measure different frames, so only a rough agreement is
+    # expected.
+    difference = np.abs(image_png.astype(np.int16) - image_yuv.astype(np.int16))
+    print("shape png %s, yuv %s" % (image_png.shape, image_yuv.shape))
+    print("mean absolute difference between the images: %.2f" % difference.mean())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""This code measures how long it takes to graph a measurement and get the
+graph ready for the GUI, and how much memory that uses over many
+measurements.  It compares the original approach (a new pyplot figure saved to
+out.png and read back) with the reused figure in plot.py.  It doesn't need
+the camera.  Usage: "python3 bench_plot.py [measurements]".
+
+This software is licensed under the MIT license.
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from PIL import Image
+
+from plot import render_fig
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def legacy_render(data, cal, data_title, out_file_loc):
+    """The original plot_fig, followed by reading the file back like the
+    Finish windows did."""
+
+    fig = plt.figure()
+    plt.title(data_title)
+    xticks_locs = np.arange(0, len(data)+1, len(data)/5)
+    xticks_labels_array = np.linspace(cal["min"], cal["max"], 6)
+    xticks_labels_list = []
+    for label in xticks_labels_array:
+        xticks_labels_list.append("%.2f" % round(label, 2))
+    plt.xticks(xticks_locs, labels=xticks_labels_list)
+    plt.xlabel("Wavelength (nm)")
+    plt.ylabel("Absorbance")
+    plt.plot(data)
+    fig.savefig(out_file_loc)
+    image = Image.open(out_file_loc)
+    image.load()
+    return image
+
+
+def run(name, function, num_measurements):
+    """Render num_measurements random spectra.  Print the latency and the
+    memory that is still allocated at the end."""
+
+    rng = np.random.default_rng(0)
+    cal = {"min" : 380.0, "max" : 660.0}
+    latencies = np.empty(num_measurements)
+    tracemalloc.start()
+    function(rng.random(116), cal, "warm up")
+    baseline, _ = tracemalloc.get_traced_memory()
+    for i in range(num_measurements):
+        data = rng.random(116)
+        start = time.perf_counter()
+        function(data, cal, "Measurement %d" % i)
+        latencies[i] = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-8s mean %.1f ms  p95 %.1f ms  retained %.1f MB  peak %.1f MB  "
+          "open pyplot figures %d" %
+          (name, 1000 * latencies.mean(), 1000 * np.percentile(latencies, 95),
+           (current - baseline) / 1e6, peak / 1e6, len(plt.get_fignums())))
+
+
+def main():
+    num_measurements = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    # The original approach leaks figures on purpose; don't warn about it.
+    plt.rcParams["figure.max_open_warning"] = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        out_file_loc = os.path.join(temp_dir, "out.png")
+        run("original", lambda data, cal, title:
+            legacy_render(data, cal, title, out_file_loc), num_measurements)
+    plt.close("all")
+    run("reused", render_fig, num_measurements)
+
+
+if __name__ == "__main__":
+    main()
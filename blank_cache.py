@@ -0,0 +1,185 @@
+"""This code lets a blank be reused for several samples.  It is used by gui.py
+and measure.py.
+
+A blank is cached together with the calibration and location it was measured
+with, and it expires after a time limit.  Before it is reused, a few frames
+of the blank (CHECK_FRAMES) are averaged and compared with the cached one.
+If the LED or the sensor has drifted too much, a full blank is measured
+instead.
+
+The shared cache is saved in blank_cache.json, so that a blank can also be
+reused by the next run of measure.py.
+
+This software is licensed under the MIT license.
+
+"""
+
+import json
+import time
+
+import numpy as np
+
+from config import write_json_atomic
+from metrics import count
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# Seconds a blank may be reused for.
+BLANK_TTL = 600.0
+# The number of frames averaged for the check.  A single frame is too noisy:
+# on its own, its drift from an unchanged blank can exceed DRIFT_THRESHOLD.
+CHECK_FRAMES = 4
+# The largest relative change between the cached blank and the check
+# capture before the blank is measured again.
+DRIFT_THRESHOLD = 0.02
+
+
+def blank_drift(cached_row, check_row):
+    """Return how much a blank has changed, as a fraction.
+
+    This is the larger of the change in total brightness (LED drift) and the
+    median change of the individual points (a change in shape).  Only the
+    points that are at least 10% as bright as the brightest point are used,
+    because the dark ends of the spectrum are mostly noise.
+
+    """
+
+    cached_row = np.asarray(cached_row, dtype=np.float64)
+    check_row = np.asarray(check_row, dtype=np.float64)
+    bright = cached_row >= 0.1 * cached_row.max()
+    if not np.any(bright):
+        return np.inf
+    cached_bright = cached_row[bright]
+    check_bright = check_row[bright]
+    brightness_change = abs(check_bright.sum() / cached_bright.sum() - 1)
+    shape_change = np.median(np.abs(check_bright - cached_bright) / cached_bright)
+    return float(max(brightness_change, shape_change))
+
+
+class BlankCache():
+    """Cache of the most recent blank for each calibration and location.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a blank may be reused for.  0 disables reuse.
+    drift_threshold : float
+        The largest drift (see blank_drift()) at which a blank is still reused.
+    file_loc : string, optional
+        A JSON file to save the cache in.  If None, the cache only lasts as
+        long as the program.
+
+    """
+
+    def __init__(self, ttl=BLANK_TTL, drift_threshold=DRIFT_THRESHOLD, file_loc=None):
+        self.ttl = ttl
+        self.drift_threshold = drift_threshold
+        self.file_loc = file_loc
+        self._blanks = {}
+        self.last_drift = None
+        if file_loc is not None:
+            self._load()
+
+    @staticmethod
+    def key(cal, loc):
+        """Return a string identifying a calibration and location."""
+
+        return json.dumps([cal.get("version"),
+                           cal.get("coeffs", [cal["min"], cal["max"]]),
+                           sorted(loc.items())])
+
+    def _load(self):
+        try:
+            with open(self.file_loc, "r") as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        for key, (saved_time, row) in saved.items():
+            self._blanks[key] = (saved_time, np.array(row))
+
+    def _save(self):
+        if self.file_loc is not None:
+            saved = {key : (saved_time, row.tolist())
+                     for key, (saved_time, row) in self._blanks.items()}
+            write_json_atomic(self.file_loc, saved)
+
+    def store(self, cal, loc, blank_row):
+        """Remember a freshly measured blank."""
+
+        now = time.time()
+        # Expired blanks are never used again, so drop them.
+        self._blanks = {key : entry for key, entry in self._blanks.items()
+                        if now - entry[0] <= self.ttl}
+        self._blanks[self.key(cal, loc)] = (now, np.array(blank_row))
+        self._save()
+
+    def clear(self):
+        self._blanks.clear()
+        self._save()
+
+    def lookup(self, cal, loc):
+        """Return (age in seconds, blank row) of an unexpired cached blank, or
+        None."""
+
+        entry = self._blanks.get(self.key(cal, loc))
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age > self.ttl:
+            return None
+        return age, entry[1]
+
+    def get_blank(self, cal, loc, capture_full, capture_check, force=False):
+        """Return a blank, reusing the cached one if it is still good.
+
+        Parameters
+        ----------
+        cal : dictionary
+            The current calibration.
+        loc : dictionary
+            The current location of the spectrum.
+        capture_full : function
+            Called with loc; measures a full (averaged) blank and returns its
+            row.
+        capture_check : function
+            Called with loc; quickly captures CHECK_FRAMES frames of the blank
+            and returns their averaged row.
+        force : bool
+            If True, always measure a new blank.
+
+        Returns
+        -------
+        numpy array
+            The blank row.
+        bool
+            True if the cached blank was reused.
+
+        """
+
+        self.last_drift = None
+        cached = None if force else self.lookup(cal, loc)
+        if cached is not None:
+            _, cached_row = cached
+            self.last_drift = blank_drift(cached_row, capture_check(loc))
+            if self.last_drift <= self.drift_threshold:
+                count("blanks_reused")
+                return cached_row, True
+            # The blank has drifted, so it is measured again.
+            count("blank_retries")
+        blank_row = capture_full(loc)
+        self.store(cal, loc, blank_row)
+        return blank_row, False
+
+
+_blank_cache = None
+
+
+def get_blank_cache():
+    """Return the shared BlankCache, creating it the first time."""
+
+    global _blank_cache
+    if _blank_cache is None:
+        _blank_cache = BlankCache(file_loc="blank_cache.json")
+    return _blank_cache
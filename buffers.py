@@ -0,0 +1,114 @@
+"""This code contains the frame buffer pool used by get_image.py.
+
+Capturing used to allocate new arrays for every image: the color image, the
+running sum of the frames and the averaged image.  At 640x480, that is a few
+megabytes per measurement, which the Pi's small memory bandwidth notices.
+The pool keeps arrays that have been given back and hands them out again, so
+after the first few measurements, capturing allocates nothing.
+
+An array from acquire() belongs to the caller until it is passed to
+release().  The pool only keeps weak references to the arrays it has handed
+out, so arrays that are never released are simply garbage collected.
+
+This software is licensed under the MIT license.
+
+"""
+
+import threading
+import weakref
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# The number of free arrays of each shape and type that are kept.
+MAX_FREE = 4
+
+
+class BufferPool():
+    """Reusable numpy arrays, grouped by shape and type.
+
+    Parameters
+    ----------
+    max_free : int
+        At most this many free arrays of each shape and type are kept.  More
+        than that are dropped when they are released.
+
+    """
+
+    def __init__(self, max_free=MAX_FREE):
+        self.max_free = max_free
+        self._free = {}
+        # The arrays that are handed out, by id, so that an array is never
+        # released twice (or released without having been acquired).  The
+        # references are weak, so an array that is dropped instead of released
+        # disappears from here too.
+        self._in_use = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    @staticmethod
+    def _key(shape, dtype):
+        return (tuple(shape), np.dtype(dtype).str)
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Return an array of the given shape and type.  Its contents are
+        whatever was left in it."""
+
+        key = self._key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                self.reuses += 1
+            else:
+                array = np.empty(key[0], dtype=key[1])
+                self.allocations += 1
+            self._in_use[id(array)] = array
+        return array
+
+    @property
+    def outstanding(self):
+        """The number of arrays handed out that haven't been released or
+        garbage collected."""
+        return len(self._in_use)
+
+    def zeros(self, shape, dtype=np.uint8):
+        """Return an array of the given shape and type, filled with 0."""
+
+        array = self.acquire(shape, dtype)
+        array.fill(0)
+        return array
+
+    def release(self, array):
+        """Give back an array from acquire().  It mustn't be used afterwards.
+        Anything else (e.g. a view of the array) raises ValueError."""
+
+        with self._lock:
+            if self._in_use.pop(id(array), None) is not array:
+                raise ValueError("The array didn't come from this pool.")
+            free = self._free.setdefault(self._key(array.shape, array.dtype), [])
+            if len(free) < self.max_free:
+                free.append(array)
+
+    def clear(self):
+        """Drop the free arrays."""
+
+        with self._lock:
+            self._free.clear()
+
+
+_pool = BufferPool()
+
+def get_buffer_pool():
+    """Return the pool shared by all captures."""
+    return _pool
+
+def release_buffer(array):
+    """Give back an image from get_image.py to the shared pool once it is no
+    longer needed.  Releasing it is optional."""
+
+    _pool.release(array)
@@ -1,25 +1,79 @@
 """This code contains functions called by gui.py.
 
+Every calibration is a numbered profile.  The current profile is stored in
+cal.json, and a copy of each profile is kept in the cal_profiles directory
+so that old measurements can be matched with the calibration they used.
+
 This software is licensed under the MIT license.
 
 """
 
+import os
+
+from numpy.polynomial import polynomial
 
-import json
+from config import ConfigStore, write_json_atomic
 
 __author__ = "Daniel James Evans"
 __copyright__ = "Copyright 2019, Daniel James Evans"
 __license__ = "MIT"
 
+_cal_store = ConfigStore("cal.json")
+CAL_PROFILE_DIR = "cal_profiles"
+# Settings that aren't part of the wavelength calibration.  A new profile
+# keeps them unless it sets them itself.
+KEPT_KEYS = ("exposure", "quant")
+
+def _profile_loc(version):
+    return os.path.join(CAL_PROFILE_DIR, "cal_v%d.json" % version)
+
+def save_cal_profile(dict_cal):
+    """Save dict_cal as a new calibration profile and make it the current one.
+    Return its version number."""
+    try:
+        current = get_cal()
+    except (OSError, ValueError):
+        current = {}
+    version = current.get("version", 0) + 1
+    dict_cal = dict(dict_cal)
+    for key in KEPT_KEYS:
+        if key in current and key not in dict_cal:
+            dict_cal[key] = current[key]
+    dict_cal["version"] = version
+    os.makedirs(CAL_PROFILE_DIR, exist_ok=True)
+    write_json_atomic(_profile_loc(version), dict_cal)
+    _cal_store.write(dict_cal)
+    return version
+
 def set_cal(new_min, new_max):
     """Update cal.json with new values."""
     dict_cal = {"min" : new_min, "max" : new_max}
-    with open("cal.json", "w") as cal_file:
-        cal_file.truncate()
-        json.dump(dict_cal, cal_file)
+    return save_cal_profile(dict_cal)
+
+def set_cal_coeffs(coeffs):
+    """Update cal.json with a polynomial calibration (see wavelength.py).  The
+    "min" and "max" are also saved, for code that only uses those."""
+    coeffs = [float(coeff) for coeff in coeffs]
+    dict_cal = {"min" : float(polynomial.polyval(0.0, coeffs)),
+                "max" : float(polynomial.polyval(1.0, coeffs)),
+                "coeffs" : coeffs}
+    return save_cal_profile(dict_cal)
 
 def get_cal():
-    """Read cal.json, and return its contents as a dictionary."""
-    with open("cal.json", "r") as cal_file:
-        dict_cal = json.load(cal_file)
-        return dict_cal
+    """Read cal.json, and return its contents as a dictionary.  The file is
+    only parsed again if it has changed."""
+    return _cal_store.read()
+
+def get_cal_profile(version):
+    """Return the calibration profile with the given version number."""
+    return ConfigStore(_profile_loc(version)).read()
+
+def list_cal_versions():
+    """Return a sorted list of the saved calibration profile versions."""
+    if not os.path.isdir(CAL_PROFILE_DIR):
+        return []
+    versions = []
+    for name in os.listdir(CAL_PROFILE_DIR):
+        if name.startswith("cal_v") and name.endswith(".json"):
+            versions.append(int(name[len("cal_v"):-len(".json")]))
+    return sorted(versions)
@@ -0,0 +1,204 @@
+"""This code contains the camera backends used by get_image.py.
+
+A backend hides the camera and the LED behind a few methods, so the rest of
+the code doesn't care whether it is talking to a real Pi camera or to the
+simulated spectrophotometer in sim_camera.py.
+
+This software is licensed under the MIT license.
+
+"""
+
+import time
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+class CameraBackend():
+    """Base class for camera backends.
+
+    Subclasses must set self.resolution to a (width, height) tuple and
+    implement capture_rgb(), capture_luma() and stream_luma().  The LED
+    methods do nothing by default.
+
+    """
+
+    resolution = (640, 480)
+    # The locked exposure settings (a dictionary), or None while the camera
+    # is on automatic exposure.
+    exposure_settings = None
+
+    @property
+    def frame_shape(self):
+        """The (rows, columns) of a captured frame."""
+        return (self.resolution[1], self.resolution[0])
+
+    def warm_up(self):
+        """Wait until the camera is ready to capture."""
+
+    def led_on(self):
+        """Turn on the light source."""
+
+    def led_off(self):
+        """Turn off the light source."""
+
+    @property
+    def exposure_locked(self):
+        """True if the exposure settings are fixed."""
+        return self.exposure_settings is not None
+
+    def measure_exposure(self):
+        """Return the settings that automatic exposure has chosen, as a
+        dictionary that can be passed to lock_exposure() and saved as JSON.
+        Return None if the camera can't lock its exposure."""
+        return None
+
+    def lock_exposure(self, settings):
+        """Fix the shutter speed, ISO and gains to settings (from
+        measure_exposure())."""
+
+    def unlock_exposure(self):
+        """Go back to automatic exposure and white balance."""
+        self.exposure_settings = None
+
+    def capture_rgb(self, output):
+        """Capture a color image into output, a (rows, columns, 3) uint8 array."""
+        raise NotImplementedError
+
+    def capture_luma(self, window=None):
+        """Capture a grayscale image.  Return a 2D uint8 array.
+
+        The array may be a view of a buffer owned by the backend; it is only
+        valid until the next capture.  If window (a tuple of slices, see
+        roi.SpectrumROI.crop_window()) is given, only that part of the image
+        is returned, and the backend may skip the rest.
+
+        """
+        raise NotImplementedError
+
+    def stream_luma(self, window=None):
+        """Yield grayscale images continuously, as fast as the camera allows.
+
+        Each yielded array is only valid until the next one is requested.
+        window is the same as for capture_luma().
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the camera."""
+
+
+class PiCameraBackend(CameraBackend):
+    """Backend for the Raspberry Pi camera, with the LED on GPIO pin 4.
+
+    Parameters
+    ----------
+    resolution : tuple of int
+        (width, height) of the images.
+    framerate : int
+        Frame rate of the camera's video port.
+    led_pin : int
+        GPIO pin of the LED.
+
+    """
+
+    def __init__(self, resolution=(640, 480), framerate=24, led_pin=4):
+        # These are imported here so that the module can be imported on
+        # computers that aren't Pis.
+        from picamera.array import raw_resolution
+        from picamera import PiCamera
+        from gpiozero import LED
+
+        self.camera = PiCamera()
+        self.camera.resolution = resolution
+        self.camera.framerate = framerate
+        self.resolution = tuple(resolution)
+        self.led = LED(led_pin)
+        # The camera needs half a second to warm up.  Instead of sleeping
+        # here, the first capture waits for whatever is left of it.
+        self._ready_time = time.monotonic() + 0.5
+
+        # The camera pads YUV frames to a multiple of 32 columns and 16 rows.
+        # The luma (Y) plane comes first, followed by the quarter-size U and V
+        # planes.
+        yuv_width, yuv_height = raw_resolution(self.camera.resolution)
+        self._yuv_buffer = np.empty(yuv_width * yuv_height * 3 // 2, dtype=np.uint8)
+        luma_plane = self._yuv_buffer[:yuv_width * yuv_height].reshape(yuv_height,
+                                                                       yuv_width)
+        self._luma = luma_plane[:resolution[1], :resolution[0]]
+
+    def _wait_until_ready(self):
+        delay = self._ready_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def warm_up(self):
+        self._wait_until_ready()
+
+    def led_on(self):
+        self.led.on()
+
+    def led_off(self):
+        self.led.off()
+
+    def measure_exposure(self, settle_time=2.0):
+        self.unlock_exposure()
+        time.sleep(settle_time)
+        camera = self.camera
+        return {"shutter_speed" : int(camera.exposure_speed),
+                "iso" : int(camera.iso),
+                "analog_gain" : float(camera.analog_gain),
+                "digital_gain" : float(camera.digital_gain),
+                "awb_gains" : [float(gain) for gain in camera.awb_gains]}
+
+    def lock_exposure(self, settings, settle_time=2.0):
+        camera = self.camera
+        camera.iso = settings["iso"]
+        camera.shutter_speed = settings["shutter_speed"]
+        camera.awb_mode = "off"
+        camera.awb_gains = tuple(settings["awb_gains"])
+        try:
+            # Newer firmware lets the gains be set directly.
+            camera.analog_gain = settings["analog_gain"]
+            camera.digital_gain = settings["digital_gain"]
+        except AttributeError:
+            # Otherwise, let automatic exposure settle at the fixed ISO and
+            # shutter speed before freezing the gains.
+            time.sleep(settle_time)
+        camera.exposure_mode = "off"
+        self.exposure_settings = dict(settings)
+
+    def unlock_exposure(self):
+        self.camera.shutter_speed = 0
+        self.camera.exposure_mode = "auto"
+        self.camera.awb_mode = "auto"
+        self.exposure_settings = None
+
+    def capture_rgb(self, output):
+        self._wait_until_ready()
+        self.camera.capture(output, "rgb")
+
+    # The camera's zoom could crop on the sensor, but it scales the cropped
+    # area up to the full resolution, which would change the pixels that loc
+    # refers to.  So the whole frame is captured into the same buffer, and a
+    # window is just a view of it.
+
+    def capture_luma(self, window=None):
+        self._wait_until_ready()
+        self.camera.capture(self._yuv_buffer, "yuv")
+        return self._luma if window is None else self._luma[window]
+
+    def stream_luma(self, window=None):
+        self._wait_until_ready()
+        luma = self._luma if window is None else self._luma[window]
+        for _ in self.camera.capture_continuous(self._yuv_buffer, "yuv",
+                                                use_video_port=True):
+            yield luma
+
+    def close(self):
+        self.led.close()
+        self.camera.close()
@@ -0,0 +1,149 @@
+"""This code contains the configuration store used by loc.py and cal.py, and
+the helpers that other modules use to write files atomically (write_atomic())
+and to reload files only when they change (FileCache).
+
+This software is licensed under the MIT license.
+
+"""
+
+import copy
+import errno
+import json
+import os
+import tempfile
+import threading
+
+from metrics import count, span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def write_atomic(file_loc, write, mode="wb"):
+    """Write a file without ever leaving a partly written file.
+
+    write(file) is called with a temporary file in the same directory, opened
+    with mode.  The file is flushed to disk and then renamed over file_loc.
+    Renaming is atomic, so a crash leaves either the old file or the new one.
+
+    """
+
+    directory = os.path.dirname(os.path.abspath(file_loc))
+    temp_fd, temp_loc = tempfile.mkstemp(dir=directory, prefix=".tmp-",
+                                         suffix=os.path.splitext(file_loc)[1])
+    try:
+        with os.fdopen(temp_fd, mode) as temp_file:
+            write(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_loc, file_loc)
+    except BaseException:
+        if os.path.exists(temp_loc):
+            os.remove(temp_loc)
+        raise
+
+def write_json_atomic(file_loc, contents):
+    """Write contents to a JSON file without ever leaving a partly written file
+    (see write_atomic())."""
+
+    write_atomic(file_loc, lambda json_file: json.dump(contents, json_file), mode="w")
+
+
+def file_key(file_loc):
+    """Return a key that changes whenever file_loc changes on disk: its
+    absolute path, modification time, size and inode.  Raise OSError if it
+    doesn't exist."""
+
+    stat = os.stat(file_loc)
+    return (os.path.abspath(file_loc), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class FileCache():
+    """The object loaded from the most recently used file, loaded again only
+    if the file changes (see file_key()).  It may be used from several
+    threads.
+
+    Parameters
+    ----------
+    load : function
+        Called as load(file_loc) to load the object.
+
+    """
+
+    def __init__(self, load):
+        self.load = load
+        self._key = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self, file_loc):
+        """Return the object loaded from file_loc, or None if the file doesn't
+        exist."""
+
+        try:
+            key = file_key(file_loc)
+        except OSError:
+            return None
+        with self._lock:
+            if key != self._key:
+                self._value = self.load(file_loc)
+                self._key = key
+            return self._value
+
+    def put(self, file_loc, value):
+        """Remember that value was just written to file_loc, so it isn't
+        loaded again."""
+
+        key = file_key(file_loc)
+        with self._lock:
+            self._value = value
+            self._key = key
+
+
+class ConfigStore():
+    """A JSON file holding a dictionary, cached in memory (see FileCache).
+
+    read() only parses the file again if it has changed on disk (its
+    modification time, size or inode is different), so repeated reads cost a
+    single os.stat() call and a copy.  write() replaces the file atomically.
+
+    Parameters
+    ----------
+    file_loc : string
+        The path of the JSON file.
+
+    """
+
+    def __init__(self, file_loc):
+        self.file_loc = file_loc
+        self._cache = FileCache(self._parse)
+
+    @staticmethod
+    def _parse(file_loc):
+        count("config_parses")
+        with open(file_loc, "r") as config_file:
+            return json.load(config_file)
+
+    def read(self):
+        """Return the contents of the file as a dictionary.  Raise OSError if
+        it doesn't exist.
+
+        A new (deep) copy is returned each time, so callers may change it,
+        including the dictionaries and lists inside it, without affecting the
+        cache.
+
+        """
+
+        contents = self._cache.get(self.file_loc)
+        if contents is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    self.file_loc)
+        return copy.deepcopy(contents)
+
+    def write(self, contents):
+        """Replace the contents of the file with the dictionary contents."""
+
+        with span("persist_config"):
+            write_json_atomic(self.file_loc, contents)
+        self._cache.put(self.file_loc, copy.deepcopy(contents))
@@ -0,0 +1,229 @@
+"""This code contains functions called by gui.py.
+
+On automatic exposure, the camera may pick a different shutter speed or gain
+for the blank than for the sample, which shows up as a baseline offset.  Here
+the exposure is locked once: the settings chosen by automatic exposure (with
+the LED on) are fixed and saved in the calibration (the "exposure" entry of
+cal.json), so they are the same every session.
+
+While the exposure is locked, a dark frame (the image with the LED off) is
+kept and subtracted from every averaged image.  It is only captured again if
+the exposure settings or the resolution change; it is saved in
+dark_frame.npz so it survives restarts.  The dark frame is streamed (on the
+Pi, from the video port), and every image it is subtracted from is streamed
+too, because the still port has different gain and denoising.
+
+Usage: "python3 exposure.py lock", "python3 exposure.py unlock" or
+"python3 exposure.py show".
+
+This software is licensed under the MIT license.
+
+"""
+
+import json
+import sys
+import threading
+
+import numpy as np
+
+from accumulate import FrameAccumulator
+from cal import get_cal, save_cal_profile
+from config import write_atomic
+from metrics import span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+DARK_FILE = "dark_frame.npz"
+# The number of frames averaged for the dark frame.
+DARK_FRAMES = 16
+# How the frames are captured: see CameraBackend.stream_luma().  Dark frames
+# saved by a different method are captured again.
+DARK_SOURCE = "stream"
+
+
+def get_exposure_profile():
+    """Return the saved exposure settings, or None if the exposure isn't
+    locked."""
+
+    try:
+        return get_cal().get("exposure")
+    except (OSError, ValueError):
+        return None
+
+def apply_saved_exposure(backend):
+    """Lock backend's exposure to the saved settings, if there are any.
+    Return the settings."""
+
+    settings = get_exposure_profile()
+    if settings is not None:
+        backend.lock_exposure(settings)
+    return settings
+
+def lock_exposure(backend):
+    """Let automatic exposure choose settings with the LED on, then lock them
+    and save them in the calibration.  Return the settings, or None if the
+    camera can't lock its exposure."""
+
+    backend.led_on()
+    try:
+        settings = backend.measure_exposure()
+    finally:
+        backend.led_off()
+    if settings is None:
+        return None
+    backend.lock_exposure(settings)
+    cal = get_cal()
+    cal["exposure"] = settings
+    save_cal_profile(cal)
+    return settings
+
+def unlock_exposure(backend):
+    """Go back to automatic exposure, and remove the settings from the
+    calibration."""
+
+    backend.unlock_exposure()
+    cal = get_cal()
+    if cal.get("exposure") is not None:
+        cal["exposure"] = None
+        save_cal_profile(cal)
+
+def subtract_dark(image, dark, out=None):
+    """Return image - dark, clipped at 0, for uint8 arrays of the same shape.
+
+    Subtracting min(image, dark) instead of dark keeps the result from
+    wrapping around without converting to a wider type.
+
+    """
+
+    return np.subtract(image, np.minimum(image, dark), out=out)
+
+
+class DarkFrame():
+    """The averaged image with the LED off, for the current exposure settings.
+
+    Parameters
+    ----------
+    file_loc : string, optional
+        Where the dark frame is saved.  None keeps it only in memory.
+    num_frames : int
+        The number of frames to average.
+
+    """
+
+    def __init__(self, file_loc=None, num_frames=DARK_FRAMES):
+        self.file_loc = file_loc
+        self.num_frames = num_frames
+        self._key = None
+        self._frame = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(settings, shape):
+        """Return the string that identifies the conditions of a dark frame."""
+        return json.dumps({"exposure" : settings, "shape" : list(shape),
+                           "source" : DARK_SOURCE}, sort_keys=True)
+
+    def _load(self):
+        if self.file_loc is None:
+            return
+        try:
+            with np.load(self.file_loc) as contents:
+                self._key = str(contents["key"])
+                self._frame = contents["frame"]
+        except (OSError, KeyError, ValueError):
+            self._key = None
+            self._frame = None
+
+    def _save(self):
+        if self.file_loc is None:
+            return
+        write_atomic(self.file_loc, lambda npz_file: np.savez(
+            npz_file, key=np.array(self._key), frame=self._frame))
+
+    def capture(self, backend, cancel=None):
+        """Capture and return a new dark frame.  The LED must be off.  The
+        frames are streamed, like the images it is subtracted from."""
+
+        accumulator = FrameAccumulator(backend.frame_shape, roi=(0, 0))
+        frames = backend.stream_luma()
+        try:
+            for _ in range(self.num_frames):
+                if cancel is not None and cancel.is_set():
+                    return None
+                accumulator.add(next(frames))
+        finally:
+            frames.close()
+        return accumulator.average()
+
+    def get(self, backend, cancel=None):
+        """Return the dark frame for backend's current settings, capturing it
+        if necessary.  Return None if backend's exposure isn't locked."""
+
+        if not backend.exposure_locked:
+            return None
+        key = self.key(backend.exposure_settings, backend.frame_shape)
+        with self._lock:
+            if key != self._key:
+                with span("dark_frame"):
+                    frame = self.capture(backend, cancel)
+                if frame is None:
+                    return None
+                self._key = key
+                self._frame = frame
+                self._save()
+            return self._frame
+
+    def clear(self):
+        with self._lock:
+            self._key = None
+            self._frame = None
+
+
+_dark_frame = None
+
+def get_dark_frame(backend, cancel=None):
+    """Return the dark frame for backend (see DarkFrame.get()).  Call this
+    while the LED is off."""
+
+    global _dark_frame
+    if _dark_frame is None:
+        _dark_frame = DarkFrame(DARK_FILE)
+    return _dark_frame.get(backend, cancel)
+
+def set_dark_frame(dark_frame):
+    """Use dark_frame (a DarkFrame) for all captures from now on, instead of
+    the one saved in DARK_FILE."""
+
+    global _dark_frame
+    _dark_frame = dark_frame
+
+
+def main(argv=None):
+    from get_image import get_backend
+
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "show"
+    backend = get_backend()
+    if command == "lock":
+        settings = lock_exposure(backend)
+        if settings is None:
+            print("This camera can't lock its exposure.")
+            return
+        get_dark_frame(backend)
+        print("Locked: %s" % json.dumps(settings))
+    elif command == "unlock":
+        unlock_exposure(backend)
+        print("Automatic exposure.")
+    elif command == "show":
+        settings = get_exposure_profile()
+        print("Locked: %s" % json.dumps(settings) if settings is not None
+              else "Automatic exposure.")
+    else:
+        print("Usage: python3 exposure.py [lock|unlock|show]")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,285 @@
 """This code contains functions called by gui.py.
 
+The camera is reached through a backend (see camera_backend.py).  By default
+the Pi camera is used.  Setting the environment variable SPECTRO_CAMERA=sim
+selects the simulated spectrophotometer in sim_camera.py instead, and
+set_backend() can install any other backend.
+
+The images returned are taken from the shared buffer pool (see buffers.py).
+Passing an image to buffers.release_buffer() when it is no longer needed
+lets the next capture reuse it instead of allocating a new one.
+
 This software is licensed under the MIT license.
 
 """
 
+import os
 import time
 
-from picamera.array import PiRGBArray
-from picamera import PiCamera
-from gpiozero import LED
-
 import numpy as np
 from PIL import Image
 
+from accumulate import FrameAccumulator
+from buffers import get_buffer_pool
+from exposure import apply_saved_exposure, get_dark_frame, subtract_dark
+from metrics import count, enabled, span
+
 __author__ = "Daniel James Evans"
 __copyright__ = "Copyright 2019, Daniel James Evans"
 __license__ = "MIT"
 
-camera = PiCamera()
-camera.resolution = (640, 480)
-camera.framerate = 24
-time.sleep(0.5)
+_backend = None
+
+
+class CaptureCancelled(Exception):
+    """Raised when a capture is stopped by its cancel event."""
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        count("captures_cancelled")
+        raise CaptureCancelled()
+
+def _count_frame(frame):
+    """Update the frame counters for a captured frame (or the part of it that
+    matters)."""
+
+    count("frames_captured")
+    if enabled():
+        count("saturated_pixels", int(np.count_nonzero(frame == 255)))
+
+
+def get_backend():
+    """Return the camera backend, creating it the first time."""
+
+    global _backend
+    if _backend is None:
+        if os.environ.get("SPECTRO_CAMERA", "pi") == "sim":
+            from sim_camera import SimulatedCamera
+            # Draw the simulated spectrum where loc.json says it is.
+            try:
+                from loc import get_loc
+                sim_loc = get_loc()
+            except (OSError, ValueError):
+                sim_loc = None
+            _backend = SimulatedCamera(loc=sim_loc)
+        else:
+            from camera_backend import PiCameraBackend
+            _backend = PiCameraBackend()
+        apply_saved_exposure(_backend)
+    return _backend
+
+def set_backend(backend):
+    """Use backend for all captures from now on."""
+
+    global _backend
+    _backend = backend
+
+
+def warm_up(progress=None, cancel=None):
+    """Create the backend and wait until the camera is ready, so the first
+    measurement doesn't have to.  It is run in the background when the GUI
+    starts."""
+
+    _check_cancel(cancel)
+    get_backend().warm_up()
+
+def _window_shape(frame_shape, window):
+    """Return the (rows, columns) of window (a tuple of slices) of a frame."""
+
+    if window is None:
+        return tuple(frame_shape)
+    return tuple(len(range(*part.indices(size))) for part, size in zip(window,
+                                                                        frame_shape))
+
+def _finish_average(accumulator, dark, window):
+    """Return the average of the accumulator's frames, minus the dark frame,
+    in an array from the buffer pool, and give the accumulator's arrays
+    back."""
 
+    with span("averaging"):
+        image = accumulator.average(out=get_buffer_pool().acquire(accumulator.shape))
+        accumulator.release()
+        if dark is not None:
+            subtract_dark(image, dark if window is None else dark[window], out=image)
+    return image
 
-def get_color_image():
-    """Take a color image using the camera.  Return as a numpy array."""
+def get_color_image(progress=None, cancel=None):
+    """Take a color image using the camera.  Return as a numpy array.
 
-    led = LED(4)
-    led.on()
+    progress and cancel are accepted so that this can be run by
+    worker.TaskRunner; see get_bw_image().  The array is from the buffer
+    pool.
 
-    output = np.empty((480, 640, 3), dtype=np.uint8)
-    camera.capture(output, "rgb")
-    led.off()
+    """
+
+    _check_cancel(cancel)
+    backend = get_backend()
+    backend.led_on()
+
+    output = get_buffer_pool().acquire(backend.frame_shape + (3,), np.uint8)
+    with span("capture_color"):
+        backend.capture_rgb(output)
+    count("frames_captured")
+    backend.led_off()
     return output
 
-def get_bw_image():
+def get_bw_image(num_frames=5, progress=None, cancel=None, window=None):
+    """Return a numpy array of a grayscale image from the camera.
+
+    The function takes multiple pictures and averages the values from
+    each picture.  This is done to reduce noise.
+
+    The pictures are captured without touching the filesystem; on the Pi,
+    only the luma (Y) plane of a YUV capture is used.  If the exposure is
+    locked (see exposure.py), the pictures are streamed back to back, like
+    the dark frame, and the dark frame is subtracted; otherwise the camera is
+    given 0.1 s between pictures to adjust its exposure.
+
+    Parameters
+    ----------
+    num_frames : int
+        The number of pictures to average.
+    progress : function, optional
+        Called as progress(fraction, message) after each picture.
+    cancel : threading.Event, optional
+        If it is set, capturing stops and CaptureCancelled is raised.
+    window : tuple of slices, optional
+        Only capture and average this part of the pictures (see
+        roi.get_cropped_roi()).  By default the whole picture is used.
+
+    Returns
+    -------
+    2D numpy array of uint8
+        The averaged image (or window), with shape (rows, columns).  It is
+        from the buffer pool.
+
+    """
+
+    backend = get_backend()
+    dark = get_dark_frame(backend, cancel)
+    shape = _window_shape(backend.frame_shape, window)
+    backend.led_on()
+
+    pool = get_buffer_pool()
+    accumulator = FrameAccumulator(shape, roi=(0, 0), pool=pool)
+    # The dark frame is streamed, so the pictures it is subtracted from must
+    # be too.
+    frames = backend.stream_luma(window) if dark is not None else None
+    try:
+        for i in range(num_frames):
+            _check_cancel(cancel)
+            if i > 0 and dark is None:
+                time.sleep(0.1)
+            with span("capture"):
+                if frames is not None:
+                    frame = next(frames)
+                else:
+                    frame = backend.capture_luma(window)
+            _count_frame(frame)
+            with span("averaging"):
+                accumulator.add(frame)
+            if progress is not None:
+                progress((i + 1) / num_frames, "Frame %d of %d" % (i + 1, num_frames))
+    except BaseException:
+        accumulator.release()
+        raise
+    finally:
+        if frames is not None:
+            frames.close()
+        backend.led_off()
+
+    # Integer division truncates the same way the old float division followed
+    # by astype(np.uint8) did.
+    return _finish_average(accumulator, dark, window)
+
+def get_bw_image_adaptive(roi, target_noise=0.5, min_frames=3, max_frames=50,
+                          progress=None, cancel=None, window=None):
+    """Return an averaged grayscale image, taking only as many frames as are
+    needed to make the spectrum quiet enough.  If the exposure is locked, the
+    dark frame is subtracted.
+
+    Frames are streamed from the camera.  After each frame, the standard
+    error of the mean over the region of interest is checked; when it drops
+    below target_noise, or after max_frames frames, capturing stops.
+
+    Parameters
+    ----------
+    roi : tuple of slices
+        Index into a frame (or into the window, if there is one) that selects
+        the spectrum.  See roi.SpectrumROI.bounding_slices().
+    target_noise : float
+        The RMS standard error of the mean (in grey levels) to stop at.
+    min_frames : int
+        Always take at least this many frames.  At least 2 are needed to
+        estimate the noise.
+    max_frames : int
+        Never take more than this many frames, even if min_frames is larger.
+        With max_frames=1, a single streamed frame is returned.
+    progress : function, optional
+        Called as progress(fraction, message) after each frame.  fraction is
+        the larger of the share of max_frames taken and how close the noise
+        is to the target.
+    cancel : threading.Event, optional
+        If it is set, capturing stops and CaptureCancelled is raised.
+    window : tuple of slices, optional
+        Only capture and average this part of the frames; see get_bw_image().
+
+    Returns
+    -------
+    2D numpy array of uint8
+        The averaged image (or window), from the buffer pool.
+    int
+        The number of frames that were averaged.
+
+    """
+
+    backend = get_backend()
+    dark = get_dark_frame(backend, cancel)
+    backend.led_on()
+
+    accumulator = FrameAccumulator(_window_shape(backend.frame_shape, window),
+                                   roi=roi, pool=get_buffer_pool())
+    min_frames = max(min_frames, 2)
+    frames = backend.stream_luma(window)
+    try:
+        while True:
+            with span("capture"):
+                frame = next(frames)
+            _check_cancel(cancel)
+            _count_frame(frame[roi])
+            with span("averaging"):
+                accumulator.add(frame)
+                noise = accumulator.noise()
+            if progress is not None:
+                fraction = max(accumulator.count / max_frames,
+                               min(target_noise / noise, 1.0) if noise > 0 else 1.0)
+                progress(fraction, "Frame %d, noise %.2f" % (accumulator.count, noise))
+            if accumulator.count >= max_frames:
+                break
+            if accumulator.count >= min_frames and noise < target_noise:
+                break
+    except BaseException:
+        accumulator.release()
+        raise
+    finally:
+        frames.close()
+        backend.led_off()
+    return _finish_average(accumulator, dark, window), accumulator.count
+
+def get_bw_image_png():
     """Return a numpy array of a grayscale image from the camera.
-    I couldn't figure out the proper way
-    to do this, so the function saves the image as bw.png.
+    This is the original implementation of get_bw_image().  The function
+    saves the image as bw.png and reads it back.  It is kept so that
+    bench_capture.py can compare it against the in-memory path.  It only
+    works with the Pi camera backend.
 
     The function takes multiple pictures and averages the values from
     each picture.  This is done to reduce noise."""
 
-    led = LED(4)
-    led.on()
+    backend = get_backend()
+    camera = backend.camera
+    backend.led_on()
 
     # I couldn't find a way for the
     # camera to pass a grayscale
@@ -82,7 +318,7 @@ def get_bw_image():
     image_arr = image_arr.astype(np.uint8)
 
     camera.color_effects = None
-    led.off()
+    backend.led_off()
 
     # Each pixel has 3 values (plus a 4th).
     # But the values are identical
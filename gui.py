@@ -7,59 +7,161 @@ This software is licensed under the MIT license.
 
 """
 
-import shutil
-import csv
 import tkinter
 import tkinter.filedialog
 
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 from PIL import Image, ImageTk
 
 from loc import get_loc, set_loc
-from cal import get_cal, set_cal
-from get_image import get_color_image, get_bw_image
+from cal import get_cal, set_cal, set_cal_coeffs
+from get_image import get_color_image, warm_up, CaptureCancelled
+from buffers import get_buffer_pool, release_buffer
+from plot import get_renderer, render_fig
+from measure import capture_row, compute_absorbance, write_csv, archive_result, get_blank
+from kinetics import KineticsRun
+from batch import SampleQueue
+from worker import TaskRunner
+from roi import get_roi
+from locate import detect_spectrum
+from wavelength import fit_coeffs, get_model
+from live import LiveSession, LiveFrame
+from library import get_library
+from quant import get_quant_model
+from postprocess import process
 
 __author__ = "Daniel James Evans"
 __copyright__ = "Copyright 2019, Daniel James Evans"
 __license__ = "MIT"
 
-def plot_fig(data, out_file_loc, cal, data_title):
-    """Graph data and save the result as an image.
+def measure_sample_result(is_cal, blank_row, data_title, progress=None, cancel=None):
+    """Capture a sample and process it.  This runs on the background worker.
 
-    The function takes a 1D array of y-values; it assumes that the x-values are evenly
-    spaced.
+    Returns
+    -------
+    tuple
+        The sample row, the absorbance spectrum, the graph (a PIL image) and
+        the analysis: a dictionary with the closest matches in the spectral
+        library under "matches" (a list of (name, score) tuples; see
+        library.py), the concentrations under "concentrations" (a list of
+        (component, concentration) tuples; see quant.py) and the peaks under
+        "peaks" (see postprocess.py).  Each is None if it isn't available.
 
-    Parameters
-    ----------
-    data : 1D list or numpy array
-        It contains the y-values of the points to be graphed.  The x-values should be
-        evenly spaced points between the min and max described in cal.
-    out_file_loc : string
-        The path of where the image should be saved to.
-    cal : dictionary
-        It contains 2 keys: "min" and "max".  The values are the minimum and maximum
-        values (float or int) of the x-axis.
-    data_title : string
-        The title of the graph.
+        Unless calibrating, the spectrum is post-processed (see
+        postprocess.py) before it is graphed and returned.  The archive, the
+        library and the concentrations use the unprocessed spectrum, like the
+        references and standards they are compared with.
 
     """
 
-    fig = plt.figure()
-    plt.title(data_title)
-    xticks_locs = np.arange(0, len(data)+1, len(data)/5)
-    xticks_step = (cal["max"] - cal["min"]) / 5
-    xticks_labels_array = np.arange(cal["min"], cal["max"]+xticks_step, step=xticks_step)
-    xticks_labels_list = []
-    for label in xticks_labels_array:
-        xticks_labels_list.append("%.2f" % round(label, 2))
-    plt.xticks(xticks_locs, labels=xticks_labels_list)
-    plt.xlabel("Wavelength (nm)")
-    plt.ylabel("Absorbance")
-    plt.plot(data)
-    fig.savefig(out_file_loc)
+    sample_row = capture_row(progress=progress, cancel=cancel)
+    data = compute_absorbance(blank_row, sample_row)
+    cal = get_cal()
+    analysis = {"matches" : None, "concentrations" : None, "peaks" : None}
+    if is_cal:
+        graph_image = render_fig(data, cal, data_title)
+    else:
+        archive_result(data_title, data, blank_row, sample_row, cal, get_loc())
+        library = get_library()
+        if library is not None and len(library) > 0:
+            try:
+                analysis["matches"] = library.match(data, cal, top_k=3)
+            except ValueError:
+                # The calibration doesn't cover the library's wavelengths.
+                pass
+        quant_model = get_quant_model(cal)
+        if quant_model is not None:
+            try:
+                analysis["concentrations"] = list(zip(
+                    quant_model.components, quant_model.concentrations(data, cal)))
+            except ValueError:
+                pass
+        data, analysis["peaks"] = process(data, cal)
+        graph_image = render_fig(data, cal, data_title)
+    return sample_row, data, graph_image, analysis
+
+
+def start_devices(progress=None, cancel=None):
+    """Start the camera and the graph renderer.  This runs on the background
+    worker when the app starts, so the menu appears without waiting for
+    them."""
+
+    warm_up(progress, cancel)
+    get_renderer()
+
+
+class TaskWindow(tkinter.Toplevel):
+    """Base class for windows that capture or process in the background.
+
+    run_task() submits a job to the application's TaskRunner (see worker.py)
+    and shows its progress in a status line with a Cancel button.  If the
+    window is closed, its task is cancelled, and callbacks for a window that
+    no longer exists are ignored.
+
+    """
+
+    def __init__(self):
+        tkinter.Toplevel.__init__(self)
+        self.task = None
+        self.status_frame = tkinter.Frame(self)
+        self.task_label = tkinter.Label(self.status_frame, text="")
+        self.task_label.pack(side=tkinter.LEFT)
+        self.cancel_button = tkinter.Button(self.status_frame, text="Cancel",
+                                            command=self.cancel_task)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+
+    def run_task(self, message, function, *args, on_done=None, **kwargs):
+        """Run function(*args, **kwargs) in the background, showing message while
+        it runs.  on_done(result) is called on the tkinter thread when it
+        finishes.
+
+        """
+
+        self.task_label.config(text=message)
+        self.cancel_button.pack(side=tkinter.LEFT)
+        self.status_frame.pack()
+
+        def done(result):
+            if self.winfo_exists():
+                self.cancel_button.pack_forget()
+                self.task_label.config(text="")
+                if on_done is not None:
+                    on_done(result)
+
+        def progress(fraction, progress_message):
+            if self.winfo_exists():
+                self.task_label.config(text="%s %d%% %s" % (message, round(100 * fraction),
+                                                           progress_message))
+
+        self.task = app.tasks.submit(function, *args, on_done=done,
+                                     on_error=self.task_failed, on_progress=progress,
+                                     **kwargs)
+        return self.task
+
+
+    def task_failed(self, error):
+        """Show why a background task stopped."""
+
+        if not self.winfo_exists():
+            return
+        self.cancel_button.pack_forget()
+        if isinstance(error, CaptureCancelled):
+            self.task_label.config(text="Cancelled.")
+        else:
+            self.task_label.config(text="Error: %s" % error)
+
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+    def close(self):
+        """Cancel any running task and close the window."""
+
+        self.cancel_task()
+        self.destroy()
 
 
 class MeasurementWindow(tkinter.Toplevel):
@@ -81,6 +183,11 @@ class MeasurementWindow(tkinter.Toplevel):
         self.button_for_blank = tkinter.Button(self, text="\t\t\t\tMeasure Blank\t\t\t\t",
                                                command=self.move_to_blank)
         self.button_for_blank.pack()
+        self.new_blank_var = tkinter.BooleanVar(self, value=False)
+        self.check_new_blank = tkinter.Checkbutton(
+            self, text="Measure a new blank even if a recent one can be reused",
+            variable=self.new_blank_var)
+        self.check_new_blank.pack()
         if is_cal:
             self.data_title = "Calibration"
         else:
@@ -112,11 +219,12 @@ class MeasurementWindow(tkinter.Toplevel):
 
         """
 
+        new_blank = self.new_blank_var.get()
         self.destroy()
-        BlankMeasWindow(self.is_cal, self.data_title)
+        BlankMeasWindow(self.is_cal, self.data_title, new_blank)
 
 
-class BlankMeasWindow(tkinter.Toplevel):
+class BlankMeasWindow(TaskWindow):
     """Window for measuring a blank.
 
     The BlankMeasWindow is created by a MeasurementWindow.  After using a BlankMeasWindow,
@@ -128,21 +236,39 @@ class BlankMeasWindow(tkinter.Toplevel):
         True if calibrating; False if taking a measurement to save.
     data_title : string
         The title of the graph to be created.
+    new_blank : bool
+        If True, always measure a new blank.  Otherwise a recent blank is
+        reused if a quick check shows that it is still good.
 
     """
 
-    def __init__(self, is_cal, data_title):
-        tkinter.Toplevel.__init__(self)
+    def __init__(self, is_cal, data_title, new_blank=False):
+        TaskWindow.__init__(self)
         self.title("Take a Measurement")
         self.is_cal = is_cal
         self.data_title = data_title
-        self.blank_array = get_bw_image()
-        loc = get_loc()
-        self.blank_row = self.blank_array[loc["y"] : loc["y"]+loc["length"], loc["x"]]
-        self.title("Take a Measurement")
+        self.blank_row = None
+        self.blank_label = tkinter.Label(self, text="")
+        self.blank_label.pack()
         self.button_for_reading = tkinter.Button(self, text="\t\tMeasure Sample\t\t",
-                                                 command=self.move_to_sample)
+                                                 command=self.move_to_sample,
+                                                 state=tkinter.DISABLED)
         self.button_for_reading.pack()
+        # The capture runs in the background; the button is enabled when it
+        # finishes.
+        self.run_task("Measuring the blank...", get_blank, force=new_blank,
+                      on_done=self.blank_done)
+
+
+    def blank_done(self, result):
+        """Called when the blank has been measured."""
+
+        self.blank_row, reused = result
+        if reused:
+            self.blank_label.config(text="A recent blank was reused.")
+        else:
+            self.blank_label.config(text="The blank has been measured.")
+        self.button_for_reading.config(state=tkinter.NORMAL)
 
 
     def move_to_sample(self):
@@ -155,7 +281,7 @@ class BlankMeasWindow(tkinter.Toplevel):
         SampleMeasWindow(self.is_cal, self.blank_row, self.data_title)
 
 
-class SampleMeasWindow(tkinter.Toplevel):
+class SampleMeasWindow(TaskWindow):
     """Window for measuring a sample.
 
     The SampleMeasWindow is created by a BlankMeasWindow.  After using a SampleMeasWindow,
@@ -173,24 +299,23 @@ class SampleMeasWindow(tkinter.Toplevel):
     """
 
     def __init__(self, is_cal, blank_row, data_title):
-        tkinter.Toplevel.__init__(self)
+        TaskWindow.__init__(self)
         self.title("Take a Measurement")
-        sample_array = get_bw_image()
-        loc = get_loc()
-        sample_row = sample_array[loc["y"] : loc["y"]+loc["length"], loc["x"]]
-        # I don't want to do math on uint8s.
-        sample_row = sample_row.astype(np.int16)
-        blank_row = blank_row.astype(np.int16)
-        data = np.log10(blank_row / sample_row)
-        # The top (low indices) is the high wavelength.
-        data = data[::-1]
-        cal = get_cal()
-        plot_fig(data, "out.png", cal, data_title)
+        self.is_cal = is_cal
+        self.blank_row = blank_row
+        self.run_task("Measuring the sample...", measure_sample_result, is_cal,
+                      blank_row, data_title, on_done=self.sample_done)
+
+
+    def sample_done(self, result):
+        """Called when the sample has been measured and processed."""
+
+        sample_row, data, graph_image, analysis = result
         self.destroy()
-        if is_cal:
-            FinishCalibrationWindow(sample_row, blank_row)
+        if self.is_cal:
+            FinishCalibrationWindow(sample_row, self.blank_row, graph_image)
         else:
-            FinishSampleWindow(data)
+            FinishSampleWindow(data, graph_image, analysis)
 
 
 class FinishCalibrationWindow(tkinter.Toplevel):
@@ -198,7 +323,9 @@ class FinishCalibrationWindow(tkinter.Toplevel):
 
     The FinishCalibrationWindow is created by a SampleMeasWindow.  It displays a
     graph, and allows the user to specify the minimum and maximum points on the
-    x-axis.
+    x-axis.  Alternatively, the user can enter several reference points (a
+    wavelength read off the graph and the true wavelength of that feature), and
+    a polynomial is fitted to them.
 
     Parameters
     ----------
@@ -206,15 +333,17 @@ class FinishCalibrationWindow(tkinter.Toplevel):
         The data points from when the sample was measured.
     blank_row : 1D list or numpy array
         The data points from when the blank was measured.
+    graph_image : PIL image
+        The graph of the measurement.
 
     """
 
-    def __init__(self, sample_row, blank_row):
+    def __init__(self, sample_row, blank_row, graph_image):
         tkinter.Toplevel.__init__(self)
         self.title("Calibrate the x axis")
         self.sample_row = sample_row
         self.blank_row = blank_row
-        self.cal_image_tk = ImageTk.PhotoImage(file="out.png")
+        self.cal_image_tk = ImageTk.PhotoImage(image=graph_image)
         self.panel_cal = tkinter.Label(self, image=self.cal_image_tk)
         self.panel_cal.image = self.cal_image_tk # Necessary b/c of garbage collector.
         self.panel_cal.pack()
@@ -238,6 +367,17 @@ class FinishCalibrationWindow(tkinter.Toplevel):
         self.cal_button = tkinter.Button(self.cal_canvas, text="Update calibration",
                                          command=self.update_cal)
         self.cal_button.pack()
+
+        ref_points_text = ("Or enter reference points as graph=true wavelength pairs,\n"
+                           "separated by commas (for example 421=415, 542=536, 670=672)")
+        self.ref_points_label = tkinter.Label(self.cal_canvas, text=ref_points_text)
+        self.ref_points_label.pack()
+        self.ref_points_entry = tkinter.Entry(self.cal_canvas, width=50)
+        self.ref_points_entry.pack()
+        self.ref_points_button = tkinter.Button(self.cal_canvas,
+                                                text="Fit calibration to reference points",
+                                                command=self.update_cal_points)
+        self.ref_points_button.pack()
         cal_end_button_text = "The graph looks correct; end calibration."
         self.cal_end_button = tkinter.Button(self.cal_canvas, text=cal_end_button_text,
                                              command=self.destroy)
@@ -254,10 +394,34 @@ class FinishCalibrationWindow(tkinter.Toplevel):
 
         min_val_entered = self.cal_min_entry.get()
         max_val_entered = self.cal_max_entry.get()
-        app.update_cal(min_val_entered, max_val_entered, self.sample_row, self.blank_row)
-        self.cal_image_tk = ImageTk.PhotoImage(file="out.png")
-        self.panel_cal.config(image=self.cal_image_tk)
-        self.panel_cal.image = self.cal_image_tk
+        graph_image = app.update_cal(min_val_entered, max_val_entered,
+                                     self.sample_row, self.blank_row)
+        self.show_graph(graph_image)
+
+
+    def update_cal_points(self):
+        """Called when the user presses the reference points button.  Fits and saves
+        a new calibration, and updates the graph on the screen.
+
+        """
+
+        graph_image = app.update_cal_points(self.ref_points_entry.get(),
+                                            self.sample_row, self.blank_row)
+        self.show_graph(graph_image)
+        if graph_image is not None:
+            self.cal_min_entry.delete(0, tkinter.END)
+            self.cal_min_entry.insert(0, "%.2f" % app.cal["min"])
+            self.cal_max_entry.delete(0, tkinter.END)
+            self.cal_max_entry.insert(0, "%.2f" % app.cal["max"])
+
+
+    def show_graph(self, graph_image):
+        """Display a new calibration graph.  Do nothing if graph_image is None."""
+
+        if graph_image is not None:
+            self.cal_image_tk = ImageTk.PhotoImage(image=graph_image)
+            self.panel_cal.config(image=self.cal_image_tk)
+            self.panel_cal.image = self.cal_image_tk
 
 
 class FinishSampleWindow(tkinter.Toplevel):
@@ -266,16 +430,46 @@ class FinishSampleWindow(tkinter.Toplevel):
     The FinishSampleWindow is created by a SampleMeasWindow.  It displays a
     graph, and allows the user to save the data if desired.
 
+    Parameters
+    ----------
+    data : 1D numpy array
+        The absorbance spectrum.
+    graph_image : PIL image
+        The graph of the absorbance spectrum.  It is only written to a file if
+        the user saves it.
+    analysis : dictionary, optional
+        The library matches and concentrations; see measure_sample_result().
+
     """
 
-    def __init__(self, data):
+    def __init__(self, data, graph_image, analysis=None):
         self.data = data
+        self.graph_image = graph_image
         tkinter.Toplevel.__init__(self)
         self.title("Take a Measurement")
-        self.preview_image_tk = ImageTk.PhotoImage(file="out.png")
+        self.preview_image_tk = ImageTk.PhotoImage(image=graph_image)
         self.panel_preview = tkinter.Label(self, image=self.preview_image_tk)
         self.panel_preview.image = self.preview_image_tk
         self.panel_preview.pack()
+        analysis = analysis or {}
+        peaks = analysis.get("peaks")
+        if peaks is not None and len(peaks["wavelength"]) > 0:
+            peaks_text = "Peaks:\n" + "\n".join(
+                "%.1f nm: absorbance %.3f, FWHM %.1f nm" % peak
+                for peak in zip(peaks["wavelength"][:5], peaks["height"][:5],
+                                peaks["fwhm"][:5]))
+            self.label_peaks = tkinter.Label(self, text=peaks_text)
+            self.label_peaks.pack()
+        if analysis.get("concentrations"):
+            concentrations_text = "Concentrations:\n" + "\n".join(
+                "%s: %.4g" % pair for pair in analysis["concentrations"])
+            self.label_concentrations = tkinter.Label(self, text=concentrations_text)
+            self.label_concentrations.pack()
+        if analysis.get("matches"):
+            matches_text = "Closest library matches:\n" + "\n".join(
+                "%s (similarity %.3f)" % pair for pair in analysis["matches"])
+            self.label_matches = tkinter.Label(self, text=matches_text)
+            self.label_matches.pack()
         label_preview_text = "Here is the result.  Do you want to save it?"
         self.label_preview = tkinter.Label(self, text=label_preview_text)
         self.label_preview.pack()
@@ -316,7 +510,7 @@ class FinishSampleWindow(tkinter.Toplevel):
         self.save_graph_toplevel.destroy()
         sample_graph_loc = tkinter.filedialog.asksaveasfilename()
         if sample_graph_loc != "":
-            shutil.copyfile("out.png", sample_graph_loc)
+            self.graph_image.save(sample_graph_loc, format="PNG")
             self.save_data_intro()
 
 
@@ -333,6 +527,11 @@ class FinishSampleWindow(tkinter.Toplevel):
         self.label_save_data = tkinter.Label(self.save_data_toplevel,
                                              text=label_save_data_text)
         self.label_save_data.pack()
+        self.resample_var = tkinter.BooleanVar(self.save_data_toplevel, value=False)
+        self.check_resample = tkinter.Checkbutton(self.save_data_toplevel,
+                                                  text="Use the common 1 nm wavelength grid",
+                                                  variable=self.resample_var)
+        self.check_resample.pack()
         self.button_save = tkinter.Button(self.save_data_toplevel,
                                           text="Select Location For CSV",
                                           command=self.save_data)
@@ -342,40 +541,333 @@ class FinishSampleWindow(tkinter.Toplevel):
     def save_data(self):
         """Ask the user where to save the csv file.  Save the file."""
 
+        resample = self.resample_var.get()
         self.save_data_toplevel.destroy()
         sample_data_loc = tkinter.filedialog.asksaveasfilename()
         if sample_data_loc != "":
-            cal = get_cal()
-            wavelength_step = (cal["max"] - cal["min"]) / len(self.data)
-            wavelength_array = np.arange(cal["min"], cal["max"]+wavelength_step,
-                                         step=wavelength_step)
-            with open(sample_data_loc, mode="w") as csv_file:
-                csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"',
-                                        quoting=csv.QUOTE_MINIMAL)
-                csv_writer.writerow(["Wavelength (nm)", "Absorbance"])
-                for i in range(len(self.data)):
-                    csv_writer.writerow([wavelength_array[i], self.data[i]])
+            write_csv(sample_data_loc, self.data, get_cal(), resample)
             self.destroy()
 
 
-class LocateSpectrumWindow(tkinter.Toplevel):
+class KineticsWindow(TaskWindow):
+    """Window for measuring the absorbance spectrum repeatedly over time.
+
+    The user chooses the interval, duration and output directory, measures the
+    blank, then starts the run.  The most recent spectrum is displayed while
+    the run continues, with the change in absorbance at its highest point
+    over the spectra kept in memory (see SpectrumRing).
+
+    """
+
+    def __init__(self):
+        TaskWindow.__init__(self)
+        self.title("Kinetics Measurement")
+        self.run = None
+        self.stopped = True
+        self.settings_canvas = tkinter.Canvas(self)
+        self.interval_label = tkinter.Label(self.settings_canvas,
+                                            text="Seconds between measurements")
+        self.interval_label.pack()
+        self.interval_entry = tkinter.Entry(self.settings_canvas)
+        self.interval_entry.insert(0, "5")
+        self.interval_entry.pack()
+        self.duration_label = tkinter.Label(self.settings_canvas,
+                                            text="Length of the run (seconds)")
+        self.duration_label.pack()
+        self.duration_entry = tkinter.Entry(self.settings_canvas)
+        self.duration_entry.insert(0, "600")
+        self.duration_entry.pack()
+        self.dir_button = tkinter.Button(self.settings_canvas,
+                                         text="Select Directory to Save the Run",
+                                         command=self.choose_dir)
+        self.dir_button.pack()
+        self.settings_canvas.pack()
+        self.out_dir = ""
+
+        self.status_label = tkinter.Label(self, text="Choose a directory, then "
+                                                     "measure the blank.")
+        self.status_label.pack()
+        self.panel_preview = tkinter.Label(self)
+        self.panel_preview.pack()
+        self.blank_button = tkinter.Button(self, text="Measure Blank",
+                                           command=self.measure_blank)
+        self.blank_button.pack()
+        self.start_button = tkinter.Button(self, text="Start", state=tkinter.DISABLED,
+                                           command=self.start_run)
+        self.start_button.pack()
+        self.stop_button = tkinter.Button(self, text="Stop", state=tkinter.DISABLED,
+                                          command=self.stop_run)
+        self.stop_button.pack()
+        self.after_id = None
+
+
+    def choose_dir(self):
+        """Ask the user where to save the run."""
+
+        self.out_dir = tkinter.filedialog.askdirectory()
+
+
+    def measure_blank(self):
+        """Read the settings and measure the blank."""
+
+        try:
+            interval = float(self.interval_entry.get())
+            duration = float(self.duration_entry.get())
+        except ValueError:
+            self.status_label.config(text="The interval and length must be numbers.")
+            return
+        if interval <= 0 or duration <= 0 or self.out_dir == "":
+            self.status_label.config(text="Choose a directory, and use positive "
+                                          "numbers for the interval and length.")
+            return
+        try:
+            self.run = KineticsRun(self.out_dir, interval, duration)
+        except FileExistsError:
+            self.status_label.config(text="That directory already holds a run.  "
+                                          "Choose an empty directory.")
+            return
+        self.blank_button.config(state=tkinter.DISABLED)
+        self.run_task("Measuring the blank...", self.run.measure_blank,
+                      on_done=self.blank_done)
+
+
+    def blank_done(self, _):
+        self.status_label.config(text="Blank measured.  Insert the sample, then "
+                                      "press Start.")
+        self.blank_button.config(state=tkinter.NORMAL)
+        self.start_button.config(state=tkinter.NORMAL)
+
+
+    def start_run(self):
+        """Start measuring the sample."""
+
+        self.start_button.config(state=tkinter.DISABLED)
+        self.blank_button.config(state=tkinter.DISABLED)
+        self.stop_button.config(state=tkinter.NORMAL)
+        self.stopped = False
+        self.run.start()
+        self.measure_next()
+
+
+    def measure_next(self):
+        """Measure one spectrum in the background; it is displayed by
+        show_spectrum()."""
+
+        self.after_id = None
+        if self.run.is_done():
+            self.stop_run()
+            return
+
+        def measure_and_render(progress=None, cancel=None):
+            self.run.measure_next(progress, cancel)
+            elapsed, data = self.run.ring.latest()
+            return (render_fig(data, self.run.cal, "t = %.1f s" % elapsed),
+                    self.trace_text(data))
+
+        self.run_task("Measuring...", measure_and_render, on_done=self.show_spectrum)
+
+
+    def trace_text(self, data):
+        """Describe how the absorbance at the highest point of the spectrum data
+        has changed over the spectra kept in memory."""
+
+        if not np.isfinite(data).any():
+            return ""
+        index = int(np.nanargmax(data))
+        times, values = self.run.ring.trace(index)
+        wavelength = get_model(self.run.cal, len(data)).at(index)
+        return ("At %.0f nm, the absorbance went from %.3f to %.3f over the last "
+                "%.0f s." % (wavelength, values[0], values[-1], times[-1] - times[0]))
+
+
+    def show_spectrum(self, result):
+        """Display the latest spectrum and schedule the next one."""
+
+        graph_image, trace_text = result
+        self.preview_image_tk = ImageTk.PhotoImage(image=graph_image)
+        self.panel_preview.config(image=self.preview_image_tk)
+        self.panel_preview.image = self.preview_image_tk
+        self.status_label.config(text="%d spectra measured.  %s"
+                                 % (self.run.log.count, trace_text))
+        if not self.stopped:
+            delay_ms = int(1000 * self.run.seconds_until_next())
+            self.after_id = self.after(delay_ms, self.measure_next)
+
+
+    def stop_run(self):
+        """Stop the run early (or after it finishes) and save it."""
+
+        self.stopped = True
+        self.cancel_task()
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+        self.run.finish()
+        self.stop_button.config(state=tkinter.DISABLED)
+        self.status_label.config(text="Finished.  %d spectra were saved to %s."
+                                 % (self.run.log.count, self.out_dir))
+
+
+    def close(self):
+        """Save the run, if one was started, and close the window."""
+
+        if self.run is not None and self.run.log is not None and not self.stopped:
+            self.stop_run()
+        TaskWindow.close(self)
+
+
+class BatchWindow(TaskWindow):
+    """Window for measuring a queue of labelled samples against one blank.
+
+    The user enters one label per line and measures the blank.  Then the
+    samples are measured in order.  Each sample is processed and saved in the
+    background (see batch.py) while the user loads the next one.
+
+    """
+
+    def __init__(self):
+        TaskWindow.__init__(self)
+        self.title("Measure Several Samples")
+        self.labels_label = tkinter.Label(self, text="Enter one sample name per line.")
+        self.labels_label.pack()
+        self.labels_text = tkinter.Text(self, width=40, height=10)
+        self.labels_text.pack()
+        self.blank_button = tkinter.Button(self, text="Measure Blank",
+                                           command=self.measure_blank)
+        self.blank_button.pack()
+        self.status_label = tkinter.Label(self, text="")
+        self.status_label.pack()
+        self.sample_button = tkinter.Button(self, text="Measure Sample",
+                                            state=tkinter.DISABLED,
+                                            command=self.measure_sample)
+        self.sample_button.pack()
+        self.results_list = tkinter.Listbox(self, width=60)
+        self.results_list.pack()
+        self.queue = None
+        self.labels = []
+        self.next_index = 0
+        self.shown = 0
+
+
+    def measure_blank(self):
+        """Read the labels and measure (or reuse) the blank."""
+
+        self.labels = [line.strip() for line in self.labels_text.get("1.0", tkinter.END).split("\n")
+                       if line.strip() != ""]
+        if len(self.labels) == 0:
+            self.status_label.config(text="Enter at least one sample name.")
+            return
+        self.labels_text.config(state=tkinter.DISABLED)
+        self.blank_button.config(state=tkinter.DISABLED)
+        self.run_task("Measuring the blank...", get_blank, on_done=self.blank_done)
+
+
+    def blank_done(self, result):
+        blank_row, _ = result
+        self.queue = SampleQueue(blank_row, get_cal(), get_loc())
+        self.sample_button.config(state=tkinter.NORMAL)
+        self.prompt_next()
+        self.poll_results()
+
+
+    def prompt_next(self):
+        """Tell the user which sample to load next."""
+
+        if self.next_index < len(self.labels):
+            label = self.labels[self.next_index]
+            self.status_label.config(text="Load %s, then press the button." % label)
+            self.sample_button.config(text="Measure %s" % label)
+        else:
+            self.status_label.config(text="All samples have been measured.")
+            self.sample_button.config(state=tkinter.DISABLED)
+
+
+    def measure_sample(self):
+        """Capture the next sample in the background and queue it for
+        processing."""
+
+        label = self.labels[self.next_index]
+        self.sample_button.config(state=tkinter.DISABLED)
+        self.run_task("Measuring %s..." % label, self.queue.capture, label,
+                      on_done=self.sample_captured)
+
+
+    def sample_captured(self, _):
+        self.next_index += 1
+        self.sample_button.config(state=tkinter.NORMAL)
+        self.prompt_next()
+
+
+    def poll_results(self):
+        """List the results that have finished processing, in order."""
+
+        futures = self.queue.futures
+        while self.shown < len(futures) and futures[self.shown].done():
+            future = futures[self.shown]
+            if future.exception() is not None:
+                self.results_list.insert(tkinter.END, "%s: failed (%s)" %
+                                         (self.labels[self.shown], future.exception()))
+            else:
+                result = future.result()
+                self.results_list.insert(tkinter.END, "%s: saved as archive id %d" %
+                                         (result["label"], result["id"]))
+            self.shown += 1
+        if self.shown < len(self.labels):
+            self.after(200, self.poll_results)
+
+
+    def close(self):
+        """Finish processing the samples that were measured, then close the
+        window.  (tkinter drops poll_results() once the window is gone, so
+        the queue is closed here.)"""
+
+        self.cancel_task()
+        if self.queue is not None:
+            try:
+                self.queue.close()
+            except Exception:
+                # A sample that failed has nothing left to save.
+                pass
+        TaskWindow.close(self)
+
+
+class LocateSpectrumWindow(TaskWindow):
     """Window for locating the diffraction spectrum.
 
-    The LocateSpectrumWindow displays an image taken by the camera.  The user
-    enters the location (in pixels) of the diffraction spectrum.
+    The LocateSpectrumWindow displays an image taken by the camera.  The location
+    of the spectrum is detected automatically; the user can accept it, or enter
+    the location (in pixels) by hand.
 
     """
 
     def __init__(self):
-        tkinter.Toplevel.__init__(self)
+        TaskWindow.__init__(self)
         self.title("Diffraction Spectrum Location")
         self.label_text = ("Find a diffraction spectrum in the image.")
         self.label = tkinter.Label(self, text=self.label_text)
         self.label.pack()
-        self.image_array = get_color_image()
-        self.image_tk = ImageTk.PhotoImage(image=Image.fromarray(self.image_array))
-        self.panel_loc = tkinter.Label(self, image=self.image_tk)
-        self.panel_loc.image = self.image_tk
+
+        def capture_and_detect(progress=None, cancel=None):
+            image_array = get_color_image(progress, cancel)
+            return image_array, detect_spectrum(image_array)
+
+        self.run_task("Capturing an image...", capture_and_detect,
+                      on_done=self.image_captured)
+
+
+    def image_captured(self, result):
+        """Called when the image has been captured.  Display it and the rest
+        of the window."""
+
+        self.image_array, (self.detected_loc, self.detected_confidence) = result
+        # The image with the band drawn on it.  Each update only restores the
+        # pixels of the old band and draws the new one.
+        self.image_line_array = get_buffer_pool().acquire(self.image_array.shape)
+        np.copyto(self.image_line_array, self.image_array)
+        self.band_pixels = None
+        self.image_line_tk = ImageTk.PhotoImage(image=Image.fromarray(self.image_line_array))
+        self.panel_loc = tkinter.Label(self, image=self.image_line_tk)
+        self.panel_loc.image = self.image_line_tk
         self.panel_loc.pack()
         self.move_spec_canvas = tkinter.Canvas(self)
         x_loc_label_text = "x location (less than %d)" %(self.image_array.shape[1])
@@ -396,15 +888,48 @@ class LocateSpectrumWindow(tkinter.Toplevel):
         self.length_entry = tkinter.Entry(self.move_spec_canvas)
         self.length_entry.pack()
 
+        width_label_text = "width of the band (pixels)"
+        self.width_label = tkinter.Label(self.move_spec_canvas, text=width_label_text)
+        self.width_label.pack()
+        self.width_entry = tkinter.Entry(self.move_spec_canvas)
+        self.width_entry.pack()
+
+        tilt_label_text = "tilt (pixels to the right per row)"
+        self.tilt_label = tkinter.Label(self.move_spec_canvas, text=tilt_label_text)
+        self.tilt_label.pack()
+        self.tilt_entry = tkinter.Entry(self.move_spec_canvas)
+        self.tilt_entry.pack()
+
+        curve_label_text = "curve (pixels to the right per row squared)"
+        self.curve_label = tkinter.Label(self.move_spec_canvas, text=curve_label_text)
+        self.curve_label.pack()
+        self.curve_entry = tkinter.Entry(self.move_spec_canvas)
+        self.curve_entry.pack()
+
         self.move_spec_canvas.pack()
         old_loc = get_loc()
         self.x_loc_entry.insert(0, old_loc["x"])
         self.y_loc_entry.insert(0, old_loc["y"])
         self.length_entry.insert(0, old_loc["length"])
+        self.width_entry.insert(0, old_loc.get("width", 1))
+        self.tilt_entry.insert(0, old_loc.get("tilt", 0.0))
+        self.curve_entry.insert(0, old_loc.get("curve", 0.0))
         self.update()
         self.update_loc_from_gui() # Initialize the line.
 
         self.menu_canvas = tkinter.Canvas(self)
+        if self.detected_loc is None:
+            detected_text = "The spectrum couldn't be found automatically."
+        else:
+            detected_text = ("A spectrum was found automatically (%d%% confidence)."
+                             % round(100 * self.detected_confidence))
+        self.detected_label = tkinter.Label(self.menu_canvas, text=detected_text)
+        self.detected_label.pack()
+        if self.detected_loc is not None:
+            self.detected_button = tkinter.Button(self.menu_canvas,
+                                                  command=self.use_detected_loc,
+                                                  text="Use the Detected Location")
+            self.detected_button.pack()
         self.update_button = tkinter.Button(self.menu_canvas,
                                             command=self.update_loc_from_gui,
                                             text="Update")
@@ -414,6 +939,29 @@ class LocateSpectrumWindow(tkinter.Toplevel):
         self.dismiss_button.pack()
         self.menu_canvas.pack()
 
+    def use_detected_loc(self):
+        """Fill the entries with the automatically detected location, then update
+        the image and loc.json."""
+
+        entries = ((self.x_loc_entry, "x"), (self.y_loc_entry, "y"),
+                   (self.length_entry, "length"), (self.width_entry, "width"),
+                   (self.tilt_entry, "tilt"), (self.curve_entry, "curve"))
+        for entry, key in entries:
+            entry.delete(0, tkinter.END)
+            entry.insert(0, self.detected_loc[key])
+        self.update_loc_from_gui()
+
+    def destroy(self):
+        """Give the images back to the buffer pool (see buffers.py) and destroy
+        the window."""
+
+        for name in ("image_array", "image_line_array"):
+            image_array = getattr(self, name, None)
+            if image_array is not None:
+                setattr(self, name, None)
+                release_buffer(image_array)
+        TaskWindow.destroy(self)
+
     def cal_after_loc(self):
         """After the user has located the spectrum, it is necessary to calibrate the
         x-axis.  Destroy the top-level and initialize a MeasurementWindow with
@@ -434,25 +982,36 @@ class LocateSpectrumWindow(tkinter.Toplevel):
             new_x = int(self.x_loc_entry.get())
             new_y = int(self.y_loc_entry.get())
             new_length = int(self.length_entry.get())
-            self.image_line_array = np.copy(self.image_array)
+            new_width = int(self.width_entry.get())
+            new_tilt = float(self.tilt_entry.get())
+            new_curve = float(self.curve_entry.get())
             new_x_good = (new_x < self.image_line_array.shape[1]) and (new_x > 0)
             new_y_good = new_y > 0
             new_length_good = ((new_y + new_length < self.image_line_array.shape[0]) and
                                (new_length > 0))
-            if new_x_good and new_y_good and new_length_good:
-                set_loc(new_x, new_y, new_length)
-                line_t = new_y
-                line_b = new_y + new_length
-                line_l_edge = max(new_x-5, 0)
-                line_r_edge = min(new_x+5, self.image_line_array.shape[1])
-
-                # Draw a red line where the location is.
-                self.image_line_array[line_t : line_b,\
-                                      line_l_edge : line_r_edge] = np.array([255, 0, 0])
-                image_pil = Image.fromarray(self.image_line_array)
-                self.image_line_tk = ImageTk.PhotoImage(image=image_pil)
-                self.panel_loc.configure(image=self.image_line_tk)
-                self.panel_loc.image = self.image_line_tk
+            last_step = new_length - 1
+            end_x = new_x + new_tilt * last_step + new_curve * last_step**2
+            new_band_good = ((new_width > 0) and
+                             (end_x - new_width / 2 > 0) and
+                             (end_x + new_width / 2 < self.image_line_array.shape[1]))
+            if new_x_good and new_y_good and new_length_good and new_band_good:
+                new_loc = {"x" : new_x, "y" : new_y, "length" : new_length,
+                           "width" : new_width, "tilt" : new_tilt, "curve" : new_curve}
+                set_loc(new_x, new_y, new_length, new_width, new_tilt, new_curve)
+
+                # Draw the band in red where the location is.  A band that is
+                # narrower than 10 pixels is drawn 10 pixels wide so it is
+                # visible.
+                draw_loc = dict(new_loc, width=max(new_width, 10))
+                new_band = get_roi(draw_loc, self.image_line_array.shape[:2]).pixel_indices()
+                line_pixels = self.image_line_array.reshape(-1, 3)
+                if self.band_pixels is not None:
+                    line_pixels[self.band_pixels] = \
+                        self.image_array.reshape(-1, 3)[self.band_pixels]
+                line_pixels[new_band] = (255, 0, 0)
+                self.band_pixels = new_band
+                # The Tk image is updated in place instead of being replaced.
+                self.image_line_tk.paste(Image.fromarray(self.image_line_array))
             else:
                 self.complain_bad_loc_val()
         except ValueError:
@@ -474,10 +1033,34 @@ class LocateSpectrumWindow(tkinter.Toplevel):
         dismiss_button.pack()
 
 
+class LiveWindow(TaskWindow):
+    """Window showing the absorbance spectrum live, for aligning the optics.
+
+    The stream runs as a background task, so other measurements wait until
+    this window is closed.
+
+    """
+
+    def __init__(self):
+        TaskWindow.__init__(self)
+        self.title("Live Spectrum")
+        self.session = LiveSession()
+        self.live_frame = LiveFrame(self, self.session, print_every=0)
+        self.live_frame.pack()
+        self.run_task("Streaming...", self.session.run)
+
+
+    def close(self):
+        self.live_frame.stop_polling()
+        TaskWindow.close(self)
+
+
 class SpecApp(tkinter.Tk):
     """Toplevel class that is initialized when the app starts."""
     def __init__(self):
         tkinter.Tk.__init__(self) # Initialize tkinter.
+        # Captures and processing run on this background worker.
+        self.tasks = TaskRunner(self)
         # Display a window when the program starts.
         self.title("Main Menu")
 
@@ -493,13 +1076,36 @@ class SpecApp(tkinter.Tk):
                                              command=lambda: MeasurementWindow(False),
                                              text="Take Blank and Sample Measurement")
         self.measure_button.pack()
+        self.batch_button = tkinter.Button(self, command=BatchWindow,
+                                           text="Measure Several Samples")
+        self.batch_button.pack()
+        self.kinetics_button = tkinter.Button(self, command=KineticsWindow,
+                                              text="Kinetics (Time Series) Measurement")
+        self.kinetics_button.pack()
+        self.live_button = tkinter.Button(self, command=LiveWindow,
+                                          text="Live Spectrum (Alignment)")
+        self.live_button.pack()
+        self.status_label = tkinter.Label(self, text="Starting the camera...")
+        self.status_label.pack()
         self.cal = get_cal()
+        # The camera and matplotlib start in the background once the menu is
+        # drawn.  Measurements started before they are ready wait in the
+        # worker's queue.
+        self.after_idle(self.start_up)
+
+
+    def start_up(self):
+        self.tasks.submit(start_devices,
+                          on_done=lambda _: self.status_label.config(text="Ready."),
+                          on_error=lambda error: self.status_label.config(
+                              text="Camera error: %s" % error))
 
 
     def update_cal(self, new_min_string, new_max_string, sample_row, blank_row):
-        """Update cal.json with new calibration values.  Update the calibration
-        graph at out.png.  Note that this function doesn't display the new graph.
-        It is called by a FinishCalibrationWindow object that updates the window.
+        """Update cal.json with new calibration values.  Return the new
+        calibration graph as a PIL image, or None if the values are invalid.
+        Note that this function doesn't display the new graph.  It is called by
+        a FinishCalibrationWindow object that updates the window.
 
         """
 
@@ -508,28 +1114,62 @@ class SpecApp(tkinter.Tk):
             new_max = float(new_max_string)
             if new_min < new_max:
                 set_cal(new_min, new_max)
-                self.cal = {"min" : new_min, "max" : new_max}
-                # I don't want to do math on uint8s.
-                sample_row = sample_row.astype(np.int16)
-                blank_row = blank_row.astype(np.int16)
-                data = np.log10(blank_row / sample_row)
-                # The top (low indices) is the high wavelength.
-                data = data[::-1]
-                out_file_loc = "out.png"
-                plot_fig(data, out_file_loc, self.cal, "Calibration")
+                self.cal = get_cal()
+                data = compute_absorbance(blank_row, sample_row)
+                return render_fig(data, self.cal, "Calibration")
             else:
                 self.complain_bad_cal_val()
         except ValueError:
             self.complain_bad_cal_val()
 
 
+    def update_cal_points(self, ref_points_string, sample_row, blank_row):
+        """Fit a polynomial calibration to reference points and save it in
+        cal.json.  Return the new calibration graph as a PIL image, or None if
+        the points are invalid.
+
+        Parameters
+        ----------
+        ref_points_string : string
+            Comma-separated "graph=true" pairs.  "graph" is a wavelength read off
+            the x-axis of the current graph, and "true" is the known wavelength
+            of the same feature.
+        sample_row : 1D list or numpy array
+            The data points from when the sample was measured.
+        blank_row : 1D list or numpy array
+            The data points from when the blank was measured.
+
+        """
+
+        try:
+            data = compute_absorbance(blank_row, sample_row)
+            current_model = get_model(self.cal, len(data))
+            pairs = [pair.split("=") for pair in ref_points_string.split(",")
+                     if pair.strip() != ""]
+            graph_wavelengths = [float(graph) for graph, _ in pairs]
+            true_wavelengths = [float(true) for _, true in pairs]
+            indices = current_model.index_of(graph_wavelengths)
+            if len(pairs) < 2 or not all(index == index for index in indices):
+                # NaN != NaN: a graph wavelength is outside the graph.
+                raise ValueError
+            coeffs = fit_coeffs(indices, true_wavelengths, len(data))
+            if not get_model({"coeffs" : coeffs}, len(data)).increasing:
+                raise ValueError
+        except ValueError:
+            self.complain_bad_cal_val()
+            return None
+        set_cal_coeffs(coeffs)
+        self.cal = get_cal()
+        return render_fig(data, self.cal, "Calibration")
+
+
     def complain_bad_cal_val(self):
         """Display an error message is the user provides invalid input."""
 
         toplevel_for_complaint = tkinter.Toplevel(self)
         toplevel_for_complaint.title("Error: Bad Input!")
-        complaint_text = ("Either a value isn't a number, or the minimum is greater than "
-                          "the maximum.")
+        complaint_text = ("Either a value isn't a number, the minimum is greater than "
+                          "the maximum, or the reference points don't make sense.")
         complaint_label = tkinter.Label(toplevel_for_complaint,
                                         text=complaint_text)
         complaint_label.pack()
@@ -539,5 +1179,6 @@ class SpecApp(tkinter.Tk):
         dismiss_button.pack()
 
 
-app = SpecApp()
-app.mainloop()
+if __name__ == "__main__":
+    app = SpecApp()
+    app.mainloop()
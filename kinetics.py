@@ -0,0 +1,352 @@
+"""This code measures reaction kinetics: the absorbance spectrum is measured
+at a fixed rate for minutes to hours.  It is used by gui.py, and it can also
+be run from the command line.  Usage:
+
+    python3 kinetics.py --interval 5 --duration 3600 --out run1
+
+The blank is measured first; then the sample should be put in the
+spectrophotometer.  Every spectrum is appended to a memory-mapped array in
+the --out directory, so long runs use a constant amount of memory.  The most
+recent spectra are also kept in memory for display.  A directory that already
+holds a run is never overwritten; choose a new one for each run.
+
+To print the absorbance at one wavelength over time from a finished run:
+
+    python3 kinetics.py --trace 550 --out run1
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from loc import get_loc
+from cal import get_cal
+from measure import capture_row, compute_absorbance, wavelength_axis
+from metrics import span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+class SpectrumRing():
+    """Fixed-size in-memory buffer of the most recent spectra.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of spectra to keep.  Older spectra are overwritten.
+    num_points : int
+        The length of each spectrum.
+
+    """
+
+    def __init__(self, capacity, num_points):
+        self.capacity = capacity
+        self.spectra = np.full((capacity, num_points), np.nan)
+        self.times = np.full(capacity, np.nan)
+        self.count = 0
+
+    def append(self, elapsed, data):
+        """Add a spectrum measured elapsed seconds after the start."""
+
+        index = self.count % self.capacity
+        self.spectra[index] = data
+        self.times[index] = elapsed
+        self.count += 1
+
+    def latest(self):
+        """Return (time, spectrum) of the most recent spectrum."""
+
+        index = (self.count - 1) % self.capacity
+        return self.times[index], self.spectra[index]
+
+    def ordered(self):
+        """Return (times, spectra) of the spectra in the buffer, oldest first."""
+
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.spectra[:self.count]
+        order = np.roll(np.arange(self.capacity), -(self.count % self.capacity))
+        return self.times[order], self.spectra[order]
+
+    def trace(self, index):
+        """Return (times, values) of the point index of the spectra in the
+        buffer, oldest first."""
+
+        times, spectra = self.ordered()
+        return times, spectra[:, index]
+
+
+class SpectrumLog():
+    """On-disk, memory-mapped record of every spectrum in a kinetics run.
+
+    The directory contains meta.json, times.f8 (float64 seconds since the
+    start) and spectra.f4 (float32, one row per spectrum).  The files grow
+    in chunks; unused rows have a time of NaN, so the number of spectra can be
+    recovered even if the program stops unexpectedly.
+
+    Use SpectrumLog.create() to start a new run and SpectrumLog.open() to
+    read an existing one.
+
+    """
+
+    chunk_rows = 1024
+
+    def __init__(self, directory, metadata, writable):
+        self.directory = directory
+        self.metadata = metadata
+        self.num_points = metadata["num_points"]
+        self.writable = writable
+        self._times = None
+        self._spectra = None
+        self._map(self._rows_on_disk())
+        finite = np.isfinite(self._times)
+        self.count = len(finite) if finite.all() else int(np.argmin(finite))
+
+    FILES = ("meta.json", "times.f8", "spectra.f4")
+
+    @classmethod
+    def exists(cls, directory):
+        """Return True if directory already holds (part of) a run."""
+
+        return any(os.path.exists(os.path.join(directory, name)) for name in cls.FILES)
+
+    @classmethod
+    def create(cls, directory, num_points, metadata=None):
+        """Start a new run in directory.  metadata is a dictionary of extra
+        information (e.g. the calibration) to save in meta.json.  If directory
+        already holds a run, FileExistsError is raised."""
+
+        if cls.exists(directory):
+            raise FileExistsError("%s already holds a run." % directory)
+        os.makedirs(directory, exist_ok=True)
+        metadata = dict(metadata or {})
+        metadata["num_points"] = int(num_points)
+        with open(os.path.join(directory, "meta.json"), "x") as meta_file:
+            json.dump(metadata, meta_file)
+        for name in ("times.f8", "spectra.f4"):
+            open(os.path.join(directory, name), "xb").close()
+        return cls(directory, metadata, writable=True)
+
+    @classmethod
+    def open(cls, directory):
+        """Open an existing run for reading."""
+
+        with open(os.path.join(directory, "meta.json"), "r") as meta_file:
+            metadata = json.load(meta_file)
+        return cls(directory, metadata, writable=False)
+
+    def _rows_on_disk(self):
+        return os.path.getsize(os.path.join(self.directory, "times.f8")) // 8
+
+    def _map(self, rows):
+        """(Re)map the files with room for rows spectra, growing them if
+        necessary."""
+
+        self.flush()
+        times_loc = os.path.join(self.directory, "times.f8")
+        spectra_loc = os.path.join(self.directory, "spectra.f4")
+        old_rows = self._rows_on_disk()
+        if rows > old_rows:
+            with open(times_loc, "ab") as times_file:
+                times_file.write(np.full(rows - old_rows, np.nan).tobytes())
+            with open(spectra_loc, "ab") as spectra_file:
+                spectra_file.truncate(rows * self.num_points * 4)
+        if rows == 0:
+            self._times = np.empty(0)
+            self._spectra = np.empty((0, self.num_points), dtype=np.float32)
+            return
+        mode = "r+" if self.writable else "r"
+        self._times = np.memmap(times_loc, dtype=np.float64, mode=mode, shape=(rows,))
+        self._spectra = np.memmap(spectra_loc, dtype=np.float32, mode=mode,
+                                  shape=(rows, self.num_points))
+
+    def append(self, elapsed, data):
+        """Add a spectrum measured elapsed seconds after the start."""
+
+        with span("persist_kinetics"):
+            if self.count == len(self._times):
+                self._map(self.count + self.chunk_rows)
+            self._spectra[self.count] = data
+            # The time is written last, so a row only counts once it is
+            # complete.
+            self._times[self.count] = elapsed
+            self.count += 1
+
+    def flush(self):
+        """Make sure everything appended so far is on disk."""
+
+        if self.writable and isinstance(self._times, np.memmap):
+            with span("persist_kinetics_flush"):
+                self._spectra.flush()
+                self._times.flush()
+
+    def times(self):
+        """Return the times (seconds since the start) of all of the spectra."""
+
+        return np.array(self._times[:self.count])
+
+    def spectra(self):
+        """Return a read-only memory-mapped (count, num_points) array of all of
+        the spectra.  It isn't loaded into memory until it is used."""
+
+        return self._spectra[:self.count]
+
+    def trace(self, indices):
+        """Return the absorbance over time at the given spectrum indices.
+
+        Only the requested columns are copied into memory.
+
+        Parameters
+        ----------
+        indices : int or 1D list of int
+            Indices into each spectrum.
+
+        Returns
+        -------
+        numpy array
+            Shape (count,) for a single index, or (count, len(indices)).
+
+        """
+
+        return np.array(self._spectra[:self.count, indices], dtype=np.float64)
+
+    def wavelength_index(self, wavelength):
+        """Return the index of the point closest to wavelength (nm), using the
+        calibration saved with the run."""
+
+        wavelengths = wavelength_axis(self.metadata["cal"], self.num_points)
+        return int(np.argmin(np.abs(wavelengths - wavelength)))
+
+
+class KineticsRun():
+    """A kinetics measurement: one blank, then a spectrum every interval
+    seconds.
+
+    Parameters
+    ----------
+    out_dir : string
+        Directory to save the run to.
+    interval : float
+        Seconds between the starts of consecutive measurements.
+    duration : float
+        Length of the run in seconds.
+    ring_size : int
+        The number of recent spectra to keep in memory.
+
+    """
+
+    def __init__(self, out_dir, interval, duration, ring_size=256):
+        # Checked now, so the blank isn't measured for nothing.
+        if SpectrumLog.exists(out_dir):
+            raise FileExistsError("%s already holds a run." % out_dir)
+        self.out_dir = out_dir
+        self.interval = interval
+        self.duration = duration
+        self.ring_size = ring_size
+        self.loc = get_loc()
+        self.cal = get_cal()
+        self.blank_row = None
+        self.ring = None
+        self.log = None
+        self.start_time = None
+        self.next_time = None
+
+    def measure_blank(self, progress=None, cancel=None):
+        """Measure the blank.  This must be done before start().  progress and
+        cancel are passed to capture_row()."""
+
+        self.blank_row = capture_row(self.loc, progress, cancel)
+
+    def start(self):
+        """Create the log and begin timing.  The first spectrum is due
+        immediately."""
+
+        num_points = len(self.blank_row)
+        self.ring = SpectrumRing(self.ring_size, num_points)
+        metadata = {"cal" : self.cal, "loc" : self.loc, "interval" : self.interval,
+                    "start" : time.time(),
+                    "blank" : np.asarray(self.blank_row).tolist()}
+        self.log = SpectrumLog.create(self.out_dir, num_points, metadata)
+        self.start_time = time.perf_counter()
+        self.next_time = self.start_time
+
+    def is_done(self):
+        return self.next_time - self.start_time > self.duration
+
+    def seconds_until_next(self):
+        return max(self.next_time - time.perf_counter(), 0.0)
+
+    def measure_next(self, progress=None, cancel=None):
+        """Measure one spectrum, store it, and schedule the next one.
+        Return (elapsed seconds, absorbance spectrum).  progress and cancel
+        are passed to capture_row()."""
+
+        elapsed = time.perf_counter() - self.start_time
+        data = compute_absorbance(self.blank_row, capture_row(self.loc, progress, cancel))
+        self.ring.append(elapsed, data)
+        self.log.append(elapsed, data)
+        # Schedule from the planned time rather than from now, so the rate
+        # doesn't drift.  If a measurement overran, skip the missed slots.
+        self.next_time += self.interval
+        now = time.perf_counter()
+        if self.next_time < now:
+            missed = np.ceil((now - self.next_time) / self.interval)
+            self.next_time += missed * self.interval
+        return elapsed, data
+
+    def run(self, callback=None):
+        """Measure until the duration is over.  callback(elapsed, data) is
+        called after each measurement."""
+
+        while not self.is_done():
+            time.sleep(self.seconds_until_next())
+            elapsed, data = self.measure_next()
+            if callback is not None:
+                callback(elapsed, data)
+        self.finish()
+
+    def finish(self):
+        self.log.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the absorbance spectrum repeatedly over time.")
+    parser.add_argument("--out", default="kinetics",
+                        help="directory to save the run to (or read it from)")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="seconds between measurements")
+    parser.add_argument("--duration", type=float, default=600.0,
+                        help="length of the run in seconds")
+    parser.add_argument("--trace", type=float, metavar="NM",
+                        help="print the absorbance at this wavelength from an "
+                             "existing run instead of measuring")
+    args = parser.parse_args(argv)
+
+    if args.trace is not None:
+        log = SpectrumLog.open(args.out)
+        index = log.wavelength_index(args.trace)
+        for elapsed, value in zip(log.times(), log.trace(index)):
+            print("%.3f,%.6f" % (elapsed, value))
+        return
+
+    try:
+        run = KineticsRun(args.out, args.interval, args.duration)
+    except FileExistsError as error:
+        parser.error("%s  Use a new --out directory." % error)
+    run.measure_blank()
+    input("Blank measured.  Insert the sample, then press Enter to start.")
+    run.start()
+    run.run(lambda elapsed, data: print("%.1f s: mean absorbance %.4f"
+                                        % (elapsed, np.nanmean(data))))
+
+
+if __name__ == "__main__":
+    main()
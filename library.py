@@ -0,0 +1,276 @@
+"""This code identifies a sample by comparing its absorbance spectrum with a
+library of reference spectra.  It is used by gui.py.
+
+All of the references are resampled onto COMMON_GRID (see wavelength.py) and
+cut to the library's wavelength window, then stored as the rows of a single
+matrix.  Each row is centered and scaled to unit length when it is added, so
+the similarity of a new spectrum to every reference is one matrix-vector
+product: the Pearson correlation of the shapes, from -1 to 1.  It doesn't
+depend on the concentration of the sample.
+
+For big libraries, build_index() keeps a PCA-reduced copy of the matrix.
+Matches are then found among the references that score best in the reduced
+space, and only those are scored exactly.
+
+The library is saved in library.npz.  Usage:
+"python3 library.py add NAME file.csv", "python3 library.py add-archive NAME ID",
+"python3 library.py match file.csv" and "python3 library.py list".
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from config import FileCache, write_atomic
+from wavelength import COMMON_GRID, get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+LIBRARY_FILE = "library.npz"
+# The wavelengths (nm) compared.  Every reference and sample must cover them.
+DEFAULT_WINDOW = (400.0, 650.0)
+
+
+def read_csv_spectrum(file_loc):
+    """Read a csv file saved by measure.write_csv() and return the absorbance
+    on COMMON_GRID (NaN outside the file's wavelengths)."""
+
+    table = np.loadtxt(file_loc, delimiter=",", skiprows=1, ndmin=2)
+    wavelengths, absorbance = table[:, 0], table[:, 1]
+    order = np.argsort(wavelengths)
+    return np.interp(COMMON_GRID, wavelengths[order], absorbance[order],
+                     left=np.nan, right=np.nan)
+
+
+class SpectralLibrary():
+    """Reference spectra, stored for fast matching.
+
+    Parameters
+    ----------
+    window : tuple of float
+        The first and last wavelengths (nm) that are compared.
+
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = (float(window[0]), float(window[1]))
+        self._columns = np.flatnonzero((COMMON_GRID >= self.window[0]) &
+                                       (COMMON_GRID <= self.window[1]))
+        self.names = []
+        # Each row is a reference, centered and scaled to unit length.
+        self.matrix = np.empty((0, len(self._columns)), dtype=np.float32)
+        # The length of each reference before it was scaled.
+        self.norms = np.empty(0, dtype=np.float32)
+        self._components = None
+        self._reduced = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _normalize(self, grid_spectra):
+        """Cut spectra on COMMON_GRID (one per row) to the window, then center
+        and scale each one.  Return the normalized rows and their norms."""
+
+        rows = np.asarray(grid_spectra, dtype=np.float64)[..., self._columns]
+        if not np.all(np.isfinite(rows)):
+            raise ValueError("The spectrum doesn't cover %g-%g nm." % self.window)
+        rows = rows - rows.mean(axis=-1, keepdims=True)
+        norms = np.linalg.norm(rows, axis=-1)
+        # A flat spectrum has no shape to match; leave it as zeros.
+        scale = np.where(norms > 0, norms, 1.0)
+        return rows / scale[..., np.newaxis], norms
+
+    def to_grid(self, data, cal):
+        """Return absorbance spectra (one per row, as measured) on
+        COMMON_GRID."""
+
+        data = np.asarray(data, dtype=np.float64)
+        return get_model(cal, data.shape[-1]).resample(data)
+
+    def add_grid(self, names, grid_spectra):
+        """Add references that are already on COMMON_GRID.
+
+        Parameters
+        ----------
+        names : list of string
+            One name per reference.
+        grid_spectra : 2D numpy array
+            One spectrum per row, len(COMMON_GRID) long.
+
+        """
+
+        rows, norms = self._normalize(np.atleast_2d(grid_spectra))
+        if len(rows) != len(names):
+            raise ValueError("There must be one name per spectrum.")
+        self.matrix = np.concatenate((self.matrix, rows.astype(np.float32)))
+        self.norms = np.concatenate((self.norms, norms.astype(np.float32)))
+        self.names.extend(names)
+        # The PCA index no longer covers every reference.
+        self._components = None
+        self._reduced = None
+
+    def add(self, name, data, cal):
+        """Add a measured absorbance spectrum, with the calibration it was
+        measured with."""
+
+        self.add_grid([name], self.to_grid(data, cal)[np.newaxis])
+
+    def build_index(self, num_components=16):
+        """Keep a PCA-reduced copy of the matrix, to make matching quicker for
+        big libraries.  It is dropped when references are added."""
+
+        num_components = min(num_components, *self.matrix.shape)
+        if num_components == 0:
+            return
+        # The rows are already centered, so the right singular vectors are the
+        # principal directions of the spectra.
+        _, _, vt = np.linalg.svd(self.matrix.astype(np.float64), full_matrices=False)
+        self._components = vt[:num_components].astype(np.float32)
+        self._reduced = self.matrix @ self._components.T
+
+    def _top(self, scores, top_k):
+        """Return the indices of the top_k highest scores, best first."""
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return np.empty(0, dtype=np.intp)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return best[np.argsort(-scores[best])]
+
+    def match_grid(self, grid_spectra, top_k=5, candidates=None):
+        """Find the references most similar to each spectrum.
+
+        Parameters
+        ----------
+        grid_spectra : numpy array
+            A spectrum on COMMON_GRID, or a stack of them (one per row).
+        top_k : int
+            The number of matches returned for each spectrum.
+        candidates : int, optional
+            With a PCA index, how many references are scored exactly.  By
+            default it is 10 * top_k (at least 50).
+
+        Returns
+        -------
+        list
+            A list of (name, score) tuples, best first, for each spectrum.  If
+            grid_spectra is one spectrum, only its list is returned.
+
+        """
+
+        single = np.ndim(grid_spectra) == 1
+        queries, _ = self._normalize(np.atleast_2d(grid_spectra))
+        queries = queries.astype(np.float32)
+        if self._reduced is None:
+            scores = queries @ self.matrix.T
+            results = [[(self.names[i], float(row[i])) for i in self._top(row, top_k)]
+                       for row in scores]
+        else:
+            if candidates is None:
+                candidates = max(10 * top_k, 50)
+            approximate = (queries @ self._components.T) @ self._reduced.T
+            results = []
+            for query, row in zip(queries, approximate):
+                shortlist = self._top(row, candidates)
+                exact = self.matrix[shortlist] @ query
+                results.append([(self.names[shortlist[i]], float(exact[i]))
+                                for i in self._top(exact, top_k)])
+        return results[0] if single else results
+
+    def match(self, data, cal, top_k=5):
+        """Find the references most similar to a measured absorbance spectrum
+        (or a stack of them).  See match_grid()."""
+
+        return self.match_grid(self.to_grid(data, cal), top_k)
+
+    def save(self, file_loc):
+        """Save the library, replacing file_loc in one step."""
+
+        write_atomic(file_loc, lambda npz_file: np.savez(
+            npz_file, names=np.array(self.names, dtype=str), matrix=self.matrix,
+            norms=self.norms, window=np.array(self.window)))
+
+    @classmethod
+    def load(cls, file_loc):
+        with np.load(file_loc) as contents:
+            library = cls(tuple(contents["window"]))
+            library.names = [str(name) for name in contents["names"]]
+            library.matrix = contents["matrix"]
+            library.norms = contents["norms"]
+        return library
+
+
+def _load_indexed(file_loc):
+    """Load a library, giving it a PCA index if it has more than a thousand
+    references."""
+
+    library = SpectralLibrary.load(file_loc)
+    if len(library) > 1000:
+        library.build_index()
+    return library
+
+_library_cache = FileCache(_load_indexed)
+
+def get_library(file_loc=LIBRARY_FILE):
+    """Return the library saved in file_loc, or None if there isn't one.  It
+    is only loaded again if the file has changed (see config.FileCache)."""
+
+    return _library_cache.get(file_loc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the reference spectral "
+                                                 "library and identify samples.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="add csv files as references")
+    add_parser.add_argument("name")
+    add_parser.add_argument("csv_files", nargs="+")
+    archive_parser = subparsers.add_parser("add-archive",
+                                           help="add archived measurements")
+    archive_parser.add_argument("name")
+    archive_parser.add_argument("ids", type=int, nargs="+")
+    match_parser = subparsers.add_parser("match", help="identify csv files")
+    match_parser.add_argument("csv_files", nargs="+")
+    match_parser.add_argument("--top", type=int, default=5)
+    subparsers.add_parser("list", help="list the references")
+    parser.add_argument("--library", default=LIBRARY_FILE, help="the library file")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.library):
+        library = SpectralLibrary.load(args.library)
+    else:
+        library = SpectralLibrary()
+
+    if args.command == "add":
+        library.add_grid([args.name] * len(args.csv_files),
+                         np.array([read_csv_spectrum(loc) for loc in args.csv_files]))
+        library.save(args.library)
+        print("%d references." % len(library))
+    elif args.command == "add-archive":
+        from archive import get_archive
+        archive = get_archive()
+        for measurement_id in args.ids:
+            measurement = archive.get(measurement_id)
+            library.add(args.name, measurement["absorbance"], measurement["cal"])
+        library.save(args.library)
+        print("%d references." % len(library))
+    elif args.command == "match":
+        matches = library.match_grid(
+            np.array([read_csv_spectrum(loc) for loc in args.csv_files]), args.top)
+        for csv_loc, file_matches in zip(args.csv_files, matches):
+            print(csv_loc)
+            for name, score in file_matches:
+                print("    %.4f  %s" % (score, name))
+    else:
+        for name in sorted(set(library.names)):
+            print("%5d  %s" % (library.names.count(name), name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""This code shows the absorbance spectrum live, for aligning the optics.  It
+is used by gui.py and show_video.py.  Usage: "python3 show_video.py".
+
+Frames are streamed from the camera's video port on a background thread.
+If the exposure is locked, the dark frame is subtracted (see exposure.py).
+For every frame the spectrum is extracted and its absorbance is computed
+against a held blank.  The first frames are used as the blank; press "Hold
+Blank" (or the b key) to take a new one.  The graph is updated by blitting:
+only the line and the status text are redrawn, on top of a saved copy of the
+axes.
+
+The achieved frame rate and the average time of each stage (capture,
+extraction, absorbance and drawing) are shown under the graph and printed
+every few seconds, so the pipeline can be tuned.
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import threading
+import time
+import tkinter
+
+import numpy as np
+
+from loc import get_loc
+from cal import get_cal
+from get_image import get_backend, CaptureCancelled
+from exposure import get_dark_frame, subtract_dark
+from measure import compute_absorbance
+from roi import get_cropped_roi
+from wavelength import get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+STAGES = ("capture", "extract", "absorbance", "draw")
+# The number of frames averaged for the blank.
+BLANK_FRAMES = 10
+
+
+class LiveStats():
+    """Frame rate and per-stage latency, as exponential moving averages.
+
+    Parameters
+    ----------
+    smoothing : float
+        The weight of each new measurement (between 0 and 1).
+
+    """
+
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+        self.latency = dict.fromkeys(STAGES, 0.0)
+        self.frames = 0
+        self.fps = 0.0
+        self._last_frame_time = None
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """Add a measurement of how long stage took."""
+
+        with self._lock:
+            self.latency[stage] += self.smoothing * (seconds - self.latency[stage])
+
+    def frame_done(self):
+        """Count a frame and update the frame rate."""
+
+        now = time.perf_counter()
+        with self._lock:
+            if self._last_frame_time is not None:
+                interval = now - self._last_frame_time
+                if interval > 0:
+                    self.fps += self.smoothing * (1.0 / interval - self.fps)
+            self._last_frame_time = now
+            self.frames += 1
+
+    def summary(self):
+        """Return a one-line description of the frame rate and latencies."""
+
+        with self._lock:
+            stages = "  ".join("%s %.1f ms" % (stage, 1000 * self.latency[stage])
+                               for stage in STAGES)
+            return "%.1f fps  %s" % (self.fps, stages)
+
+
+class LiveSession():
+    """Streams frames and computes their absorbance on a background thread.
+
+    The newest result is kept in latest (a tuple of the frame number and
+    the absorbance spectrum, or None); older results are simply replaced, so
+    a slow display never makes the capture fall behind.
+
+    Parameters
+    ----------
+    loc : dictionary, optional
+        The location of the spectrum.  By default loc.json is read.
+
+    """
+
+    def __init__(self, loc=None):
+        self.loc = loc if loc is not None else get_loc()
+        self.stats = LiveStats()
+        self.latest = None
+        self.blank_row = None
+        self._blank_sum = None
+        self._blank_count = 0
+        self._hold_requested = True
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def hold_blank(self):
+        """Use the next BLANK_FRAMES frames as the blank."""
+
+        self._hold_requested = True
+
+    def run(self, progress=None, cancel=None):
+        """Stream until cancel (or stop()) is set.  This blocks, so it is run on
+        a background thread; it can also be submitted to a worker.TaskRunner."""
+
+        cancel = cancel if cancel is not None else self._cancel
+        backend = get_backend()
+        # Only the pixels around the band are streamed.
+        window, roi = get_cropped_roi(self.loc, backend.frame_shape)
+        # The dark frame is subtracted like it is from measurements, so the
+        # live absorbance matches them.
+        dark = get_dark_frame(backend, cancel)
+        if dark is not None:
+            dark = dark[window]
+            subtracted = np.empty_like(dark)
+        backend.led_on()
+        frames = None
+        try:
+            frames = backend.stream_luma(window)
+            while not (cancel.is_set() or self._cancel.is_set()):
+                start = time.perf_counter()
+                frame = next(frames)
+                if dark is not None:
+                    frame = subtract_dark(frame, dark, out=subtracted)
+                extract_start = time.perf_counter()
+                row = roi.extract(frame)
+                absorbance_start = time.perf_counter()
+                if self._hold_requested:
+                    self._hold_requested = False
+                    self._blank_sum = np.zeros_like(row)
+                    self._blank_count = 0
+                if self._blank_sum is not None:
+                    self._blank_sum += row
+                    self._blank_count += 1
+                    if self._blank_count == BLANK_FRAMES:
+                        self.blank_row = self._blank_sum / BLANK_FRAMES
+                        self._blank_sum = None
+                if self.blank_row is not None:
+                    self.latest = (self.stats.frames,
+                                   compute_absorbance(self.blank_row, row))
+                end = time.perf_counter()
+                self.stats.record("capture", extract_start - start)
+                self.stats.record("extract", absorbance_start - extract_start)
+                self.stats.record("absorbance", end - absorbance_start)
+                self.stats.frame_done()
+        finally:
+            # On the Pi, this stops the video port's continuous capture.
+            if frames is not None:
+                frames.close()
+            backend.led_off()
+        raise CaptureCancelled()
+
+    def start(self):
+        """Start streaming on a new background thread."""
+
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run_quietly, daemon=True)
+        self._thread.start()
+
+    def _run_quietly(self):
+        try:
+            self.run()
+        except CaptureCancelled:
+            pass
+
+    def stop(self):
+        self._cancel.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class LiveView():
+    """A graph of the live absorbance spectrum, redrawn by blitting.
+
+    Parameters
+    ----------
+    master : tkinter widget
+        The window to draw the graph in.
+    session : LiveSession
+        Where the spectra come from.
+    y_range : tuple of float
+        The limits of the absorbance axis.
+
+    """
+
+    def __init__(self, master, session, y_range=(-0.1, 1.5)):
+        # matplotlib is slow to import, so it isn't imported until it is needed.
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.session = session
+        self.fig = Figure()
+        self.axes = self.fig.add_subplot(1, 1, 1)
+        self.axes.set_xlabel("Wavelength (nm)")
+        self.axes.set_ylabel("Absorbance")
+        self.axes.set_title("Live")
+        self.axes.set_ylim(*y_range)
+        self.line, = self.axes.plot([], [], animated=True)
+        self.text = self.axes.text(0.02, 0.95, "", transform=self.axes.transAxes,
+                                   animated=True, va="top", fontsize=8)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+        self.canvas.get_tk_widget().pack()
+        self._background = None
+        self._num_points = None
+        self._shown_frame = None
+        # The saved background must be refreshed whenever the whole figure is
+        # redrawn (e.g. when the window is resized).
+        self.canvas.mpl_connect("draw_event", self._save_background)
+
+    def _save_background(self, _=None):
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def _set_axis(self, num_points):
+        """Label the x-axis for spectra of num_points points, and redraw the
+        static parts of the figure."""
+
+        model = get_model(get_cal(), num_points)
+        xticks_locs = np.linspace(0, num_points, 6)
+        self.axes.set_xticks(xticks_locs)
+        self.axes.set_xticklabels(np.char.mod("%.2f", np.round(model.at(xticks_locs), 2)))
+        self.axes.set_xlim(0, num_points)
+        self.line.set_xdata(np.arange(num_points))
+        self._num_points = num_points
+        self.canvas.draw()
+
+    def rescale(self):
+        """Fit the absorbance axis to the current spectrum."""
+
+        if self.session.latest is not None:
+            data = self.session.latest[1]
+            finite = data[np.isfinite(data)]
+            if len(finite) > 0:
+                margin = 0.1 * max(finite.max() - finite.min(), 0.05)
+                self.axes.set_ylim(finite.min() - margin, finite.max() + margin)
+                self.canvas.draw()
+
+    def refresh(self):
+        """Draw the newest spectrum, if there is one that hasn't been drawn."""
+
+        latest = self.session.latest
+        if latest is None or latest[0] == self._shown_frame:
+            return
+        start = time.perf_counter()
+        frame_number, data = latest
+        if len(data) != self._num_points:
+            self._set_axis(len(data))
+        if self._background is None:
+            self._save_background()
+        self.line.set_ydata(data)
+        self.text.set_text(self.session.stats.summary())
+        self.canvas.restore_region(self._background)
+        self.axes.draw_artist(self.line)
+        self.axes.draw_artist(self.text)
+        self.canvas.blit(self.fig.bbox)
+        self._shown_frame = frame_number
+        self.session.stats.record("draw", time.perf_counter() - start)
+
+
+class LiveFrame(tkinter.Frame):
+    """The live graph plus its buttons, polling the session with after().
+
+    Parameters
+    ----------
+    master : tkinter widget
+        The window to put the frame in.
+    session : LiveSession
+        The running session.
+    refresh_ms : int
+        How often to check for a new spectrum.
+    print_every : float
+        Print the statistics this often (seconds).  0 disables printing.
+
+    """
+
+    def __init__(self, master, session, refresh_ms=10, print_every=5.0):
+        tkinter.Frame.__init__(self, master)
+        self.session = session
+        self.refresh_ms = refresh_ms
+        self.print_every = print_every
+        self.view = LiveView(self, session)
+        self.button_frame = tkinter.Frame(self)
+        self.blank_button = tkinter.Button(self.button_frame, text="Hold Blank",
+                                           command=session.hold_blank)
+        self.blank_button.pack(side=tkinter.LEFT)
+        self.rescale_button = tkinter.Button(self.button_frame, text="Rescale",
+                                             command=self.view.rescale)
+        self.rescale_button.pack(side=tkinter.LEFT)
+        self.button_frame.pack()
+        master.bind("b", lambda _: session.hold_blank())
+        self._last_print = time.perf_counter()
+        self._after_id = self.after(self.refresh_ms, self._poll)
+
+    def _poll(self):
+        self.view.refresh()
+        now = time.perf_counter()
+        if self.print_every > 0 and now - self._last_print >= self.print_every:
+            print(self.session.stats.summary())
+            self._last_print = now
+        self._after_id = self.after(self.refresh_ms, self._poll)
+
+    def stop_polling(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Show the absorbance spectrum live from the camera.")
+    parser.add_argument("--seconds", type=float, default=0.0,
+                        help="stop after this many seconds (0 runs until the "
+                             "window is closed)")
+    parser.add_argument("--no-display", action="store_true",
+                        help="don't draw anything; only print the frame rate "
+                             "and latencies")
+    args = parser.parse_args(argv)
+
+    session = LiveSession()
+    session.start()
+    if args.no_display:
+        start = time.perf_counter()
+        try:
+            while args.seconds <= 0 or time.perf_counter() - start < args.seconds:
+                time.sleep(2.0)
+                print(session.stats.summary())
+        except KeyboardInterrupt:
+            pass
+        session.stop()
+        return
+
+    root = tkinter.Tk()
+    root.title("Live Spectrum")
+    frame = LiveFrame(root, session)
+    frame.pack()
+
+    def close():
+        frame.stop_polling()
+        session.stop()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", close)
+    if args.seconds > 0:
+        root.after(int(1000 * args.seconds), close)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
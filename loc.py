@@ -4,21 +4,22 @@ This software is licensed under the MIT license.
 
 """
 
-import json
+from config import ConfigStore
 
 __author__ = "Daniel James Evans"
 __copyright__ = "Copyright 2019, Daniel James Evans"
 __license__ = "MIT"
 
-def set_loc(new_x, new_y, new_length):
-    """Update loc.json with new values."""
-    dict_loc = {"x" : new_x, "y" : new_y, "length" : new_length}
-    with open("loc.json", "w") as loc_file:
-        loc_file.truncate()
-        json.dump(dict_loc, loc_file)
+_loc_store = ConfigStore("loc.json")
+
+def set_loc(new_x, new_y, new_length, new_width=1, new_tilt=0.0, new_curve=0.0):
+    """Update loc.json with new values.  See roi.py for the meaning of width,
+    tilt and curve."""
+    dict_loc = {"x" : new_x, "y" : new_y, "length" : new_length,
+                "width" : new_width, "tilt" : new_tilt, "curve" : new_curve}
+    _loc_store.write(dict_loc)
 
 def get_loc():
-    """Read loc.json, and return its contents as a dictionary."""
-    with open("loc.json", "r") as loc_file:
-        dict_loc = json.load(loc_file)
-        return dict_loc
+    """Read loc.json, and return its contents as a dictionary.  The file is
+    only parsed again if it has changed."""
+    return _loc_store.read()
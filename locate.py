@@ -0,0 +1,137 @@
+"""This code finds the diffraction spectrum in a color image from the camera,
+so the user doesn't have to guess its location.  It is used by gui.py.
+
+The image is mostly dark.  The slit is a bright white rectangle, and the
+spectrum is a bright, colorful band above it.  So the band is found from
+profiles of brightness and color saturation:
+
+1. The column with the most saturated color (summed down the image) is the
+   center of the band.
+2. Near that column, the longest run of rows that are both bright and
+   colorful is the band's top and length.
+3. The centroid of each of those rows gives the band's tilt, and the width of
+   each row's profile gives the band's width.
+
+A detection less confident than MIN_CONFIDENCE is reported as no spectrum.
+An image with no spectrum (e.g. with the LED off) scores about 0.02, and a
+clear spectrum about 0.9.
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# Detections less confident than this are rejected.
+MIN_CONFIDENCE = 0.2
+
+
+def _longest_run(mask):
+    """Return (start, length) of the longest run of True values in a 1D boolean
+    array.  Return (0, 0) if there are none."""
+
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    if len(edges) == 0:
+        return 0, 0
+    starts, stops = edges[::2], edges[1::2]
+    longest = np.argmax(stops - starts)
+    return int(starts[longest]), int(stops[longest] - starts[longest])
+
+
+def detect_spectrum(image_array, min_length=10, min_confidence=MIN_CONFIDENCE):
+    """Find the diffraction spectrum in a color image.
+
+    Parameters
+    ----------
+    image_array : 3D numpy array
+        A (rows, columns, 3) uint8 RGB image, as returned by get_color_image().
+    min_length : int
+        Bands shorter than this many rows are not accepted.
+    min_confidence : float
+        Bands detected with less confidence than this are not accepted.
+
+    Returns
+    -------
+    dictionary or None
+        The proposed location, in the same format as loc.json, or None if no
+        band was found (or it was too uncertain).  The band is kept off the
+        first and last rows of the image, like the locate window requires.
+    float
+        How confident the detection is, from 0 (no spectrum) to 1.
+
+    """
+
+    num_rows, num_cols = image_array.shape[:2]
+    # Every other row and column is plenty for finding the band's column.
+    small = image_array[::2, ::2]
+    small_max = small.max(axis=2).astype(np.int16)
+    small_sat = small_max - small.min(axis=2)
+    col_profile = small_sat.sum(axis=0, dtype=np.float64)
+    # Smooth over 3 columns so single noisy columns don't win.
+    col_profile = np.convolve(col_profile, np.ones(3) / 3, mode="same")
+    peak_col = int(np.argmax(col_profile))
+    background = np.median(col_profile)
+    peak_height = col_profile[peak_col] - background
+    if peak_height <= 0:
+        return None, 0.0
+    center_x = 2 * peak_col
+
+    # Look at a strip of full-resolution columns around the band.
+    half_strip = max(num_cols // 40, 8)
+    left = max(center_x - half_strip, 0)
+    right = min(center_x + half_strip + 1, num_cols)
+    strip = image_array[:, left:right].astype(np.int16)
+    strip_max = strip.max(axis=2)
+    strip_sat = strip_max - strip.min(axis=2)
+    row_bright = strip_max.max(axis=1)
+    row_sat = strip_sat.max(axis=1)
+    dark = np.median(image_array[::4, ::4].max(axis=2))
+    bright_enough = row_bright > dark + 0.1 * (row_bright.max() - dark)
+    colorful = row_sat > 0.25 * np.maximum(row_bright - dark, 1)
+    y, length = _longest_run(bright_enough & colorful)
+    # Keep 1 <= y and y + length <= num_rows - 1.
+    if y == 0:
+        y, length = 1, length - 1
+    length = min(length, num_rows - 1 - y)
+    if length < min_length:
+        return None, 0.0
+
+    # The centroid of each row of the band, weighted by brightness above the
+    # dark level, gives its tilt.
+    band = np.clip(strip_max[y:y+length] - dark, 0, None).astype(np.float64)
+    band_totals = np.maximum(band.sum(axis=1), 1e-9)
+    centroids = (band * np.arange(left, right)[np.newaxis, :]).sum(axis=1) / band_totals
+    steps = np.arange(length)
+    tilt, start_x = np.polyfit(steps, centroids, 1)
+
+    # The width is the median over the rows of the full width at half maximum.
+    above_half = band >= band.max(axis=1, keepdims=True) / 2
+    width = max(int(np.median(np.count_nonzero(above_half, axis=1))), 1)
+
+    # A white (unsaturated) slit just below the band makes a detection more
+    # believable.
+    below = slice(y + length, min(y + length + num_rows // 4, num_rows))
+    slit_bright = row_bright[below] > dark + 0.5 * (row_bright.max() - dark)
+    slit_white = row_sat[below] < 0.25 * np.maximum(row_bright[below] - dark, 1)
+    has_slit = bool(np.any(slit_bright & slit_white))
+
+    # Confidence combines how much the band's column stands out, how much of
+    # the strip the band fills, how straight it is, and whether there is a
+    # slit.
+    prominence = peak_height / max(col_profile[peak_col], 1e-9)
+    fill = np.count_nonzero((bright_enough & colorful)[y:y+length]) / length
+    residual = np.std(centroids - (start_x + tilt * steps))
+    straightness = 1.0 / (1.0 + residual / max(width, 1))
+    confidence = prominence * fill * straightness * (1.0 if has_slit else 0.7)
+
+    confidence = float(np.clip(confidence, 0.0, 1.0))
+    if confidence < min_confidence:
+        return None, confidence
+    loc = {"x" : int(round(start_x)), "y" : int(y), "length" : int(length),
+           "width" : width, "tilt" : round(float(tilt), 4), "curve" : 0.0}
+    return loc, confidence
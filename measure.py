@@ -0,0 +1,270 @@
+"""This code contains the measurement math, separate from the GUI.  It is
+used by gui.py, and it can also be run from the command line to measure a
+blank and several samples without a display.  Usage:
+
+    python3 measure.py --samples 3 --interval 30 --out results
+
+The blank is measured immediately.  Each sample is measured after waiting
+--interval seconds (for example, while a robot swaps the cuvette).  A csv file
+(and optionally a graph) is written for each sample.  --labels names the
+samples instead of numbering them.  Each sample is processed and saved in the
+background while the next one is captured (see batch.py).
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from loc import get_loc
+from cal import get_cal
+from get_image import get_backend, get_bw_image_adaptive
+from roi import get_cropped_roi, get_roi
+from wavelength import COMMON_GRID, get_model
+from archive import get_archive
+from buffers import release_buffer
+from blank_cache import BLANK_TTL, CHECK_FRAMES, DRIFT_THRESHOLD, get_blank_cache
+from metrics import enable as enable_metrics, span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# The smallest signal (in grey levels) used when computing absorbance.
+MIN_SIGNAL = 0.5
+
+
+def extract_row(image_array, loc):
+    """Return the spectrum from a grayscale image, averaged across the width of
+    the band (see roi.py).
+
+    Parameters
+    ----------
+    image_array : 2D numpy array
+        A grayscale image, as returned by get_bw_image().
+    loc : dictionary
+        The location of the spectrum, as stored in loc.json.
+
+    """
+
+    with span("roi"):
+        return get_roi(loc, image_array.shape).extract(image_array)
+
+
+def compute_absorbance(blank_row, sample_row):
+    """Return the absorbance spectrum, log10(blank / sample).
+
+    The result is reversed so that it goes from low to high wavelength.
+
+    Parameters
+    ----------
+    blank_row : 1D list or numpy array
+        The data points from when the blank was measured.
+    sample_row : 1D list or numpy array
+        The data points from when the sample was measured.
+
+    """
+
+    with span("absorbance"):
+        # I don't want to do math on uint8s.  After the dark frame is
+        # subtracted (see exposure.py), a pixel can be 0, so the rows are kept
+        # above half a grey level.
+        sample_row = np.maximum(np.asarray(sample_row, dtype=np.float64), MIN_SIGNAL)
+        blank_row = np.maximum(np.asarray(blank_row, dtype=np.float64), MIN_SIGNAL)
+        data = np.log10(blank_row / sample_row)
+    # The top (low indices) is the high wavelength.
+    return data[::-1]
+
+
+def capture_row(loc=None, progress=None, cancel=None):
+    """Capture an averaged image and return the spectrum's pixels.  Only the
+    window around the spectrum is captured (see roi.get_cropped_roi()).
+
+    Parameters
+    ----------
+    loc : dictionary, optional
+        The location of the spectrum.  By default loc.json is read.
+    progress, cancel : optional
+        Passed to get_bw_image_adaptive().
+
+    """
+
+    if loc is None:
+        loc = get_loc()
+    window, roi = get_cropped_roi(loc, get_backend().frame_shape)
+    image_array, _ = get_bw_image_adaptive(roi.bounding_slices(), progress=progress,
+                                           cancel=cancel, window=window)
+    with span("roi"):
+        row = roi.extract(image_array)
+    release_buffer(image_array)
+    return row
+
+
+def capture_check_row(loc=None, cancel=None, num_frames=CHECK_FRAMES):
+    """Average num_frames frames and return the spectrum's pixels.  This is
+    much quicker than capture_row(), but noisier.  The frames are streamed
+    from the same window as capture_row()'s (on the Pi, from the video port),
+    so the row can be compared with a blank from capture_row()."""
+
+    if loc is None:
+        loc = get_loc()
+    window, roi = get_cropped_roi(loc, get_backend().frame_shape)
+    image_array, _ = get_bw_image_adaptive(roi.bounding_slices(), min_frames=num_frames,
+                                           max_frames=num_frames, cancel=cancel,
+                                           window=window)
+    with span("roi"):
+        row = roi.extract(image_array)
+    release_buffer(image_array)
+    return row
+
+
+def get_blank(loc=None, cal=None, force=False, progress=None, cancel=None):
+    """Return (blank row, reused) for a blank measurement.  A recent blank is
+    reused if a quick check shows it is still good; see blank_cache.py.  If
+    force is True, a new blank is always measured.  progress and cancel are
+    passed to the captures."""
+
+    if loc is None:
+        loc = get_loc()
+    if cal is None:
+        cal = get_cal()
+    return get_blank_cache().get_blank(
+        cal, loc, lambda loc: capture_row(loc, progress, cancel),
+        lambda loc: capture_check_row(loc, cancel), force)
+
+
+def wavelength_axis(cal, num_points):
+    """Return the wavelength (nm) of each point of an absorbance spectrum.
+
+    Parameters
+    ----------
+    cal : dictionary
+        The calibration, as stored in cal.json.
+    num_points : int
+        The length of the absorbance spectrum.
+
+    """
+
+    return get_model(cal, num_points).wavelengths
+
+
+def write_csv(file_loc, data, cal, resample=False):
+    """Save an absorbance spectrum as a csv file with a wavelength column and an
+    absorbance column.
+
+    Parameters
+    ----------
+    file_loc : string
+        The path of the csv file.
+    data : 1D numpy array
+        The absorbance spectrum.
+    cal : dictionary
+        The calibration, as stored in cal.json.
+    resample : bool
+        If True, the spectrum is interpolated onto the common 1 nm grid (see
+        wavelength.py), so that files from different instruments line up.
+
+    """
+
+    with span("persist_csv"):
+        model = get_model(cal, len(data))
+        if resample:
+            grid_range = model.common_grid_range()
+            columns = np.column_stack((COMMON_GRID[grid_range],
+                                       model.resample(data)[grid_range]))
+        else:
+            columns = np.column_stack((model.wavelengths, data))
+        # Format the whole table with one string operation.
+        rows = ("%.10g,%.10g\n" * len(columns)) % tuple(columns.ravel())
+        with open(file_loc, mode="w") as csv_file:
+            csv_file.write("Wavelength (nm),Absorbance\n")
+            csv_file.write(rows)
+
+
+def archive_result(title, data, blank_row, sample_row, cal, loc):
+    """Add a measurement to the archive (see archive.py) and return its id.
+    The rows are stored in the same order as data (low to high wavelength)."""
+
+    return get_archive().append(title, data, np.asarray(blank_row)[::-1],
+                                np.asarray(sample_row)[::-1], cal, {"loc" : loc})
+
+
+def run_batch(labels, out_dir, interval=0.0, save_graphs=False, resample=False,
+              new_blank=False, workers=2):
+    """Measure a blank (or reuse a recent one unless new_blank is True), then
+    one sample for each label, writing a csv file for each sample into out_dir.
+    Return a list of the absorbance spectra."""
+
+    # batch.py imports this module, so it is imported here.
+    from batch import run_queue
+
+    os.makedirs(out_dir, exist_ok=True)
+    loc = get_loc()
+    cal = get_cal()
+    blank_row, reused = get_blank(loc, cal, new_blank)
+    if reused:
+        print("Reused the cached blank (drift %.3f)." % get_blank_cache().last_drift)
+
+    def before_capture(label):
+        if interval > 0:
+            time.sleep(interval)
+        print("Measuring %s" % label)
+
+    results = run_queue(labels, blank_row, cal, loc, before_capture, workers,
+                        out_dir=out_dir, save_graph=save_graphs, resample=resample)
+    return [result["absorbance"] for result in results]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure a blank and several samples without the GUI.")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="number of samples to measure after the blank")
+    parser.add_argument("--out", default="results",
+                        help="directory to write the results to")
+    parser.add_argument("--title", default="sample",
+                        help="prefix of the result file names")
+    parser.add_argument("--labels",
+                        help="comma-separated sample names (overrides --samples "
+                             "and --title)")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="threads for processing and saving results")
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="seconds to wait before each sample")
+    parser.add_argument("--new-blank", action="store_true",
+                        help="always measure a new blank instead of reusing a "
+                             "recent one")
+    parser.add_argument("--blank-ttl", type=float,
+                        help="seconds a blank may be reused for (default %d)"
+                             % BLANK_TTL)
+    parser.add_argument("--drift", type=float,
+                        help="largest relative drift at which a blank is reused "
+                             "(default %.2f)" % DRIFT_THRESHOLD)
+    parser.add_argument("--grid", action="store_true",
+                        help="save the csv files on the common 1 nm wavelength grid")
+    parser.add_argument("--graphs", action="store_true",
+                        help="also save a graph of each sample")
+    parser.add_argument("--metrics", metavar="DIR",
+                        help="write timing logs and a Prometheus metrics file "
+                             "to DIR (see metrics.py)")
+    args = parser.parse_args(argv)
+    if args.metrics is not None:
+        enable_metrics(args.metrics)
+    if args.blank_ttl is not None:
+        get_blank_cache().ttl = args.blank_ttl
+    if args.drift is not None:
+        get_blank_cache().drift_threshold = args.drift
+    if args.labels is not None:
+        labels = [label.strip() for label in args.labels.split(",") if label.strip()]
+    else:
+        labels = ["%s_%d" % (args.title, i + 1) for i in range(args.samples)]
+    run_batch(labels, args.out, args.interval, args.graphs, args.grid, args.new_blank,
+              args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""This code records how long each stage of a measurement takes, and counts
+things like frames captured and saturated pixels.
+
+Metrics are off by default.  They are turned on by setting the environment
+variable SPECTRO_METRICS to a directory, or by calling enable().  Two files
+are written there:
+
+* events.jsonl: one JSON object per line for every timed span, e.g.
+  {"time": 1571234567.1, "event": "span", "name": "capture", "ms": 412.5}
+* metrics.prom: the totals in the Prometheus text format, rewritten at most
+  once per second (and when the program exits), for a local scraper such as
+  node_exporter's textfile collector.
+
+Usage in the code:
+
+    with metrics.span("capture"):
+        ...
+    metrics.count("frames_captured")
+
+While metrics are off, span() returns a shared object that does nothing and
+count() returns immediately, so the cost is one function call.  Code that
+has to do extra work to produce a metric (e.g. counting saturated pixels)
+should check metrics.enabled() first.
+
+This software is licensed under the MIT license.
+
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+PREFIX = "spectro"
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class _NullSpan():
+    """Does nothing; returned by span() while metrics are off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    """Times the code inside a with statement and reports it to registry."""
+
+    def __init__(self, registry, name, fields):
+        self.registry = registry
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.registry.observe(self.name, seconds, self.fields)
+        return False
+
+
+class Registry():
+    """Counters and latency histograms, with their output files.
+
+    Parameters
+    ----------
+    directory : string
+        Where events.jsonl and metrics.prom are written.
+    write_interval : float
+        The shortest time (seconds) between rewrites of metrics.prom.
+
+    """
+
+    def __init__(self, directory, write_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prom_loc = os.path.join(directory, "metrics.prom")
+        self.write_interval = write_interval
+        self.counters = {}
+        # name: [count in each bucket (not cumulative) plus one for +Inf,
+        #        sum of seconds, count]
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self._log = open(os.path.join(directory, "events.jsonl"), "a")
+
+    def _log_event(self, event):
+        # The caller holds the lock.
+        self._log.write(json.dumps(event) + "\n")
+        self._log.flush()
+
+    def _maybe_write(self):
+        now = time.monotonic()
+        if now - self._last_write >= self.write_interval:
+            self._last_write = now
+            self.write_prometheus()
+
+    def observe(self, name, seconds, fields=None):
+        """Record that the stage name took seconds."""
+
+        event = {"time" : time.time(), "event" : "span", "name" : name,
+                 "ms" : round(1000 * seconds, 3)}
+        if fields:
+            event.update(fields)
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            bucket = 0
+            while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+                bucket += 1
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            self._log_event(event)
+        self._maybe_write()
+
+    def count(self, name, value=1):
+        """Add value to the counter name."""
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._maybe_write()
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text format."""
+
+        lines = []
+        with self._lock:
+            for name in sorted(self.counters):
+                metric = "%s_%s_total" % (PREFIX, name)
+                lines.append("# TYPE %s counter" % metric)
+                lines.append("%s %s" % (metric, self.counters[name]))
+            if self.histograms:
+                metric = "%s_stage_seconds" % PREFIX
+                lines.append("# TYPE %s histogram" % metric)
+            for name in sorted(self.histograms):
+                buckets, total, count = self.histograms[name]
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ("+Inf",), buckets):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d' %
+                                 (metric, name, bound, cumulative))
+                lines.append('%s_sum{stage="%s"} %.6f' % (metric, name, total))
+                lines.append('%s_count{stage="%s"} %d' % (metric, name, count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Rewrite metrics.prom.  A scraper never sees a partly written file
+        because the new file is renamed over the old one."""
+
+        # config.py imports this module, so it is imported here.
+        from config import write_atomic
+
+        text = self.to_prometheus()
+        write_atomic(self.prom_loc, lambda prom_file: prom_file.write(text), mode="w")
+
+    def close(self):
+        self.write_prometheus()
+        with self._lock:
+            self._log.close()
+
+
+_registry = None
+
+def enabled():
+    """Return True if metrics are being recorded."""
+    return _registry is not None
+
+def enable(directory="metrics", write_interval=1.0):
+    """Start recording metrics into directory.  Return the Registry."""
+
+    global _registry
+    if _registry is None:
+        _registry = Registry(directory, write_interval)
+        atexit.register(disable)
+    return _registry
+
+def disable():
+    """Stop recording metrics, after writing them out."""
+
+    global _registry
+    registry, _registry = _registry, None
+    if registry is not None:
+        registry.close()
+
+def span(name, **fields):
+    """Return a context manager that times the code inside it as the stage
+    name.  fields are added to the log line."""
+
+    if _registry is None:
+        return _NULL_SPAN
+    return _Span(_registry, name, fields)
+
+def count(name, value=1):
+    """Add value to the counter name."""
+
+    if _registry is not None:
+        _registry.count(name, value)
+
+
+if os.environ.get("SPECTRO_METRICS"):
+    enable(os.environ["SPECTRO_METRICS"])
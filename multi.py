@@ -0,0 +1,559 @@
+"""This code runs several spectrophotometers from one computer.
+
+Each instrument gets its own capture process, with its own camera backend
+(see camera_backend.py), so the instruments capture at the same time and a
+slow or stuck camera doesn't hold up the others.  Averaged frames come back
+through shared memory: each instrument has a few frame-sized slots in a
+multiprocessing.shared_memory block, the worker process writes the averaged
+image into a free slot, and only the slot number is sent back.  The
+controller reads the image in place, without pickling or copying it, and
+releases the slot when it is done.
+
+The controller schedules the work: capture() queues a capture on one
+instrument, capture_any() picks the instrument with the fewest captures
+waiting, measure() captures on several instruments at once, and
+run_schedule() measures every instrument at a fixed interval.
+
+Instruments are described by dictionaries:
+
+    {"name" : "bench 1", "camera" : "pi", "resolution" : [640, 480],
+     "led_pin" : 4, "loc" : {...}, "cal" : {...}}
+
+"camera" is "pi" or "sim" (the simulated camera in sim_camera.py; "seed",
+"brightness" and "noise" are passed on to it).  "loc" and "cal" default to
+loc.json and cal.json (or, for simulated cameras, where the spectrum is
+drawn).  If "exposure" (or the "exposure" entry of "cal") holds exposure
+settings (see exposure.py), the instrument's exposure is locked to them, and
+its dark frame is kept in "dark_file" (by default dark_frame_NAME.npz).
+
+If a capture process stops, or fails outside a command, every capture
+waiting on it fails with a RuntimeError, and so do later ones.
+
+Usage: "python3 multi.py --sim 3" measures three simulated instruments, and
+"python3 multi.py --config instruments.json" reads a list of instruments.
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# The number of frame slots per instrument.  With two, the controller can
+# process one frame while the next one is captured.
+NUM_SLOTS = 2
+# Seconds between checks that the capture processes are still running.
+WATCH_INTERVAL = 1.0
+# Seconds measure() and measure_blank() wait for the captures.
+CAPTURE_TIMEOUT = 120.0
+
+
+def _attach_shared_memory(name):
+    """Open an existing shared memory block, which the controller owns."""
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, there is no track argument.  The worker shares
+        # the controller's resource tracker, which already knows the block,
+        # so attaching doesn't change who deletes it.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _make_backend(spec):
+    """Create the camera backend described by spec."""
+
+    resolution = tuple(spec.get("resolution", (640, 480)))
+    if spec.get("camera", "pi") == "sim":
+        from sim_camera import SimulatedCamera
+        options = {key : spec[key] for key in ("seed", "brightness", "noise",
+                                               "realtime") if key in spec}
+        return SimulatedCamera(resolution=resolution, loc=spec.get("loc"), **options)
+    from camera_backend import PiCameraBackend
+    return PiCameraBackend(resolution=resolution, led_pin=spec.get("led_pin", 4))
+
+
+def _worker_main(name, spec, memory_name, num_slots, commands, results):
+    """The capture process of one instrument.  It runs commands from its
+    queue one at a time and reports on the shared results queue."""
+
+    from batch import label_filename
+    from buffers import release_buffer
+    from exposure import DarkFrame, get_exposure_profile, set_dark_frame
+    from get_image import get_bw_image, set_backend
+    from sim_camera import gaussian_absorbance
+
+    block = _attach_shared_memory(memory_name)
+    slots = None
+    try:
+        backend = _make_backend(spec)
+        set_backend(backend)
+        # Each instrument has its own exposure settings and dark frame.
+        if "exposure" in spec:
+            exposure = spec["exposure"]
+        elif spec.get("cal") is not None:
+            exposure = spec["cal"].get("exposure")
+        else:
+            exposure = get_exposure_profile()
+        if exposure is not None:
+            backend.lock_exposure(exposure)
+        set_dark_frame(DarkFrame(spec.get(
+            "dark_file", "dark_frame_%s.npz" % label_filename(name))))
+        slots = np.ndarray((num_slots,) + backend.frame_shape, dtype=np.uint8,
+                           buffer=block.buf)
+        results.put(("ready", name, None, {"loc" : getattr(backend, "loc", None)}))
+        while True:
+            command = commands.get()
+            if command[0] == "stop":
+                break
+            kind, job_id, args = command
+            try:
+                if kind == "capture":
+                    slot, num_frames = args
+                    start = time.perf_counter()
+                    image = get_bw_image(num_frames)
+                    slots[slot] = image
+                    release_buffer(image)
+                    results.put(("done", name, job_id,
+                                 (slot, time.perf_counter() - start)))
+                elif kind == "sample":
+                    backend.set_sample(gaussian_absorbance(*args) if args else None)
+                    results.put(("done", name, job_id, None))
+                else:
+                    raise ValueError("Unknown command %r" % kind)
+            except Exception as error:
+                results.put(("error", name, job_id, "%s: %s" % (type(error).__name__,
+                                                                error)))
+        backend.close()
+    except Exception as error:
+        results.put(("error", name, None, "%s: %s" % (type(error).__name__, error)))
+    finally:
+        # The array must go before the block can be closed.
+        del slots
+        block.close()
+
+
+def _release_frame(future):
+    """Release the Frame of a finished capture, if it succeeded."""
+
+    if not future.cancelled() and future.exception() is None:
+        future.result().release()
+
+
+class Frame():
+    """An averaged image in an instrument's shared memory slot.
+
+    image is a view of the shared memory, so it is only valid until
+    release() is called.  Frames can be used in with statements, which
+    release them at the end.
+
+    """
+
+    def __init__(self, controller, instrument, slot, capture_time):
+        self.controller = controller
+        self.instrument = instrument
+        self.slot = slot
+        self.capture_time = capture_time
+        self.image = instrument.slots[slot]
+
+    def release(self):
+        if self.image is not None:
+            self.image = None
+            self.controller._release_slot(self.instrument, self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+class Instrument():
+    """The controller's record of one instrument and its capture process."""
+
+    def __init__(self, spec, context, results, num_slots):
+        self.spec = dict(spec)
+        self.name = spec["name"]
+        resolution = tuple(spec.get("resolution", (640, 480)))
+        self.shape = (resolution[1], resolution[0])
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=num_slots * self.shape[0] * self.shape[1])
+        self.slots = np.ndarray((num_slots,) + self.shape, dtype=np.uint8,
+                                buffer=self.memory.buf)
+        self.free_slots = list(range(num_slots))
+        # Captures waiting for a free slot, as (job id, number of frames).
+        self.waiting = collections.deque()
+        self.commands = context.Queue()
+        self.process = context.Process(
+            target=_worker_main, name="instrument %s" % self.name, daemon=True,
+            args=(self.name, self.spec, self.memory.name, num_slots, self.commands,
+                  results))
+        self.loc = spec.get("loc")
+        self.cal = spec.get("cal")
+        self.blank_row = None
+        self.pending = 0
+        self.job_ids = set()
+        # Why the capture process stopped, or None while it runs.
+        self.failed = None
+
+    def close(self):
+        self.slots = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+class InstrumentController():
+    """Runs and schedules several instruments.
+
+    Parameters
+    ----------
+    specs : list of dictionaries
+        The instruments; see the top of this file.
+    num_slots : int
+        Frame slots per instrument.
+    start_method : string
+        The multiprocessing start method.  "spawn" starts each worker in a
+        fresh interpreter, which is safe even if the controller has threads
+        (e.g. a GUI).
+
+    """
+
+    def __init__(self, specs, num_slots=NUM_SLOTS, start_method="spawn"):
+        self._context = multiprocessing.get_context(start_method)
+        self._results = self._context.Queue()
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._listener = None
+        self.instruments = {}
+        for spec in specs:
+            if spec["name"] in self.instruments:
+                raise ValueError("Two instruments are named %r." % spec["name"])
+            self.instruments[spec["name"]] = Instrument(spec, self._context,
+                                                        self._results, num_slots)
+
+    def start(self, timeout=60.0):
+        """Start the capture processes and wait until every camera is open."""
+
+        for instrument in self.instruments.values():
+            instrument.process.start()
+        waiting = set(self.instruments)
+        deadline = time.monotonic() + timeout
+        while waiting:
+            try:
+                kind, name, _, info = self._results.get(
+                    timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                self.close()
+                raise TimeoutError("No reply from %s." % ", ".join(sorted(waiting)))
+            if kind == "error":
+                self.close()
+                raise RuntimeError("Instrument %s failed to start: %s" % (name, info))
+            instrument = self.instruments[name]
+            if instrument.loc is None:
+                instrument.loc = info["loc"]
+            waiting.discard(name)
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        """Hand the workers' replies to the waiting futures, and fail the
+        futures of workers that have stopped."""
+
+        last_check = time.monotonic()
+        while True:
+            try:
+                kind, name, job_id, info = self._results.get(timeout=WATCH_INTERVAL)
+            except queue.Empty:
+                kind = None
+            if time.monotonic() - last_check >= WATCH_INTERVAL or kind is None:
+                last_check = time.monotonic()
+                for instrument in list(self.instruments.values()):
+                    if instrument.failed is None and not instrument.process.is_alive():
+                        self._fail(instrument, "the capture process stopped "
+                                               "(exit code %s)" % instrument.process.exitcode)
+            if kind is None:
+                continue
+            if kind == "closed":
+                return
+            instrument = self.instruments[name]
+            if job_id is None:
+                # The worker failed outside a command, and has stopped.
+                self._fail(instrument, info)
+                continue
+            with self._lock:
+                job = self._jobs.pop(job_id, None)
+                if job is not None:
+                    instrument.pending -= 1
+                    instrument.job_ids.discard(job_id)
+            if job is None:
+                continue
+            future, on_result, slot = job
+            if kind == "done":
+                try:
+                    future.set_result(on_result(info))
+                except Exception as error:
+                    future.set_exception(error)
+            else:
+                if slot is not None:
+                    self._release_slot(instrument, slot)
+                future.set_exception(RuntimeError("Instrument %s: %s" % (name, info)))
+
+    def _fail(self, instrument, message):
+        """Mark an instrument as stopped, and fail all of its jobs."""
+
+        with self._lock:
+            if instrument.failed is not None:
+                return
+            instrument.failed = message
+            jobs = [self._jobs.pop(job_id) for job_id in instrument.job_ids]
+            instrument.job_ids.clear()
+            instrument.waiting.clear()
+            instrument.pending = 0
+        for future, _, _ in jobs:
+            future.set_exception(RuntimeError("Instrument %s: %s"
+                                              % (instrument.name, message)))
+
+    def _new_job(self, instrument, on_result, slot=None):
+        """Register a job and return its id and Future.  The caller holds the
+        lock.  If the instrument has stopped, the id is None and the Future
+        has already failed."""
+
+        future = Future()
+        if instrument.failed is not None:
+            future.set_exception(RuntimeError("Instrument %s: %s"
+                                              % (instrument.name, instrument.failed)))
+            return None, future
+        job_id = next(self._job_ids)
+        self._jobs[job_id] = (future, on_result, slot)
+        instrument.job_ids.add(job_id)
+        instrument.pending += 1
+        return job_id, future
+
+    def _submit(self, name, kind, args):
+        instrument = self.instruments[name]
+        with self._lock:
+            job_id, future = self._new_job(instrument, lambda info: info)
+        if job_id is not None:
+            instrument.commands.put((kind, job_id, args))
+        return future
+
+    def _release_slot(self, instrument, slot):
+        """Give a slot to the next waiting capture, or mark it free."""
+
+        with self._lock:
+            if instrument.waiting:
+                job_id, num_frames = instrument.waiting.popleft()
+                future, on_result, _ = self._jobs[job_id]
+                self._jobs[job_id] = (future, on_result, slot)
+                instrument.commands.put(("capture", job_id, (slot, num_frames)))
+            else:
+                instrument.free_slots.append(slot)
+
+    def capture(self, name, num_frames=5):
+        """Queue a capture of num_frames averaged frames on an instrument.
+        Return a Future of a Frame.
+
+        If every slot of the instrument holds a frame that hasn't been
+        released, the capture waits in the controller until one is, so it
+        may run after commands that were queued later.
+
+        """
+
+        instrument = self.instruments[name]
+        on_result = lambda info: Frame(self, instrument, info[0], info[1])
+        with self._lock:
+            if instrument.failed is not None:
+                return self._new_job(instrument, on_result)[1]
+            slot = instrument.free_slots.pop() if instrument.free_slots else None
+            job_id, future = self._new_job(instrument, on_result, slot)
+            if slot is None:
+                instrument.waiting.append((job_id, num_frames))
+            else:
+                instrument.commands.put(("capture", job_id, (slot, num_frames)))
+        return future
+
+    def capture_any(self, num_frames=5):
+        """Queue a capture on the instrument with the fewest captures waiting.
+        Return (name, Future of a Frame)."""
+
+        with self._lock:
+            name = min(self.instruments, key=lambda key: self.instruments[key].pending)
+        return name, self.capture(name, num_frames)
+
+    def set_sample(self, name, center=None, width=None, height=None):
+        """Put a simulated sample (see sim_camera.gaussian_absorbance()) in a
+        simulated instrument, or take it out if center is None.  Return a
+        Future."""
+
+        args = None if center is None else (center, width, height)
+        return self._submit(name, "sample", args)
+
+    def instrument_cal(self, name):
+        """Return the calibration of an instrument."""
+
+        instrument = self.instruments[name]
+        if instrument.cal is None:
+            from cal import get_cal
+            instrument.cal = get_cal()
+        return instrument.cal
+
+    def _rows(self, names, num_frames, timeout):
+        """Capture on every named instrument at once, and return the spectrum
+        row of each.  If they don't all arrive within timeout seconds,
+        concurrent.futures.TimeoutError is raised."""
+
+        from loc import get_loc
+        from measure import extract_row
+
+        futures = {name : self.capture(name, num_frames) for name in names}
+        deadline = time.monotonic() + timeout
+        rows = {}
+        try:
+            for name, future in futures.items():
+                instrument = self.instruments[name]
+                if instrument.loc is None:
+                    instrument.loc = get_loc()
+                with future.result(max(deadline - time.monotonic(), 0.0)) as frame:
+                    rows[name] = extract_row(frame.image, instrument.loc)
+        except BaseException:
+            # Free the slots of the frames that weren't used (now, or when
+            # they arrive).
+            for future in futures.values():
+                future.add_done_callback(_release_frame)
+            raise
+        return rows
+
+    def measure_blank(self, names=None, num_frames=5, timeout=CAPTURE_TIMEOUT):
+        """Measure the blank on the named instruments (all by default) at
+        once."""
+
+        names = list(self.instruments) if names is None else names
+        for name, row in self._rows(names, num_frames, timeout).items():
+            self.instruments[name].blank_row = row
+
+    def measure(self, names=None, num_frames=5, timeout=CAPTURE_TIMEOUT):
+        """Measure samples on the named instruments (all by default) at once.
+        Return a dictionary of absorbance spectra by instrument name.  If the
+        captures take longer than timeout seconds,
+        concurrent.futures.TimeoutError is raised."""
+
+        from measure import compute_absorbance
+
+        names = list(self.instruments) if names is None else names
+        missing = [name for name in names if self.instruments[name].blank_row is None]
+        if missing:
+            raise ValueError("Measure the blank first on %s." % ", ".join(missing))
+        return {name : compute_absorbance(self.instruments[name].blank_row, row)
+                for name, row in self._rows(names, num_frames, timeout).items()}
+
+    def run_schedule(self, interval, duration, callback, names=None, num_frames=5):
+        """Measure the named instruments every interval seconds for duration
+        seconds.  callback(elapsed, spectra) is called after each round, with
+        the result of measure()."""
+
+        start = time.monotonic()
+        next_time = start
+        while next_time - start <= duration:
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            callback(time.monotonic() - start, self.measure(names, num_frames))
+            next_time += interval
+
+    def close(self):
+        """Stop the capture processes and free the shared memory."""
+
+        for instrument in self.instruments.values():
+            if instrument.process.is_alive():
+                instrument.commands.put(("stop",))
+        for instrument in self.instruments.values():
+            if instrument.process.pid is not None:
+                instrument.process.join(timeout=10)
+                if instrument.process.is_alive():
+                    instrument.process.terminate()
+        if self._listener is not None:
+            self._results.put(("closed", None, None, None))
+            self._listener.join()
+            self._listener = None
+        for instrument in self.instruments.values():
+            instrument.close()
+        self.instruments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def main(argv=None):
+    from measure import wavelength_axis
+
+    parser = argparse.ArgumentParser(description="Measure several instruments "
+                                                 "from one computer.")
+    parser.add_argument("--config", help="JSON file with a list of instruments")
+    parser.add_argument("--sim", type=int, default=0,
+                        help="add this many simulated instruments")
+    parser.add_argument("--frames", type=int, default=5, help="frames per capture")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="seconds between rounds of measurements")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="keep measuring for this many seconds")
+    args = parser.parse_args(argv)
+
+    specs = []
+    if args.config is not None:
+        with open(args.config) as config_file:
+            specs.extend(json.load(config_file))
+    for i in range(args.sim):
+        specs.append({"name" : "sim %d" % (i + 1), "camera" : "sim", "seed" : i,
+                      "realtime" : True})
+    if not specs:
+        parser.error("Give --config or --sim.")
+
+    with InstrumentController(specs) as controller:
+        start = time.perf_counter()
+        controller.start()
+        print("Started %d instruments in %.1f s." % (len(specs),
+                                                     time.perf_counter() - start))
+        start = time.perf_counter()
+        controller.measure_blank(num_frames=args.frames)
+        print("Blanks measured in %.2f s." % (time.perf_counter() - start))
+        # Give each simulated instrument a different sample.
+        futures = [controller.set_sample(spec["name"], 450.0 + 60.0 * i, 40.0, 0.8)
+                   for i, spec in enumerate(specs) if spec.get("camera") == "sim"]
+        for future in futures:
+            future.result()
+
+        def report(elapsed, spectra):
+            for name, data in sorted(spectra.items()):
+                wavelengths = wavelength_axis(controller.instrument_cal(name), len(data))
+                peak = int(np.nanargmax(data))
+                print("%7.2f s  %-10s peak %.3f at %.1f nm" % (
+                    elapsed, name, data[peak], wavelengths[peak]))
+
+        start = time.perf_counter()
+        controller.run_schedule(args.interval, args.duration, report,
+                                num_frames=args.frames)
+        print("Measured for %.2f s." % (time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
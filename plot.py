@@ -0,0 +1,149 @@
+"""This code contains functions called by gui.py and measure.py.
+
+Graphs are drawn by a single SpectrumRenderer that keeps one figure and one
+line.  Each new spectrum only updates the line's data, so no figures pile up
+in memory, and the rendered graph is handed to the GUI as a PIL image
+without going through a file.
+
+matplotlib takes most of a second to import on the Pi, so it is only
+imported when the first SpectrumRenderer is created.
+
+This software is licensed under the MIT license.
+
+"""
+
+import threading
+
+import numpy as np
+from PIL import Image
+
+from wavelength import get_model
+from metrics import span
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+class SpectrumRenderer():
+    """Draws absorbance spectra, reusing the same figure every time.
+
+    The figure isn't managed by pyplot, so it is never kept alive by pyplot's
+    list of open figures.
+
+    """
+
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.fig = Figure()
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.axes = self.fig.add_subplot(1, 1, 1)
+        self.axes.set_xlabel("Wavelength (nm)")
+        self.axes.set_ylabel("Absorbance")
+        self.line, = self.axes.plot([], [])
+        self._ticks_key = None
+
+    def update(self, data, cal, data_title):
+        """Replace the graphed spectrum.
+
+        Parameters
+        ----------
+        data : 1D list or numpy array
+            It contains the y-values of the points to be graphed.  The x-values
+            should be evenly spaced points between the min and max described in
+            cal.
+        cal : dictionary
+            The calibration, as stored in cal.json.  It is used to label the
+            x-axis with wavelengths.
+        data_title : string
+            The title of the graph.
+
+        """
+
+        data = np.asarray(data)
+        self.axes.set_title(data_title)
+        self.line.set_data(np.arange(len(data)), data)
+        # The tick labels only change when the calibration or the length does.
+        model = get_model(cal, len(data))
+        ticks_key = (len(data), model.coeffs)
+        if ticks_key != self._ticks_key:
+            xticks_locs = np.linspace(0, len(data), 6)
+            xticks_labels = np.char.mod("%.2f", np.round(model.at(xticks_locs), 2))
+            self.axes.set_xticks(xticks_locs)
+            self.axes.set_xticklabels(xticks_labels)
+            self._ticks_key = ticks_key
+        self.axes.relim()
+        self.axes.autoscale_view()
+
+    def render(self):
+        """Draw the figure and return it as a PIL image."""
+
+        with span("plot"):
+            self.canvas.draw()
+            buffer = self.canvas.buffer_rgba()
+            # Copy, because the buffer is reused by the next draw.
+            return Image.frombuffer("RGBA", self.canvas.get_width_height(), buffer,
+                                    "raw", "RGBA", 0, 1).copy()
+
+    def save(self, out_file_loc):
+        """Save the figure as an image file."""
+
+        with span("plot_save"):
+            self.fig.savefig(out_file_loc)
+
+
+_renderer = None
+# The shared renderer may be used from the GUI thread and from worker threads.
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """Return the shared SpectrumRenderer, creating it the first time."""
+
+    global _renderer
+    if _renderer is None:
+        _renderer = SpectrumRenderer()
+    return _renderer
+
+
+def render_fig(data, cal, data_title):
+    """Graph data and return the result as a PIL image.
+
+    The function takes a 1D array of y-values; it assumes that the x-values are evenly
+    spaced.  See SpectrumRenderer.update() for the parameters.
+
+    """
+
+    with _renderer_lock:
+        renderer = get_renderer()
+        renderer.update(data, cal, data_title)
+        return renderer.render()
+
+
+def plot_fig(data, out_file_loc, cal, data_title):
+    """Graph data and save the result as an image.
+
+    The function takes a 1D array of y-values; it assumes that the x-values are evenly
+    spaced.
+
+    Parameters
+    ----------
+    data : 1D list or numpy array
+        It contains the y-values of the points to be graphed.  The x-values should be
+        evenly spaced points between the min and max described in cal.
+    out_file_loc : string
+        The path of where the image should be saved to.
+    cal : dictionary
+        It contains 2 keys: "min" and "max".  The values are the minimum and maximum
+        values (float or int) of the x-axis.
+    data_title : string
+        The title of the graph.
+
+    """
+
+    with _renderer_lock:
+        renderer = get_renderer()
+        renderer.update(data, cal, data_title)
+        renderer.save(out_file_loc)
@@ -0,0 +1,307 @@
+"""This code cleans up absorbance spectra and finds their peaks.  It is used by
+gui.py and batch.py, between computing the absorbance and graphing it.
+
+The steps are:
+
+* smoothing: "savgol" (Savitzky-Golay: a polynomial of degree "order" fitted
+  over "window" points) or "gaussian" (a Gaussian of width "sigma" points),
+  or "none".  Either one is a linear filter, so it is precomputed as a
+  matrix for each spectrum length, with the ends handled by fitting (for
+  Savitzky-Golay) or renormalizing (for Gaussian).  Smoothing a spectrum, or
+  a whole stack of them, is then one matrix product.
+* baseline: "offset" subtracts the lowest point, "linear" subtracts the line
+  through the averages of the first and last "baseline_edge" share of the
+  points, and "none" leaves the spectrum alone.
+* peaks: every local maximum at least "min_height" high and "min_prominence"
+  above the surrounding spectrum, with its wavelength, height and full width
+  at half maximum (FWHM).
+
+The settings are read from postprocess.json; missing settings take the
+values in DEFAULT_SETTINGS, which leave the spectrum unchanged.  Usage:
+"python3 postprocess.py --smoothing savgol --window 9" changes them, and
+"python3 postprocess.py" shows them.
+
+Every function takes a single spectrum or a stack of spectra (one per row).
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+
+import numpy as np
+
+from config import ConfigStore
+from wavelength import get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+DEFAULT_SETTINGS = {"smoothing" : "none", "window" : 7, "order" : 2, "sigma" : 1.5,
+                    "baseline" : "none", "baseline_edge" : 0.05,
+                    "min_height" : 0.02, "min_prominence" : 0.05, "max_peaks" : 10}
+_settings_store = ConfigStore("postprocess.json")
+
+
+def get_settings():
+    """Return the post-processing settings."""
+
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        settings.update(_settings_store.read())
+    except (OSError, ValueError):
+        pass
+    return settings
+
+def set_settings(**changes):
+    """Change some of the post-processing settings."""
+
+    settings = get_settings()
+    settings.update(changes)
+    _settings_store.write(settings)
+
+
+def _savgol_matrix(num_points, window, order):
+    """Return the (num_points, num_points) Savitzky-Golay smoothing matrix."""
+
+    window = min(window | 1, num_points if num_points % 2 else num_points - 1)
+    order = min(order, window - 1)
+    half = window // 2
+    offsets = np.arange(-half, half + 1)
+    # Row i of fit_values gives the fitted polynomial's value at offset i from
+    # the window's first point, as weights on the window's points.
+    vandermonde = np.vander(offsets, order + 1, increasing=True)
+    fit_values = vandermonde @ np.linalg.pinv(vandermonde)
+    matrix = np.zeros((num_points, num_points))
+    for i in range(num_points):
+        # The window is centered on i, except near the ends, where it is
+        # pushed inside and the fitted polynomial is evaluated off-center.
+        start = min(max(i - half, 0), num_points - window)
+        matrix[i, start:start + window] = fit_values[i - start]
+    return matrix
+
+def _gaussian_matrix(num_points, sigma):
+    """Return the (num_points, num_points) Gaussian smoothing matrix.  Each
+    row is normalized to add up to 1, so the ends aren't pulled down."""
+
+    positions = np.arange(num_points)
+    distance = positions[:, np.newaxis] - positions[np.newaxis, :]
+    matrix = np.exp(-0.5 * (distance / sigma)**2)
+    matrix[np.abs(distance) > 4 * sigma] = 0.0
+    return matrix / matrix.sum(axis=1, keepdims=True)
+
+
+_kernel_cache = {}
+
+def smoothing_matrix(num_points, settings):
+    """Return the smoothing matrix for spectra num_points long, or None if
+    there is no smoothing.  It is only computed the first time."""
+
+    method = settings["smoothing"]
+    if method == "savgol":
+        key = (method, num_points, int(settings["window"]), int(settings["order"]))
+    elif method == "gaussian":
+        key = (method, num_points, float(settings["sigma"]))
+    else:
+        return None
+    matrix = _kernel_cache.get(key)
+    if matrix is None:
+        if len(_kernel_cache) > 16:
+            _kernel_cache.clear()
+        if method == "savgol":
+            matrix = _savgol_matrix(num_points, key[2], key[3])
+        else:
+            matrix = _gaussian_matrix(num_points, key[2])
+        _kernel_cache[key] = matrix
+    return matrix
+
+
+def smooth(data, settings):
+    """Return smoothed spectra.  NaNs (e.g. from a pixel with no light) are
+    treated as 0 by the filter."""
+
+    data = np.asarray(data, dtype=np.float64)
+    matrix = smoothing_matrix(data.shape[-1], settings)
+    if matrix is None:
+        return data
+    return np.nan_to_num(data, nan=0.0, posinf=0.0, neginf=0.0) @ matrix.T
+
+def correct_baseline(data, settings):
+    """Return spectra with the baseline subtracted."""
+
+    data = np.asarray(data, dtype=np.float64)
+    method = settings["baseline"]
+    if method == "offset":
+        return data - np.nanmin(data, axis=-1, keepdims=True)
+    if method == "linear":
+        num_points = data.shape[-1]
+        edge = max(int(round(settings["baseline_edge"] * num_points)), 1)
+        left = np.nanmean(data[..., :edge], axis=-1, keepdims=True)
+        right = np.nanmean(data[..., -edge:], axis=-1, keepdims=True)
+        # The line goes through the middle of each edge region.
+        fraction = (np.arange(num_points) - (edge - 1) / 2) / (num_points - edge)
+        return data - (left + (right - left) * fraction)
+    return data
+
+
+def find_peaks(data, cal, min_height=0.02, max_peaks=10, min_prominence=0.05):
+    """Find the peaks of spectra.
+
+    All peaks of all spectra are found and measured together.  A peak's
+    prominence is its height above the higher of the lowest points on each
+    side before the spectrum rises above the peak (or ends); this rejects
+    the small maxima that noise makes on the baseline and on the sides and top
+    of a band.  The FWHM is
+    measured between the points where the spectrum falls to half of the
+    peak's height (interpolated between pixels).  A peak whose half height
+    isn't reached before an end of the spectrum has a FWHM of NaN.
+
+    Parameters
+    ----------
+    data : numpy array
+        An absorbance spectrum (low to high wavelength), or a stack of them.
+    cal : dictionary
+        The calibration, as stored in cal.json.
+    min_height : float
+        Smaller maxima are ignored.
+    max_peaks : int
+        At most this many peaks (the highest) are kept for each spectrum.
+    min_prominence : float
+        Less prominent maxima are ignored.
+
+    Returns
+    -------
+    dictionary or list of dictionaries
+        For each spectrum, "wavelength" (nm), "height", "fwhm" (nm) and
+        "index" arrays, highest peak first.
+
+    """
+
+    data = np.asarray(data, dtype=np.float64)
+    single = data.ndim == 1
+    stack = np.atleast_2d(data)
+    num_spectra, num_points = stack.shape
+    model = get_model(cal, num_points)
+    clean = np.where(np.isfinite(stack), stack, -np.inf)
+
+    is_peak = np.zeros(stack.shape, dtype=bool)
+    is_peak[:, 1:-1] = ((clean[:, 1:-1] > clean[:, :-2]) &
+                        (clean[:, 1:-1] >= clean[:, 2:]) &
+                        (clean[:, 1:-1] >= min_height))
+    spectrum_index, peak_index = np.nonzero(is_peak)
+    heights = stack[spectrum_index, peak_index]
+    positions = np.arange(num_points)
+
+    # For every peak at once: the nearest higher point on each side, and the
+    # lowest point between the peak and each of them.
+    rows = clean[spectrum_index]
+    higher = rows > heights[:, np.newaxis]
+    before = positions < peak_index[:, np.newaxis]
+    after = positions > peak_index[:, np.newaxis]
+    left_higher = np.where((higher & before).any(axis=1),
+                           num_points - 1 - np.argmax((higher & before)[:, ::-1], axis=1), -1)
+    right_higher = np.where((higher & after).any(axis=1),
+                            np.argmax(higher & after, axis=1), num_points)
+    left_base = np.where(before & (positions > left_higher[:, np.newaxis]),
+                         rows, np.inf).min(axis=1)
+    right_base = np.where(after & (positions < right_higher[:, np.newaxis]),
+                          rows, np.inf).min(axis=1)
+    keep = heights - np.maximum(left_base, right_base) >= min_prominence
+    spectrum_index, peak_index, heights = (spectrum_index[keep], peak_index[keep],
+                                           heights[keep])
+
+    # Which points of each peak's spectrum are below half of its height, and
+    # the nearest of those on each side.
+    half = heights / 2
+    below = clean[spectrum_index] < half[:, np.newaxis]
+    left_side = below & (positions < peak_index[:, np.newaxis])
+    right_side = below & (positions > peak_index[:, np.newaxis])
+    has_left = left_side.any(axis=1)
+    has_right = right_side.any(axis=1)
+    left = num_points - 1 - np.argmax(left_side[:, ::-1], axis=1)
+    right = np.argmax(right_side, axis=1)
+
+    def crossing(outside, inside):
+        # Where the line between the point below half height and its neighbor
+        # (which is above) crosses half height.
+        y_out = clean[spectrum_index, outside]
+        y_in = clean[spectrum_index, inside]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return outside + (half - y_out) / (y_in - y_out) * (inside - outside)
+
+    left_position = crossing(left, np.minimum(left + 1, num_points - 1))
+    right_position = crossing(right, np.maximum(right - 1, 0))
+    fwhm = np.where(has_left & has_right,
+                    model.at(right_position) - model.at(left_position), np.nan)
+    wavelengths = model.at(peak_index)
+
+    results = []
+    # The peaks are in order of spectrum, so each spectrum's peaks are a
+    # contiguous run.
+    bounds = np.searchsorted(spectrum_index, np.arange(num_spectra + 1))
+    for i in range(num_spectra):
+        run = slice(bounds[i], bounds[i + 1])
+        order = np.argsort(-heights[run], kind="stable")[:max_peaks]
+        results.append({"wavelength" : wavelengths[run][order],
+                        "height" : heights[run][order],
+                        "fwhm" : fwhm[run][order],
+                        "index" : peak_index[run][order]})
+    return results[0] if single else results
+
+
+def process(data, cal, settings=None):
+    """Smooth and baseline-correct spectra, then find their peaks.
+
+    Parameters
+    ----------
+    data : numpy array
+        An absorbance spectrum, or a stack of them.
+    cal : dictionary
+        The calibration, as stored in cal.json.
+    settings : dictionary, optional
+        By default, get_settings() is used.
+
+    Returns
+    -------
+    numpy array
+        The processed spectra, the same shape as data.
+    dictionary or list of dictionaries
+        The peaks; see find_peaks().
+
+    """
+
+    if settings is None:
+        settings = get_settings()
+    processed = correct_baseline(smooth(data, settings), settings)
+    peaks = find_peaks(processed, cal, settings["min_height"], settings["max_peaks"],
+                       settings["min_prominence"])
+    return processed, peaks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or change the "
+                                                 "post-processing settings.")
+    parser.add_argument("--smoothing", choices=["none", "savgol", "gaussian"])
+    parser.add_argument("--window", type=int, help="Savitzky-Golay window (points)")
+    parser.add_argument("--order", type=int, help="Savitzky-Golay polynomial degree")
+    parser.add_argument("--sigma", type=float, help="Gaussian width (points)")
+    parser.add_argument("--baseline", choices=["none", "offset", "linear"])
+    parser.add_argument("--baseline-edge", type=float,
+                        help="share of the points at each end used for the "
+                             "linear baseline")
+    parser.add_argument("--min-height", type=float, help="smallest peak reported")
+    parser.add_argument("--min-prominence", type=float,
+                        help="smallest peak reported, measured from the "
+                             "surrounding spectrum")
+    parser.add_argument("--max-peaks", type=int, help="most peaks reported")
+    args = vars(parser.parse_args(argv))
+    changes = {key : value for key, value in args.items() if value is not None}
+    if changes:
+        set_settings(**changes)
+    for key, value in sorted(get_settings().items()):
+        print("%s: %s" % (key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""This code turns absorbance spectra into concentrations with the
+Beer-Lambert law.  It is used by gui.py.
+
+A quantification model is fitted to standards: measurements of samples whose
+concentrations are known.  At every wavelength of COMMON_GRID (see
+wavelength.py), the absorbance is modeled as
+
+    A = e_1 c_1 + e_2 c_2 + ... + b
+
+where c_k is the concentration of component k, e_k is its extinction (times
+the path length) and b is the baseline.  All of the wavelengths are fitted in
+one least-squares solve over the matrix of standard spectra.  With more than
+one component, mixtures are unmixed.
+
+The pseudoinverse of the extinction matrix is computed once, so the
+concentrations of a new spectrum are a single matrix-vector product.  The
+model is saved in quant_profiles/quant_v{N}.npz, and its path is stored
+under "quant" in cal.json.
+
+The standards are listed in a csv file.  The first column is the source of
+each standard (an archive id, or a csv file saved by this software); the
+other columns are the concentrations, headed by the component names:
+
+    source,red dye,blue dye
+    12,0.1,0
+    13,0,0.2
+    mix1.csv,0.1,0.1
+
+Usage: "python3 quant.py fit standards.csv", "python3 quant.py apply
+sample.csv" or "python3 quant.py show".
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from cal import get_cal, save_cal_profile
+from config import FileCache, write_atomic
+from wavelength import COMMON_GRID, get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+QUANT_PROFILE_DIR = "quant_profiles"
+
+
+class QuantModel():
+    """A fitted Beer-Lambert model.
+
+    Parameters
+    ----------
+    components : list of string
+        The names of the components.
+    columns : 1D numpy array of int
+        The indices of the COMMON_GRID wavelengths that are used.
+    extinction : 2D numpy array
+        (components, wavelengths): the absorbance per unit concentration.
+    baseline : 1D numpy array
+        The absorbance at zero concentration, at each wavelength.
+    r_squared : 1D numpy array
+        How well the fit explains the standards, at each wavelength.
+
+    """
+
+    def __init__(self, components, columns, extinction, baseline, r_squared):
+        self.components = list(components)
+        self.columns = np.asarray(columns)
+        self.extinction = np.asarray(extinction, dtype=np.float64)
+        self.baseline = np.asarray(baseline, dtype=np.float64)
+        self.r_squared = np.asarray(r_squared, dtype=np.float64)
+        # concentrations = projector @ (absorbance - baseline)
+        self.projector = np.linalg.pinv(self.extinction.T)
+
+    @classmethod
+    def fit(cls, components, concentrations, grid_spectra):
+        """Fit a model to standards.
+
+        Parameters
+        ----------
+        components : list of string
+            The names of the components.
+        concentrations : 2D array-like
+            (standards, components): the known concentrations.
+        grid_spectra : 2D numpy array
+            (standards, len(COMMON_GRID)): the absorbance spectra of the
+            standards on COMMON_GRID.  Wavelengths that aren't covered by
+            every standard are left out.
+
+        """
+
+        concentrations = np.asarray(concentrations, dtype=np.float64).reshape(
+            len(grid_spectra), len(components))
+        grid_spectra = np.asarray(grid_spectra, dtype=np.float64)
+        columns = np.flatnonzero(np.all(np.isfinite(grid_spectra), axis=0))
+        if len(columns) == 0:
+            raise ValueError("The standards don't cover any common wavelengths.")
+        design = np.column_stack((concentrations, np.ones(len(concentrations))))
+        if np.linalg.matrix_rank(design) < design.shape[1]:
+            raise ValueError("There must be at least %d standards with independent "
+                             "concentrations." % design.shape[1])
+        spectra = grid_spectra[:, columns]
+        # One solve for every wavelength: each column of spectra is fitted
+        # against the same design matrix.
+        coefficients, _, _, _ = np.linalg.lstsq(design, spectra, rcond=None)
+        residuals = spectra - design @ coefficients
+        total = ((spectra - spectra.mean(axis=0))**2).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_squared = np.where(total > 0, 1 - (residuals**2).sum(axis=0) / total, 1.0)
+        return cls(components, columns, coefficients[:-1], coefficients[-1], r_squared)
+
+    def concentrations_grid(self, grid_spectra):
+        """Return the concentrations for spectra on COMMON_GRID.  grid_spectra
+        may be one spectrum or a stack (one per row); the result has one
+        concentration per component along the last axis."""
+
+        absorbance = np.asarray(grid_spectra, dtype=np.float64)[..., self.columns]
+        if not np.all(np.isfinite(absorbance)):
+            raise ValueError("The spectrum doesn't cover the model's wavelengths.")
+        return (absorbance - self.baseline) @ self.projector.T
+
+    def concentrations(self, data, cal):
+        """Return the concentrations for a measured absorbance spectrum (or a
+        stack of them), given the calibration it was measured with."""
+
+        data = np.asarray(data, dtype=np.float64)
+        return self.concentrations_grid(get_model(cal, data.shape[-1]).resample(data))
+
+    def save(self, file_loc):
+        """Save the model, replacing file_loc in one step."""
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_loc)), exist_ok=True)
+        write_atomic(file_loc, lambda npz_file: np.savez(
+            npz_file, components=np.array(self.components, dtype=str),
+            columns=self.columns, extinction=self.extinction, baseline=self.baseline,
+            r_squared=self.r_squared, projector=self.projector))
+
+    @classmethod
+    def load(cls, file_loc):
+        with np.load(file_loc) as contents:
+            model = cls.__new__(cls)
+            model.components = [str(name) for name in contents["components"]]
+            model.columns = contents["columns"]
+            model.extinction = contents["extinction"]
+            model.baseline = contents["baseline"]
+            model.r_squared = contents["r_squared"]
+            # The pseudoinverse was saved, so it isn't computed again.
+            model.projector = contents["projector"]
+        return model
+
+
+def save_quant_model(model):
+    """Save model and reference it from a new calibration profile.  Return the
+    path of the saved model."""
+
+    cal = get_cal()
+    file_loc = os.path.join(QUANT_PROFILE_DIR,
+                            "quant_v%d.npz" % (cal.get("version", 0) + 1))
+    model.save(file_loc)
+    cal["quant"] = file_loc
+    save_cal_profile(cal)
+    return file_loc
+
+
+_model_cache = FileCache(QuantModel.load)
+
+def get_quant_model(cal=None):
+    """Return the QuantModel referenced by the calibration, or None if there
+    isn't one.  It is only loaded again if the file changes (see
+    config.FileCache)."""
+
+    if cal is None:
+        cal = get_cal()
+    file_loc = cal.get("quant")
+    if file_loc is None:
+        return None
+    return _model_cache.get(file_loc)
+
+
+def read_standards(file_loc):
+    """Read a standards file (see the top of this file).
+
+    Returns
+    -------
+    list of string
+        The component names.
+    2D numpy array
+        The concentrations, one row per standard.
+    2D numpy array
+        The spectra on COMMON_GRID, one row per standard.
+
+    """
+
+    from archive import get_archive
+    from library import read_csv_spectrum
+
+    with open(file_loc, newline="") as standards_file:
+        rows = [row for row in csv.reader(standards_file) if row]
+    components = [name.strip() for name in rows[0][1:]]
+    directory = os.path.dirname(os.path.abspath(file_loc))
+    concentrations = []
+    spectra = []
+    for row in rows[1:]:
+        source = row[0].strip()
+        if source.isdigit():
+            measurement = get_archive().get(int(source))
+            absorbance = measurement["absorbance"]
+            spectra.append(get_model(measurement["cal"], len(absorbance))
+                           .resample(absorbance))
+        else:
+            spectra.append(read_csv_spectrum(os.path.join(directory, source)))
+        concentrations.append([float(value) for value in row[1:]])
+    return components, np.array(concentrations), np.array(spectra)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit and apply Beer-Lambert "
+                                                 "quantification models.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit", help="fit a model to standards")
+    fit_parser.add_argument("standards", help="csv file listing the standards")
+    apply_parser = subparsers.add_parser("apply", help="quantify csv files")
+    apply_parser.add_argument("csv_files", nargs="+")
+    subparsers.add_parser("show", help="describe the current model")
+    args = parser.parse_args(argv)
+
+    if args.command == "fit":
+        components, concentrations, spectra = read_standards(args.standards)
+        model = QuantModel.fit(components, concentrations, spectra)
+        print("Saved %s" % save_quant_model(model))
+        print("%d standards, %d wavelengths, median R^2 %.4f" % (
+            len(spectra), len(model.columns), np.median(model.r_squared)))
+        return
+
+    model = get_quant_model()
+    if model is None:
+        print("There is no quantification model.  Run \"python3 quant.py fit\".")
+        return
+    if args.command == "apply":
+        from library import read_csv_spectrum
+        spectra = np.array([read_csv_spectrum(loc) for loc in args.csv_files])
+        for csv_loc, values in zip(args.csv_files, model.concentrations_grid(spectra)):
+            print("%s: %s" % (csv_loc, ", ".join(
+                "%s %.4g" % pair for pair in zip(model.components, values))))
+    else:
+        wavelengths = COMMON_GRID[model.columns]
+        print("Components: %s" % ", ".join(model.components))
+        print("Wavelengths: %g-%g nm, median R^2 %.4f" % (
+            wavelengths[0], wavelengths[-1], np.median(model.r_squared)))
+
+
+if __name__ == "__main__":
+    main()
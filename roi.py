@@ -0,0 +1,135 @@
+"""This code contains functions called by measure.py.
+
+The spectrum is described by the location in loc.json: it starts at row y,
+is length rows long, and is centered on column x.  Optionally, it is width
+pixels wide, and its center moves tilt pixels to the right per row (plus
+curve pixels per row squared), for a band that isn't perfectly vertical.  The
+columns needn't be whole numbers.
+
+For each row, the band is sampled at width evenly spaced points across it,
+each of which is linearly interpolated between the two nearest pixels, and
+the samples are averaged.  The pixel indices and weights only depend on the
+location, so they are computed once and reused for every frame.
+
+Measurements only need the pixels around the band, so they capture a window
+(crop_window()) instead of the whole frame, and extract the spectrum with the
+location moved into the window (see get_cropped_roi()).
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# The margin (in pixels) around the band kept by crop_window().
+CROP_PADDING = 8
+
+
+class SpectrumROI():
+    """Precomputed indices and weights for extracting the spectrum.
+
+    Parameters
+    ----------
+    loc : dictionary
+        The location of the spectrum, as stored in loc.json.
+    shape : tuple of int
+        The (rows, columns) of the images the spectrum will be extracted from.
+
+    """
+
+    def __init__(self, loc, shape):
+        num_rows, num_cols = shape
+        y, length = loc["y"], loc["length"]
+        width = max(int(loc.get("width", 1)), 1)
+        steps = np.arange(length)
+        self.centers = (loc["x"] + loc.get("tilt", 0.0) * steps +
+                        loc.get("curve", 0.0) * steps**2)
+        offsets = np.arange(width) - (width - 1) / 2.0
+        positions = self.centers[:, np.newaxis] + offsets[np.newaxis, :]
+        positions = np.clip(positions, 0, num_cols - 1)
+        left = np.floor(positions).astype(np.intp)
+        frac = positions - left
+        right = np.minimum(left + 1, num_cols - 1)
+
+        row_starts = ((y + steps) * num_cols)[:, np.newaxis]
+        # Each row has 2 * width (pixel, weight) pairs.
+        self.indices = np.concatenate((row_starts + left, row_starts + right), axis=1)
+        self.weights = np.concatenate((1 - frac, frac), axis=1) / width
+        self.shape = tuple(shape)
+        self.row_slice = slice(y, y + length)
+        used_cols = (self.indices % num_cols)[self.weights > 0]
+        self.col_slice = slice(int(used_cols.min()), int(used_cols.max()) + 1)
+
+    def extract(self, image_array):
+        """Return the weighted average across the band for each row, as a 1D
+        float array with one value per row of the spectrum."""
+
+        flat = np.asarray(image_array).reshape(-1)
+        return np.einsum("ij,ij->i", flat[self.indices], self.weights)
+
+    def bounding_slices(self):
+        """Return (row slice, column slice) of the smallest rectangle that
+        contains every pixel the band uses."""
+
+        return (self.row_slice, self.col_slice)
+
+    def crop_window(self, padding=CROP_PADDING):
+        """Return (row slice, column slice) of the bounding rectangle with
+        padding pixels added on every side (but not past the image's edges)."""
+
+        num_rows, num_cols = self.shape
+        return (slice(max(self.row_slice.start - padding, 0),
+                      min(self.row_slice.stop + padding, num_rows)),
+                slice(max(self.col_slice.start - padding, 0),
+                      min(self.col_slice.stop + padding, num_cols)))
+
+    def pixel_indices(self):
+        """Return the flat indices (into the raveled image) of every pixel the
+        band uses, each once."""
+
+        return np.unique(self.indices[self.weights > 0])
+
+    def pixel_mask(self):
+        """Return a boolean image that is True at every pixel the band uses."""
+
+        mask = np.zeros(self.shape, dtype=bool)
+        mask.reshape(-1)[self.pixel_indices()] = True
+        return mask
+
+
+def crop_loc(loc, window):
+    """Return loc moved into window (from SpectrumROI.crop_window()), so that
+    the spectrum can be extracted from an image of only the window.  The
+    result is the same as extracting it from the whole image."""
+
+    return dict(loc, x=loc["x"] - window[1].start, y=loc["y"] - window[0].start)
+
+
+_roi_cache = {}
+
+
+def get_roi(loc, shape):
+    """Return the SpectrumROI for loc and the image shape.  It is only
+    computed the first time a location is used."""
+
+    key = (tuple(sorted(loc.items())), tuple(shape))
+    roi = _roi_cache.get(key)
+    if roi is None:
+        if len(_roi_cache) > 16:
+            _roi_cache.clear()
+        roi = SpectrumROI(loc, shape)
+        _roi_cache[key] = roi
+    return roi
+
+def get_cropped_roi(loc, shape, padding=CROP_PADDING):
+    """Return (window, roi): the window around the spectrum in images of the
+    given shape (see SpectrumROI.crop_window()), and the SpectrumROI for
+    images of only the window."""
+
+    window = get_roi(loc, shape).crop_window(padding)
+    window_shape = (window[0].stop - window[0].start, window[1].stop - window[1].start)
+    return window, get_roi(crop_loc(loc, window), window_shape)
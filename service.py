@@ -0,0 +1,413 @@
+"""This code lets other programs (e.g. LIMS scripts or robot arms) run the
+spectrophotometer over HTTP.  It is an asyncio server with a small built-in
+HTTP/1.1 parser, so it needs nothing beyond the standard library.
+
+Endpoints (bodies and replies are JSON unless noted):
+
+    GET  /status            the queue length, the blank, loc and cal
+    POST /blank             measure the blank; {"force": true} never reuses
+                            a recent one (see blank_cache.py)
+    POST /sample            measure a sample; {"title": "..."}.  The reply is
+                            the result (see GET /results/ID)
+    GET  /results           the ids and titles of the recent results
+    GET  /results/ID        a result: absorbance, wavelengths, peaks,
+                            concentrations and library matches
+    GET  /results/ID?format=npy   the absorbance as a .npy file
+    GET  /results/ID?format=raw   the absorbance as little-endian float64
+    GET  /loc, PUT /loc     read or set loc.json ({"x", "y", "length", ...})
+    GET  /cal, PUT /cal     read or set cal.json ({"min", "max"} or
+                            {"coeffs"})
+    POST /sim/sample        simulated camera only: put in a sample with
+                            {"center", "width", "height"}, or take it out
+                            with {}
+
+Every capture goes through one queue, served by a single camera task, so
+clients never use the camera at the same time.  Processing the captured
+sample (absorbance, post-processing, archive, library and quantification)
+runs in a thread pool, so it overlaps with the next capture.
+
+Usage: "python3 service.py --port 8080".  With SPECTRO_CAMERA=sim (see
+get_image.py), it runs against the simulated camera.
+
+This software is licensed under the MIT license.
+
+"""
+
+import argparse
+import asyncio
+import collections
+import io
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from loc import get_loc, set_loc
+from cal import get_cal, set_cal, set_cal_coeffs
+from get_image import get_backend
+from measure import (capture_row, compute_absorbance, get_blank, archive_result,
+                     wavelength_axis)
+from postprocess import process
+from library import get_library
+from quant import get_quant_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found",
+           405 : "Method Not Allowed", 409 : "Conflict",
+           500 : "Internal Server Error"}
+# The number of results kept for GET /results.
+MAX_RESULTS = 100
+
+
+class HTTPError(Exception):
+    """Raised by a handler to reply with an error status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _json_reply(contents, status=200):
+    return status, "application/json", json.dumps(contents).encode("utf-8")
+
+
+def _to_json(value):
+    """Make numpy values in a result JSON-serializable.  NaN becomes None."""
+
+    if isinstance(value, dict):
+        return {key : _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _to_json(value.tolist())
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def analyze_sample(title, blank_row, sample_row, cal, loc):
+    """Turn a captured sample into a result.  This runs in the processing
+    thread pool."""
+
+    data = compute_absorbance(blank_row, sample_row)
+    archive_id = archive_result(title, data, blank_row, sample_row, cal, loc)
+    result = {"title" : title, "archive_id" : archive_id, "time" : time.time(),
+              "matches" : None, "concentrations" : None}
+    library = get_library()
+    if library is not None and len(library) > 0:
+        try:
+            result["matches"] = library.match(data, cal, top_k=3)
+        except ValueError:
+            pass
+    quant_model = get_quant_model(cal)
+    if quant_model is not None:
+        try:
+            result["concentrations"] = dict(zip(quant_model.components,
+                                                quant_model.concentrations(data, cal)))
+        except ValueError:
+            pass
+    processed, peaks = process(data, cal)
+    result.update({"absorbance" : processed, "raw_absorbance" : data,
+                   "wavelengths" : wavelength_axis(cal, len(data)), "peaks" : peaks})
+    return result
+
+
+class MeasurementService():
+    """The state of the service: the camera queue, the blank and the results.
+
+    Parameters
+    ----------
+    workers : int
+        Threads for processing results.
+
+    """
+
+    def __init__(self, workers=2):
+        self.camera_queue = None
+        self.blank_row = None
+        self.blank_time = None
+        self.results = collections.OrderedDict()
+        self._result_ids = itertools.count(1)
+        # One thread, so blocking captures never overlap.
+        self._camera_executor = ThreadPoolExecutor(max_workers=1)
+        self._process_executor = ThreadPoolExecutor(max_workers=workers)
+        self._camera_task = None
+        self.routes = [
+            ("GET", "/status", self.status),
+            ("POST", "/blank", self.measure_blank),
+            ("POST", "/sample", self.measure_sample),
+            ("GET", "/results", self.list_results),
+            ("GET", "/loc", self.read_loc),
+            ("PUT", "/loc", self.write_loc),
+            ("GET", "/cal", self.read_cal),
+            ("PUT", "/cal", self.write_cal),
+            ("POST", "/sim/sample", self.set_sim_sample),
+        ]
+
+    async def start(self):
+        self.camera_queue = asyncio.Queue()
+        self._camera_task = asyncio.ensure_future(self._serve_camera())
+
+    async def close(self):
+        if self._camera_task is not None:
+            self._camera_task.cancel()
+            try:
+                await self._camera_task
+            except asyncio.CancelledError:
+                pass
+        self._camera_executor.shutdown()
+        self._process_executor.shutdown()
+
+    async def _serve_camera(self):
+        """Run the queued camera jobs one at a time."""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            function, args, future = await self.camera_queue.get()
+            try:
+                result = await loop.run_in_executor(self._camera_executor, function,
+                                                    *args)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def use_camera(self, function, *args):
+        """Queue function(*args) for the camera and wait for its result."""
+
+        future = asyncio.get_running_loop().create_future()
+        await self.camera_queue.put((function, args, future))
+        return await future
+
+    # Handlers: each takes the parsed JSON body (or None) and the query, and
+    # returns (status, content type, body bytes).
+
+    async def status(self, body, query):
+        return _json_reply({"queued" : self.camera_queue.qsize(),
+                            "blank_time" : self.blank_time,
+                            "results" : len(self.results),
+                            "loc" : get_loc(), "cal" : get_cal()})
+
+    async def measure_blank(self, body, query):
+        force = bool((body or {}).get("force", False))
+        loc, cal = get_loc(), get_cal()
+        blank_row, reused = await self.use_camera(get_blank, loc, cal, force)
+        self.blank_row = blank_row
+        self.blank_time = time.time()
+        return _json_reply({"reused" : reused, "points" : len(blank_row)})
+
+    async def measure_sample(self, body, query):
+        if self.blank_row is None:
+            raise HTTPError(409, "Measure the blank first (POST /blank).")
+        title = str((body or {}).get("title", "sample"))
+        loc, cal = get_loc(), get_cal()
+        blank_row = self.blank_row
+        sample_row = await self.use_camera(capture_row, loc)
+        # The camera is free again; the next request can capture while this
+        # one is processed.
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._process_executor, analyze_sample, title, blank_row, sample_row,
+            cal, loc)
+        result_id = next(self._result_ids)
+        result["id"] = result_id
+        self.results[result_id] = result
+        while len(self.results) > MAX_RESULTS:
+            self.results.popitem(last=False)
+        return _json_reply(_to_json(result))
+
+    async def list_results(self, body, query):
+        return _json_reply([{"id" : result_id, "title" : result["title"],
+                             "time" : result["time"]}
+                            for result_id, result in self.results.items()])
+
+    async def get_result(self, result_id, query):
+        result = self.results.get(result_id)
+        if result is None:
+            raise HTTPError(404, "There is no result %d." % result_id)
+        result_format = query.get("format", ["json"])[0]
+        data = np.asarray(result["absorbance"], dtype="<f8")
+        if result_format == "npy":
+            buffer = io.BytesIO()
+            np.save(buffer, data)
+            return 200, "application/x-npy", buffer.getvalue()
+        if result_format == "raw":
+            return 200, "application/octet-stream", data.tobytes()
+        if result_format == "json":
+            return _json_reply(_to_json(result))
+        raise HTTPError(400, "Unknown format %r." % result_format)
+
+    async def read_loc(self, body, query):
+        return _json_reply(get_loc())
+
+    async def write_loc(self, body, query):
+        try:
+            set_loc(int(body["x"]), int(body["y"]), int(body["length"]),
+                    int(body.get("width", 1)), float(body.get("tilt", 0.0)),
+                    float(body.get("curve", 0.0)))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "loc needs integer x, y and length.")
+        # The blank was measured somewhere else.
+        self.blank_row = None
+        self.blank_time = None
+        return _json_reply(get_loc())
+
+    async def write_cal(self, body, query):
+        try:
+            if "coeffs" in body:
+                set_cal_coeffs([float(coeff) for coeff in body["coeffs"]])
+            else:
+                new_min, new_max = float(body["min"]), float(body["max"])
+                if not new_min < new_max:
+                    raise ValueError
+                set_cal(new_min, new_max)
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "cal needs min < max, or coeffs.")
+        return _json_reply(get_cal())
+
+    async def read_cal(self, body, query):
+        return _json_reply(get_cal())
+
+    async def set_sim_sample(self, body, query):
+        backend = get_backend()
+        if not hasattr(backend, "set_sample"):
+            raise HTTPError(400, "The camera isn't simulated.")
+        from sim_camera import gaussian_absorbance
+        body = body or {}
+        if "center" in body:
+            absorbance = gaussian_absorbance(float(body["center"]),
+                                             float(body.get("width", 40.0)),
+                                             float(body.get("height", 0.5)))
+        else:
+            absorbance = None
+        # Through the camera queue, so it doesn't change during a capture.
+        await self.use_camera(backend.set_sample, absorbance)
+        return _json_reply({"sample" : body})
+
+    async def dispatch(self, method, target, body):
+        """Find the handler for a request and run it."""
+
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = parse_qs(url.query)
+        if path.startswith("/results/"):
+            if method != "GET":
+                raise HTTPError(405, "Use GET.")
+            try:
+                result_id = int(path[len("/results/"):])
+            except ValueError:
+                raise HTTPError(404, "No such result.")
+            return await self.get_result(result_id, query)
+        methods = [route for route in self.routes if route[1] == path]
+        if not methods:
+            raise HTTPError(404, "Nothing at %s." % path)
+        for route_method, _, handler in methods:
+            if route_method == method:
+                return await handler(body, query)
+        raise HTTPError(405, "Use %s." % " or ".join(route[0] for route in methods))
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP requests on one connection until it is closed."""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = (version == "HTTP/1.1" and
+                              headers.get("connection", "").lower() != "close")
+
+                try:
+                    try:
+                        body_length = int(headers.get("content-length", 0))
+                    except ValueError:
+                        body_length = -1
+                    if body_length < 0:
+                        # The body can't be skipped, so the connection can't
+                        # be used for another request.
+                        keep_alive = False
+                        raise HTTPError(400, "Bad Content-Length.")
+                    raw_body = await reader.readexactly(body_length)
+                    body = json.loads(raw_body.decode("utf-8")) if raw_body else None
+                    if body is not None and not isinstance(body, dict):
+                        raise HTTPError(400, "The body must be a JSON object.")
+                    status, content_type, reply = await self.dispatch(method.upper(),
+                                                                      target, body)
+                except HTTPError as error:
+                    status, content_type, reply = _json_reply({"error" : str(error)},
+                                                              error.status)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    status, content_type, reply = _json_reply(
+                        {"error" : "The body isn't valid JSON."}, 400)
+                except asyncio.IncompleteReadError:
+                    raise
+                except Exception as error:
+                    status, content_type, reply = _json_reply(
+                        {"error" : "%s: %s" % (type(error).__name__, error)}, 500)
+
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: %s\r\n"
+                              "Content-Length: %d\r\nConnection: %s\r\n\r\n" % (
+                                  status, REASONS.get(status, ""), content_type,
+                                  len(reply), "keep-alive" if keep_alive else "close")
+                              ).encode("latin-1") + reply)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port, workers=2):
+    """Run the service until it is cancelled."""
+
+    service = MeasurementService(workers)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print("Listening on http://%s:%d" % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the spectrophotometer as a "
+                                                 "local HTTP/JSON service.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (the default only accepts "
+                             "connections from this computer)")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="threads for processing results")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,38 @@
-"""This code turns on the LED and displays a video feed
-from the camera.  The video feed only lasts 2 minutes.
-Usage: "python3 show_video.py".
+"""This code shows the absorbance spectrum live, so the device can be
+adjusted until the spectrum shows up.  See live.py.
+Usage: "python3 show_video.py".  "python3 show_video.py --raw" turns on the
+LED and displays the camera's own video preview instead (it only lasts 2
+minutes).
 
 """
 
+import sys
 import time
 
 __author__ = "Daniel James Evans"
 __copyright__ = "Copyright 2019, Daniel James Evans"
 __license__ = "MIT"
 
-from picamera.array import PiRGBArray
-from picamera import PiCamera
 
+def show_raw_preview(seconds=120):
+    """Turn on the LED and show the camera's preview for seconds."""
 
-from gpiozero import LED
+    from picamera import PiCamera
+    from gpiozero import LED
 
-led = LED(4)
-led.on()
+    led = LED(4)
+    led.on()
 
+    camera = PiCamera()
+    camera.resolution = (640, 480)
+    camera.framerate = 32
+    camera.start_preview()
+    time.sleep(seconds)
 
 
-camera = PiCamera()
-camera.resolution = (640, 480)
-camera.framerate = 32
-camera.start_preview()
-time.sleep(120)
+if __name__ == "__main__":
+    if "--raw" in sys.argv[1:]:
+        show_raw_preview()
+    else:
+        from live import main
+        main([arg for arg in sys.argv[1:] if arg != "--raw"])
@@ -0,0 +1,260 @@
+"""This code simulates the spectrophotometer's camera, so the rest of the
+code can be run and profiled on a computer that isn't a Pi.  Select it by
+setting the environment variable SPECTRO_CAMERA=sim before starting gui.py,
+or by calling get_image.set_backend(SimulatedCamera()).
+
+The simulated image is dark except for the slit (a white rectangle near the
+bottom) and the diffraction spectrum above it (a vertical rainbow band).  The
+top of the band is the long-wavelength end, like on the real device.  The
+band is dimmed according to the absorbance spectrum of the simulated sample.
+
+This software is licensed under the MIT license.
+
+"""
+
+import time
+
+import numpy as np
+
+from camera_backend import CameraBackend
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def gaussian_absorbance(center, width, height):
+    """Return a function of wavelength (nm) that is a Gaussian absorbance peak.
+
+    Parameters
+    ----------
+    center : float
+        Wavelength of the peak, in nm.
+    width : float
+        Standard deviation of the peak, in nm.
+    height : float
+        Absorbance at the peak.
+
+    """
+
+    def absorbance(wavelengths):
+        return height * np.exp(-0.5 * ((wavelengths - center) / width)**2)
+    return absorbance
+
+
+def wavelength_to_rgb(wavelengths):
+    """Return an approximate (N, 3) array of RGB colors, between 0 and 1, for
+    an array of wavelengths in nm."""
+
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    # Piecewise-linear approximation of the visible spectrum's hues.
+    red = np.interp(wavelengths, [380, 440, 490, 510, 580, 645, 780],
+                    [0.4, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0])
+    green = np.interp(wavelengths, [380, 440, 490, 510, 580, 645, 780],
+                      [0.0, 0.0, 1.0, 1.0, 1.0, 0.0, 0.0])
+    blue = np.interp(wavelengths, [380, 440, 490, 510, 580, 645, 780],
+                     [0.4, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+    return np.stack((red, green, blue), axis=-1)
+
+
+def white_led_spectrum(wavelengths):
+    """Return the relative intensity (0 to 1) of a white LED: a narrow blue
+    peak plus a broad yellow phosphor peak."""
+
+    blue = np.exp(-0.5 * ((wavelengths - 450) / 12)**2)
+    phosphor = 0.75 * np.exp(-0.5 * ((wavelengths - 570) / 60)**2)
+    return blue + phosphor
+
+
+class SimulatedCamera(CameraBackend):
+    """A deterministic stand-in for the Pi camera and LED.
+
+    Parameters
+    ----------
+    resolution : tuple of int
+        (width, height) of the images.
+    framerate : float
+        Frames per second.  When realtime is True, captures are slowed down
+        to this rate.
+    loc : dictionary, optional
+        Where the spectrum is drawn, in the same format as loc.json.  By
+        default it is centered horizontally.
+    wavelength_range : tuple of float
+        The wavelengths (nm) at the bottom and top of the spectrum.
+    absorbance : function, optional
+        Absorbance of the sample as a function of wavelength (nm).  None means
+        no sample (a blank).  Change it with set_sample().
+    brightness : float
+        Grey level of the brightest part of the spectrum when there is no
+        sample.
+    noise : float
+        Standard deviation of the per-pixel noise, in grey levels.
+    dark_level : float
+        Grey level of the image when nothing is lit.
+    seed : int
+        Seed for the noise, so runs are repeatable.
+    realtime : bool
+        If True, captures take as long as they would on a real camera.
+    exposure_drift : float
+        While the exposure isn't locked, each frame's brightness is scaled by
+        a random factor with this standard deviation around 1, like automatic
+        exposure hunting on the real camera.
+
+    """
+
+    def __init__(self, resolution=(640, 480), framerate=24, loc=None,
+                 wavelength_range=(380.0, 700.0), absorbance=None, brightness=200.0,
+                 noise=2.0, dark_level=8.0, seed=0, realtime=True,
+                 exposure_drift=0.01):
+        self.resolution = tuple(resolution)
+        self.framerate = framerate
+        width, height = self.resolution
+        if loc is None:
+            loc = {"x" : width // 2, "y" : height // 8,
+                   "length" : height // 2}
+        self.loc = dict(loc)
+        self.wavelength_range = wavelength_range
+        self.absorbance = absorbance
+        self.brightness = brightness
+        self.noise = noise
+        self.dark_level = dark_level
+        self.realtime = realtime
+        self.exposure_drift = exposure_drift
+        self.exposure_settings = None
+        self.led_is_on = False
+        self.frames_captured = 0
+        self._rng = np.random.default_rng(seed)
+        self._last_frame_time = 0.0
+        self._clean = {}
+        self._noise_buffer = np.empty(self.frame_shape, dtype=np.float32)
+        self._luma = np.empty(self.frame_shape, dtype=np.uint8)
+        self._rgb_noise_buffer = None
+
+    def set_sample(self, absorbance):
+        """Change the sample.  absorbance is a function of wavelength (nm), or
+        None for a blank."""
+
+        self.absorbance = absorbance
+        self._clean.clear()
+
+    def led_on(self):
+        self.led_is_on = True
+
+    def led_off(self):
+        self.led_is_on = False
+
+    def measure_exposure(self):
+        self.exposure_settings = None
+        return {"shutter_speed" : int(1e6 / self.framerate), "iso" : 100,
+                "analog_gain" : 1.0, "digital_gain" : 1.0,
+                "awb_gains" : [1.5, 1.2]}
+
+    def lock_exposure(self, settings):
+        self.exposure_settings = dict(settings)
+
+    def _wait_for_frame(self):
+        """Sleep until the next frame would be ready on a real camera."""
+
+        if self.realtime:
+            next_frame_time = self._last_frame_time + 1.0 / self.framerate
+            delay = next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self._last_frame_time = time.perf_counter()
+        self.frames_captured += 1
+
+    def _render_rgb(self):
+        """Return the noiseless float32 (rows, columns, 3) image for the
+        current sample and LED state."""
+
+        key = (self.led_is_on, "rgb")
+        if key in self._clean:
+            return self._clean[key]
+        height, width = self.frame_shape
+        image = np.full((height, width, 3), self.dark_level, dtype=np.float32)
+        if self.led_is_on:
+            x, y, length = self.loc["x"], self.loc["y"], self.loc["length"]
+            columns = np.arange(width)
+
+            # The slit: a white rectangle below the spectrum.
+            slit_top = min(y + length + height // 12, height - 2)
+            slit_bottom = min(slit_top + height // 24, height)
+            slit_columns = np.abs(columns - x) <= width // 40
+            image[slit_top:slit_bottom, slit_columns] = 250.0
+
+            # The spectrum: each row is one wavelength, with the long
+            # wavelengths at the top.
+            low, high = self.wavelength_range
+            wavelengths = np.linspace(high, low, length)
+            intensity = self.brightness * white_led_spectrum(wavelengths)
+            intensity /= white_led_spectrum(np.linspace(low, high, 200)).max()
+            if self.absorbance is not None:
+                intensity *= 10.0 ** -self.absorbance(wavelengths)
+            steps = np.arange(length)
+            centers = (x + self.loc.get("tilt", 0.0) * steps +
+                       self.loc.get("curve", 0.0) * steps**2)
+            profile = np.exp(-0.5 * ((columns[np.newaxis, :] -
+                                      centers[:, np.newaxis]) / 4.0)**2)
+            colors = wavelength_to_rgb(wavelengths)
+            # Scale the colors so the luma of each row equals its intensity.
+            luma = colors @ np.array([0.299, 0.587, 0.114])
+            colors /= np.maximum(luma, 0.05)[:, np.newaxis]
+            band = (intensity[:, np.newaxis, np.newaxis] * profile[:, :, np.newaxis] *
+                    colors[:, np.newaxis, :])
+            image[y:y+length] += band.astype(np.float32)
+        self._clean[key] = image
+        return image
+
+    def _render_luma(self):
+        """Return the noiseless float32 grayscale image."""
+
+        key = (self.led_is_on, "luma")
+        if key not in self._clean:
+            rgb = self._render_rgb()
+            self._clean[key] = (rgb @ np.array([0.299, 0.587, 0.114],
+                                               dtype=np.float32)).astype(np.float32)
+        return self._clean[key]
+
+    def _add_noise(self, clean, output, buffer=None):
+        """Write clean plus noise, rounded and clipped to uint8, into output.
+        buffer is an optional float32 array with the same shape as clean, to
+        avoid allocating one."""
+
+        if buffer is None:
+            buffer = np.empty(clean.shape, dtype=np.float32)
+        self._rng.standard_normal(dtype=np.float32, out=buffer)
+        if self.exposure_settings is None and self.exposure_drift > 0:
+            scale = 1.0 + self.exposure_drift * self._rng.standard_normal()
+            buffer *= self.noise / scale
+            buffer += clean
+            buffer *= scale
+        else:
+            buffer *= self.noise
+            buffer += clean
+        np.clip(buffer, 0, 255, out=buffer)
+        np.rint(buffer, out=buffer)
+        output[...] = buffer
+
+    def capture_rgb(self, output):
+        self._wait_for_frame()
+        if self._rgb_noise_buffer is None:
+            self._rgb_noise_buffer = np.empty(self.frame_shape + (3,), dtype=np.float32)
+        self._add_noise(self._render_rgb(), output, self._rgb_noise_buffer)
+
+    def capture_luma(self, window=None):
+        self._wait_for_frame()
+        if window is None:
+            self._add_noise(self._render_luma(), self._luma, self._noise_buffer)
+            return self._luma
+        # Only the window gets noise, like a camera that only reads out part
+        # of its sensor.  The noise goes into the start of the (contiguous)
+        # noise buffer.
+        clean = self._render_luma()[window]
+        buffer = self._noise_buffer.reshape(-1)[:clean.size].reshape(clean.shape)
+        output = self._luma[window]
+        self._add_noise(clean, output, buffer)
+        return output
+
+    def stream_luma(self, window=None):
+        while True:
+            yield self.capture_luma(window)
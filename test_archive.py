@@ -0,0 +1,78 @@
+"""Tests for archive.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+import pytest
+
+from archive import Archive
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 380.0, "max" : 660.0, "version" : 3}
+
+
+def fill(archive):
+    """Add three measurements, the last one shorter, and return their ids."""
+
+    ids = []
+    for i, num_points in enumerate((5, 5, 3)):
+        absorbance = np.arange(num_points) + 10.0 * i
+        ids.append(archive.append("sample %d" % i, absorbance, np.full(num_points, 100.0),
+                                  np.full(num_points, 50.0 + i), CAL, {"loc" : {"x" : i}}))
+    return ids
+
+
+def test_round_trip(tmp_path):
+    archive = Archive(str(tmp_path))
+    ids = fill(archive)
+    measurement = archive.get(ids[1])
+    assert np.array_equal(measurement["absorbance"], np.arange(5) + 10.0)
+    assert np.array_equal(measurement["sample_row"], np.full(5, 51.0))
+    assert measurement["title"] == "sample 1"
+    assert measurement["loc"] == {"x" : 1}
+    assert measurement["cal"] == CAL
+    with pytest.raises(KeyError):
+        archive.get(99)
+    archive.close()
+
+
+def test_query_and_matrix(tmp_path):
+    archive = Archive(str(tmp_path))
+    ids = fill(archive)
+    assert [row[0] for row in archive.query(title="sample [02]")] == [ids[0], ids[2]]
+    assert archive.query(cal_version=4) == []
+    matrix = archive.absorbance_matrix([ids[2], ids[0]])
+    assert matrix.shape == (2, 5)
+    assert np.array_equal(matrix[0, :3], [20.0, 21.0, 22.0])
+    assert np.isnan(matrix[0, 3:]).all()
+    archive.close()
+
+
+def test_export(tmp_path):
+    archive = Archive(str(tmp_path / "archive"))
+    ids = fill(archive)
+    out_file_loc = str(tmp_path / "export.npz")
+    archive.export_npz(np.array([ids[2], ids[1]]), out_file_loc)
+    with np.load(out_file_loc) as exported:
+        assert list(exported["titles"]) == ["sample 2", "sample 1"]
+        assert list(exported["cal_versions"]) == [3, 3]
+        assert np.array_equal(exported["absorbance"][1], np.arange(5) + 10.0)
+    archive.close()
+
+
+def test_rebuild_index(tmp_path):
+    archive = Archive(str(tmp_path))
+    fill(archive)
+    # A record that was only partly written before a crash.
+    with open(archive.data_loc, "ab") as data_file:
+        data_file.write(b"SPEC\x01\x00")
+    assert archive.rebuild_index() == 3
+    assert [row[1] for row in archive.query()] == ["sample 0", "sample 1", "sample 2"]
+    assert np.array_equal(archive.get(archive.query()[2][0])["absorbance"],
+                          [20.0, 21.0, 22.0])
+    archive.close()
@@ -0,0 +1,86 @@
+"""Tests for blank_cache.py, partly using the simulated camera.  Run them with
+"python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+import pytest
+
+from blank_cache import BlankCache, blank_drift
+from get_image import set_backend
+from measure import capture_check_row, capture_row
+from sim_camera import SimulatedCamera
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 380.0, "max" : 660.0}
+LOC = {"x" : 315, "y" : 54, "length" : 116}
+ROW = np.linspace(10.0, 200.0, 50)
+
+
+def test_drift():
+    assert blank_drift(ROW, ROW) == 0.0
+    assert blank_drift(ROW, 1.1 * ROW) == pytest.approx(0.1)
+    # Only the bright points count.
+    dim_changed = ROW.copy()
+    dim_changed[0] = 0.0
+    assert blank_drift(ROW, dim_changed) == 0.0
+
+
+def test_reuse_expiry_and_force():
+    cache = BlankCache(ttl=600.0)
+    captures = []
+
+    def capture_full(loc):
+        captures.append(loc)
+        return ROW
+
+    row, reused = cache.get_blank(CAL, LOC, capture_full, lambda loc: ROW)
+    assert not reused and len(captures) == 1
+    row, reused = cache.get_blank(CAL, LOC, capture_full, lambda loc: ROW)
+    assert reused and np.array_equal(row, ROW) and len(captures) == 1
+    # A different location has its own blank.
+    other_loc = dict(LOC, x=300)
+    assert not cache.get_blank(CAL, other_loc, capture_full, lambda loc: ROW)[1]
+    assert not cache.get_blank(CAL, LOC, capture_full, lambda loc: ROW, force=True)[1]
+    cache.ttl = 0.0
+    assert not cache.get_blank(CAL, LOC, capture_full, lambda loc: ROW)[1]
+
+
+def test_saved_between_runs(tmp_path):
+    file_loc = str(tmp_path / "blank_cache.json")
+    BlankCache(file_loc=file_loc).store(CAL, LOC, ROW)
+    age, row = BlankCache(file_loc=file_loc).lookup(CAL, LOC)
+    assert age < 60 and np.allclose(row, ROW)
+
+
+@pytest.fixture
+def camera():
+    camera = SimulatedCamera(loc=LOC, realtime=False)
+    set_backend(camera)
+    yield camera
+    set_backend(None)
+
+
+def test_unchanged_blank_is_reused(camera):
+    cache = BlankCache()
+    capture_full = lambda loc: capture_row(loc)
+    cache.get_blank(CAL, LOC, capture_full, capture_check_row)
+    for _ in range(10):
+        assert cache.get_blank(CAL, LOC, capture_full, capture_check_row)[1]
+
+
+def test_changed_blank_is_measured_again(camera):
+    cache = BlankCache()
+    capture_full = lambda loc: capture_row(loc)
+    cache.get_blank(CAL, LOC, capture_full, capture_check_row)
+    # The LED gets dimmer.
+    camera.brightness *= 0.9
+    camera.set_sample(None)
+    row, reused = cache.get_blank(CAL, LOC, capture_full, capture_check_row)
+    assert not reused and cache.last_drift > cache.drift_threshold
+    assert cache.get_blank(CAL, LOC, capture_full, capture_check_row)[1]
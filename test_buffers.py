@@ -0,0 +1,54 @@
+"""Tests for buffers.py, using the simulated camera.  Run them with
+"python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import gc
+
+import numpy as np
+import pytest
+
+from buffers import BufferPool, get_buffer_pool, release_buffer
+from get_image import get_color_image, set_backend
+from sim_camera import SimulatedCamera
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def test_released_arrays_are_reused():
+    pool = BufferPool()
+    array = pool.acquire((4, 5))
+    pool.release(array)
+    assert pool.acquire((4, 5)) is array
+    assert (pool.allocations, pool.reuses) == (1, 1)
+
+
+def test_release_rejects_other_arrays():
+    pool = BufferPool()
+    array = pool.acquire((4, 5))
+    with pytest.raises(ValueError):
+        pool.release(np.empty((4, 5), dtype=np.uint8))
+    pool.release(array)
+    with pytest.raises(ValueError):
+        pool.release(array)
+
+
+def test_unreleased_captures_are_not_kept():
+    set_backend(SimulatedCamera(realtime=False))
+    try:
+        pool = get_buffer_pool()
+        start = pool.outstanding
+        for _ in range(20):
+            get_color_image()
+        gc.collect()
+        assert pool.outstanding == start
+        # A released image is still reused afterwards.
+        image = get_color_image()
+        release_buffer(image)
+        assert get_color_image() is image
+    finally:
+        set_backend(None)
@@ -0,0 +1,60 @@
+"""Tests for kinetics.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from kinetics import SpectrumLog, SpectrumRing
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 400.0, "max" : 700.0}
+
+
+def test_ring_keeps_the_latest():
+    ring = SpectrumRing(3, 2)
+    for i in range(5):
+        ring.append(float(i), [i, 10 * i])
+    assert ring.latest()[0] == 4.0
+    times, spectra = ring.ordered()
+    assert list(times) == [2.0, 3.0, 4.0]
+    assert list(spectra[:, 1]) == [20, 30, 40]
+    assert list(ring.trace(1)[1]) == [20, 30, 40]
+
+
+def test_log_grows_and_reopens(tmp_path):
+    directory = str(tmp_path / "run")
+    log = SpectrumLog.create(directory, 4, {"cal" : CAL})
+    log.chunk_rows = 3
+    for i in range(7):
+        log.append(0.5 * i, np.arange(4) + i)
+    assert log.count == 7
+    log.flush()
+
+    reopened = SpectrumLog.open(directory)
+    # The files grew in chunks of 3, and the unused rows aren't counted.
+    assert os.path.getsize(os.path.join(directory, "times.f8")) == 9 * 8
+    assert reopened.count == 7
+    assert np.allclose(reopened.times(), 0.5 * np.arange(7))
+    assert np.allclose(reopened.spectra()[6], np.arange(4) + 6)
+    assert np.allclose(reopened.trace(2), 2 + np.arange(7))
+    assert reopened.trace([0, 3]).shape == (7, 2)
+
+
+def test_trace_at_a_wavelength(tmp_path):
+    log = SpectrumLog.create(str(tmp_path), 100, {"cal" : CAL})
+    assert log.wavelength_index(551.0) == 50
+
+
+def test_a_run_is_never_overwritten(tmp_path):
+    SpectrumLog.create(str(tmp_path), 4, {"cal" : CAL})
+    assert SpectrumLog.exists(str(tmp_path))
+    with pytest.raises(FileExistsError):
+        SpectrumLog.create(str(tmp_path), 4, {"cal" : CAL})
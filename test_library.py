@@ -0,0 +1,84 @@
+"""Tests for library.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+import pytest
+
+from library import SpectralLibrary, get_library, read_csv_spectrum
+from measure import write_csv
+from wavelength import COMMON_GRID
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 380.0, "max" : 660.0}
+
+
+def band(center, width=25.0, wavelengths=COMMON_GRID):
+    return np.exp(-0.5 * ((wavelengths - center) / width)**2)
+
+
+def reference_library(num_references=20):
+    library = SpectralLibrary()
+    centers = np.linspace(420.0, 630.0, num_references)
+    library.add_grid(["band %d" % center for center in centers],
+                     np.stack([band(center) for center in centers]))
+    return library
+
+
+def test_match_ignores_concentration():
+    library = reference_library()
+    name, score = library.match_grid(0.05 + 3.0 * band(486.3))[0]
+    assert name == "band 486" and score == pytest.approx(1.0)
+    matches = library.match_grid(np.stack((band(420.0), band(630.0))), top_k=3)
+    assert [match[0][0] for match in matches] == ["band 420", "band 630"]
+    assert [score for _, score in matches[0]] == sorted(
+        (score for _, score in matches[0]), reverse=True)
+
+
+def test_scores_are_correlations():
+    library = SpectralLibrary()
+    library.add_grid(["up", "down"], np.stack((COMMON_GRID, -COMMON_GRID)))
+    matches = dict(library.match_grid(2 * COMMON_GRID + 1))
+    assert matches["up"] == pytest.approx(1.0)
+    assert matches["down"] == pytest.approx(-1.0)
+
+
+def test_pca_index_finds_the_same_matches():
+    library = reference_library(200)
+    queries = np.stack([band(center) for center in (433.0, 512.0, 601.0)])
+    exact = library.match_grid(queries, top_k=3)
+    library.build_index(num_components=16)
+    indexed = library.match_grid(queries, top_k=3, candidates=20)
+    for exact_matches, indexed_matches in zip(exact, indexed):
+        assert [name for name, _ in indexed_matches] == [name for name, _ in exact_matches]
+        assert [score for _, score in indexed_matches] == pytest.approx(
+            [score for _, score in exact_matches], abs=1e-5)
+
+
+def test_spectrum_must_cover_the_window():
+    library = reference_library()
+    with pytest.raises(ValueError):
+        library.match_grid(np.where(COMMON_GRID < 500, np.nan, 1.0))
+
+
+def test_measured_spectra_and_files(tmp_path):
+    library = SpectralLibrary()
+    measured = np.arange(116)
+    wavelengths = 380.0 + 280.0 * measured / 116
+    library.add("red", band(520.0, wavelengths=wavelengths), CAL)
+    library.add("blue", band(610.0, wavelengths=wavelengths), CAL)
+    csv_loc = str(tmp_path / "sample.csv")
+    write_csv(csv_loc, 0.4 * band(522.0, wavelengths=wavelengths), CAL)
+    assert library.match_grid(read_csv_spectrum(csv_loc))[0][0] == "red"
+
+    file_loc = str(tmp_path / "library.npz")
+    library.save(file_loc)
+    loaded = get_library(file_loc)
+    assert loaded.names == ["red", "blue"]
+    assert get_library(file_loc) is loaded
+    assert get_library(str(tmp_path / "missing.npz")) is None
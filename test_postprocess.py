@@ -0,0 +1,65 @@
+"""Tests for postprocess.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+
+from postprocess import DEFAULT_SETTINGS, correct_baseline, find_peaks, smooth
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+CAL = {"min" : 380.0, "max" : 660.0}
+WAVELENGTHS = 380.0 + 280.0 * np.arange(116) / 116
+
+
+def band(center, width, height):
+    return height * np.exp(-0.5 * ((WAVELENGTHS - center) / width)**2)
+
+
+def test_savgol_keeps_polynomials():
+    settings = dict(DEFAULT_SETTINGS, smoothing="savgol", window=7, order=2)
+    x = np.arange(30.0)
+    data = 0.01 * x**2 - x + 3
+    assert np.allclose(smooth(data, settings), data)
+
+
+def test_gaussian_keeps_constants_to_the_ends():
+    settings = dict(DEFAULT_SETTINGS, smoothing="gaussian", sigma=2.0)
+    assert np.allclose(smooth(np.ones(30), settings), 1.0)
+
+
+def test_no_smoothing_by_default():
+    data = np.linspace(0, 1, 10)
+    assert np.array_equal(smooth(data, DEFAULT_SETTINGS), data)
+
+
+def test_baselines():
+    line = 0.5 + 0.1 * np.arange(30.0)
+    assert np.allclose(correct_baseline(line, dict(DEFAULT_SETTINGS, baseline="linear")), 0)
+    offset = correct_baseline(np.array([0.3, 0.5, 0.4]),
+                              dict(DEFAULT_SETTINGS, baseline="offset"))
+    assert np.allclose(offset, [0.0, 0.2, 0.1])
+
+
+def test_peak_position_height_and_width():
+    peaks = find_peaks(np.stack([band(450, 15, 0.3) + band(600, 15, 0.5),
+                                 band(525, 20, 0.8)]), CAL)
+    assert np.allclose(peaks[0]["wavelength"], [600, 450], atol=3)
+    assert np.allclose(peaks[0]["height"], [0.5, 0.3], atol=0.01)
+    # The FWHM of a Gaussian is 2.355 times its width.
+    assert np.allclose(peaks[0]["fwhm"], 2.355 * 15, atol=2)
+    assert len(peaks[1]["wavelength"]) == 1
+
+
+def test_noise_makes_no_peaks():
+    rng = np.random.default_rng(0)
+    data = band(525, 20, 0.8) + rng.normal(0, 0.01, len(WAVELENGTHS))
+    # Without the prominence test, noise adds maxima beside and on the band.
+    assert len(find_peaks(data, CAL, min_prominence=0)["wavelength"]) > 1
+    peaks = find_peaks(data, CAL)
+    assert len(peaks["wavelength"]) == 1
+    assert abs(peaks["wavelength"][0] - 525) < 5
@@ -0,0 +1,67 @@
+"""Tests for quant.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+import pytest
+
+from quant import QuantModel
+from wavelength import COMMON_GRID, get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+RED = np.exp(-0.5 * ((COMMON_GRID - 520.0) / 30.0)**2)
+BLUE = np.exp(-0.5 * ((COMMON_GRID - 620.0) / 30.0)**2)
+BASELINE = 0.02
+
+
+def standards(concentrations):
+    return np.asarray(concentrations) @ np.stack((RED, BLUE)) + BASELINE
+
+
+def test_single_component():
+    model = QuantModel.fit(["red"], [[0.0], [0.5], [1.0]],
+                           standards([[0, 0], [0.5, 0], [1, 0]]))
+    assert np.allclose(model.extinction[0], RED)
+    assert np.allclose(model.baseline, BASELINE)
+    # Where there is no band, the fit explains nothing but rounding error.
+    assert np.allclose(model.r_squared[RED > 0.01], 1.0)
+    assert np.allclose(model.concentrations_grid(standards([[0.3, 0]])), [[0.3]])
+
+
+def test_mixtures_are_unmixed():
+    concentrations = [[0.1, 0.0], [0.0, 0.2], [0.3, 0.1], [0.2, 0.4]]
+    model = QuantModel.fit(["red", "blue"], concentrations, standards(concentrations))
+    unknown = standards([[0.15, 0.25], [0.4, 0.05]])
+    assert np.allclose(model.concentrations_grid(unknown), [[0.15, 0.25], [0.4, 0.05]])
+
+
+def test_measured_spectrum_is_resampled():
+    model = QuantModel.fit(["red"], [[0.0], [1.0]], standards([[0, 0], [1, 0]]))
+    # The spectrum must cover every wavelength of the model.
+    cal = {"min" : 340.0, "max" : 820.0}
+    wavelengths = get_model(cal, 320).wavelengths
+    data = 0.6 * np.exp(-0.5 * ((wavelengths - 520.0) / 30.0)**2) + BASELINE
+    assert model.concentrations(data, cal) == pytest.approx([0.6], abs=1e-3)
+
+
+def test_dependent_standards_are_rejected():
+    with pytest.raises(ValueError):
+        QuantModel.fit(["red"], [[0.5], [0.5]], standards([[0.5, 0], [0.5, 0]]))
+    with pytest.raises(ValueError):
+        QuantModel.fit(["red"], [[0.0], [1.0]], np.full((2, len(COMMON_GRID)), np.nan))
+
+
+def test_save_and_load(tmp_path):
+    concentrations = [[0.1, 0.0], [0.0, 0.2], [0.3, 0.1]]
+    model = QuantModel.fit(["red", "blue"], concentrations, standards(concentrations))
+    file_loc = str(tmp_path / "profiles" / "quant_v1.npz")
+    model.save(file_loc)
+    loaded = QuantModel.load(file_loc)
+    assert loaded.components == ["red", "blue"]
+    assert np.allclose(loaded.projector, model.projector)
+    assert np.allclose(loaded.concentrations_grid(standards([[0.2, 0.1]])), [[0.2, 0.1]])
@@ -0,0 +1,56 @@
+"""Tests for roi.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+
+from roi import SpectrumROI, get_cropped_roi
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+SHAPE = (40, 30)
+# Each pixel's value is its column number plus 100 times its row number, so
+# linear interpolation across a row gives back the position.
+IMAGE = (np.arange(SHAPE[1])[np.newaxis, :] +
+         100.0 * np.arange(SHAPE[0])[:, np.newaxis])
+
+
+def test_single_column():
+    roi = SpectrumROI({"x" : 12, "y" : 5, "length" : 10}, SHAPE)
+    assert np.allclose(roi.extract(IMAGE), 12 + 100.0 * np.arange(5, 15))
+    assert roi.bounding_slices() == (slice(5, 15), slice(12, 13))
+
+
+def test_fractional_tilted_band():
+    loc = {"x" : 10.25, "y" : 2, "length" : 8, "width" : 3, "tilt" : 0.5}
+    roi = SpectrumROI(loc, SHAPE)
+    steps = np.arange(8)
+    # Averaging evenly spaced points across a linear image gives the value at
+    # the center.
+    assert np.allclose(roi.extract(IMAGE), 10.25 + 0.5 * steps + 100.0 * (2 + steps))
+    assert np.allclose(roi.weights.sum(axis=1), 1.0)
+    mask = roi.pixel_mask()
+    assert mask.sum() == len(roi.pixel_indices())
+    assert mask[2, 9] and mask[2, 12] and not mask[2, 13]
+
+
+def test_edges_are_clamped():
+    roi = SpectrumROI({"x" : 0, "y" : 0, "length" : 3, "width" : 3}, SHAPE)
+    assert roi.indices.min() >= 0
+    assert roi.col_slice.start == 0
+
+
+def test_crop_window():
+    loc = {"x" : 12.5, "y" : 20, "length" : 10, "width" : 2, "tilt" : 0.2}
+    roi = SpectrumROI(loc, SHAPE)
+    window = roi.crop_window(padding=4)
+    assert window == (slice(16, 34), slice(8, 20))
+    # The padding stops at the edges of the image.
+    assert roi.crop_window(padding=50) == (slice(0, 40), slice(0, 30))
+
+    window, cropped = get_cropped_roi(loc, SHAPE, padding=4)
+    assert np.allclose(cropped.extract(IMAGE[window]), roi.extract(IMAGE))
@@ -0,0 +1,186 @@
+"""Tests for service.py, against the simulated camera.  The service is run on
+a free local port in a temporary directory.  Run them with
+"python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from cal import set_cal
+from get_image import set_backend
+from loc import set_loc
+from service import MeasurementService
+from sim_camera import SimulatedCamera
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+LOC = {"x" : 315, "y" : 54, "length" : 116}
+
+
+class CountingCamera(SimulatedCamera):
+    """A simulated camera that records the most captures that were ever
+    running at the same time."""
+
+    def __init__(self, **kwargs):
+        SimulatedCamera.__init__(self, **kwargs)
+        self.running = 0
+        self.most_running = 0
+        self._count_lock = threading.Lock()
+
+    def capture_luma(self, window=None):
+        with self._count_lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            return SimulatedCamera.capture_luma(self, window)
+        finally:
+            with self._count_lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    """Run a MeasurementService on its own event loop thread.  Yield (port,
+    camera)."""
+
+    monkeypatch.chdir(tmp_path)
+    # These are opened in the working directory the first time they are used.
+    monkeypatch.setattr("archive._archive", None)
+    monkeypatch.setattr("blank_cache._blank_cache", None)
+    monkeypatch.setattr("exposure._dark_frame", None)
+    set_loc(LOC["x"], LOC["y"], LOC["length"])
+    set_cal(380.0, 660.0)
+    camera = CountingCamera(loc=LOC, realtime=False)
+    set_backend(camera)
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def run():
+        state["service"] = MeasurementService(workers=2)
+        await state["service"].start()
+        state["server"] = await asyncio.start_server(
+            state["service"].handle_connection, "127.0.0.1", 0)
+        state["port"] = state["server"].sockets[0].getsockname()[1]
+        started.set()
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(run(), loop).result(10)
+    started.wait(10)
+    try:
+        yield state["port"], camera
+    finally:
+        async def stop():
+            state["server"].close()
+            await state["server"].wait_closed()
+            await state["service"].close()
+        asyncio.run_coroutine_threadsafe(stop(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(10)
+        loop.close()
+        set_backend(None)
+
+
+def request(port, method, path, body=None, headers=None):
+    """Send one request and return (status, content type, body bytes)."""
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        connection.request(method, path, body=data, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read()
+    finally:
+        connection.close()
+
+
+def test_measure_blank_and_sample(service):
+    port, _ = service
+    status, _, reply = request(port, "POST", "/sample", {"title" : "early"})
+    assert status == 409
+
+    status, _, reply = request(port, "POST", "/blank", {"force" : True})
+    assert status == 200
+    assert json.loads(reply)["points"] == LOC["length"]
+
+    status, _, _ = request(port, "POST", "/sim/sample",
+                           {"center" : 550, "width" : 40, "height" : 0.8})
+    assert status == 200
+    status, _, reply = request(port, "POST", "/sample", {"title" : "dye"})
+    assert status == 200
+    result = json.loads(reply)
+    assert result["title"] == "dye"
+    assert len(result["absorbance"]) == len(result["wavelengths"]) == LOC["length"]
+    assert max(result["absorbance"]) > 0.5
+
+    status, content_type, reply = request(port, "GET",
+                                          "/results/%d?format=npy" % result["id"])
+    assert (status, content_type) == (200, "application/x-npy")
+    assert np.allclose(np.load(io.BytesIO(reply)), result["absorbance"])
+    status, _, reply = request(port, "GET", "/results/%d?format=raw" % result["id"])
+    assert np.allclose(np.frombuffer(reply, dtype="<f8"), result["absorbance"])
+
+
+def test_concurrent_clients_share_one_camera(service):
+    port, camera = service
+    assert request(port, "POST", "/blank", {"force" : True})[0] == 200
+    with ThreadPoolExecutor(max_workers=6) as clients:
+        replies = list(clients.map(
+            lambda i: request(port, "POST", "/sample", {"title" : "s%d" % i}),
+            range(6)))
+    assert [status for status, _, _ in replies] == [200] * 6
+    assert len({json.loads(reply)["id"] for _, _, reply in replies}) == 6
+    assert camera.most_running == 1
+
+
+def test_set_loc_and_cal(service):
+    port, _ = service
+    status, _, reply = request(port, "PUT", "/cal", {"min" : 400, "max" : 700})
+    assert status == 200 and json.loads(reply)["min"] == 400
+    assert request(port, "PUT", "/cal", {"min" : 700, "max" : 400})[0] == 400
+    status, _, reply = request(port, "PUT", "/loc", dict(LOC, width=3))
+    assert status == 200 and json.loads(reply)["width"] == 3
+    # A new location needs a new blank.
+    assert request(port, "POST", "/sample", {})[0] == 409
+
+
+@pytest.mark.parametrize("length", ["ten", "-5"])
+def test_bad_content_length(service, length):
+    port, _ = service
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.putrequest("POST", "/blank")
+        connection.putheader("Content-Length", length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        assert "error" in json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_errors(service):
+    port, _ = service
+    assert request(port, "GET", "/nowhere")[0] == 404
+    assert request(port, "DELETE", "/loc")[0] == 405
+    assert request(port, "GET", "/results/99")[0] == 404
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("PUT", "/cal", body=b"{no")
+        assert connection.getresponse().status == 400
+    finally:
+        connection.close()
@@ -0,0 +1,62 @@
+"""Tests for wavelength.py.  Run them with "python3 -m pytest".
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+import pytest
+
+from wavelength import COMMON_GRID, cal_coeffs, fit_coeffs, get_model
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+def test_linear_calibration():
+    cal = {"min" : 400.0, "max" : 700.0}
+    assert cal_coeffs(cal) == (400.0, 300.0)
+    model = get_model(cal, 100)
+    assert np.allclose(model.wavelengths, 400.0 + 3.0 * np.arange(100))
+    assert model.at(50.5) == pytest.approx(551.5)
+    assert model.index_of(551.5) == pytest.approx(50.5)
+    assert np.isnan(model.index_of(399.0))
+
+
+def test_fit_recovers_a_polynomial():
+    coeffs = (380.0, 250.0, 40.0)
+    indices = np.array([3.0, 20.5, 47.0, 71.0, 99.0])
+    wavelengths = np.polynomial.polynomial.polyval(indices / 116, coeffs)
+    assert np.allclose(fit_coeffs(indices, wavelengths, 116), coeffs)
+    # With two points, the fit is a line through them.
+    line = fit_coeffs([0, 58], [380.0, 520.0], 116)
+    assert np.allclose(line, (380.0, 280.0))
+    with pytest.raises(ValueError):
+        fit_coeffs([10], [500.0], 116)
+
+
+def test_model_is_shared():
+    cal = {"coeffs" : [380.0, 250.0, 40.0]}
+    assert get_model(cal, 116) is get_model(dict(cal), 116)
+    assert get_model(cal, 116) is not get_model(cal, 117)
+
+
+def test_decreasing_calibration_cannot_resample():
+    model = get_model({"min" : 700.0, "max" : 400.0}, 50)
+    assert not model.increasing
+    with pytest.raises(ValueError):
+        model.index_of(500.0)
+
+
+def test_resample_onto_common_grid():
+    model = get_model({"min" : 400.0, "max" : 700.0}, 100)
+    # A spectrum that is linear in wavelength is resampled exactly.
+    data = 0.01 * model.wavelengths - 3
+    resampled = model.resample(np.stack((data, 2 * data)))
+    grid_range = model.common_grid_range()
+    assert (COMMON_GRID[grid_range][0], COMMON_GRID[grid_range][-1]) == (400.0, 697.0)
+    assert np.allclose(resampled[0, grid_range], 0.01 * COMMON_GRID[grid_range] - 3)
+    assert np.allclose(resampled[1, grid_range], 2 * resampled[0, grid_range])
+    assert np.isnan(resampled[:, :grid_range.start]).all()
+    assert np.isnan(resampled[:, grid_range.stop:]).all()
@@ -0,0 +1,162 @@
+"""This code converts between positions in the spectrum and wavelengths.  It
+is used by measure.py, plot.py and gui.py.
+
+The calibration in cal.json maps a position u in the absorbance spectrum to a
+wavelength with a polynomial, where u goes from 0 at the first point to 1 just
+past the last point (u = index / number of points).  The coefficients are
+stored lowest order first under "coeffs".  Older calibrations only have "min"
+and "max"; they are the linear polynomial [min, max - min].
+
+To make results from different instruments line up, spectra can be resampled
+onto COMMON_GRID.  The interpolation indices and weights are computed once
+per calibration and spectrum length.
+
+This software is licensed under the MIT license.
+
+"""
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+# Every 1 nm across (and a bit beyond) the visible spectrum.
+COMMON_GRID = np.arange(350.0, 801.0, 1.0)
+
+
+def cal_coeffs(cal):
+    """Return the polynomial coefficients (lowest order first) of a calibration
+    dictionary."""
+
+    if "coeffs" in cal:
+        return tuple(float(coeff) for coeff in cal["coeffs"])
+    return (float(cal["min"]), float(cal["max"] - cal["min"]))
+
+
+def fit_coeffs(indices, wavelengths, num_points, degree=2):
+    """Fit a calibration polynomial to reference points.
+
+    Parameters
+    ----------
+    indices : 1D list or numpy array
+        Positions (indices, which needn't be whole numbers) in the absorbance
+        spectrum.
+    wavelengths : 1D list or numpy array
+        The known wavelength (nm) at each position.
+    num_points : int
+        The length of the absorbance spectrum.
+    degree : int
+        The degree of the polynomial.  It is reduced if there aren't enough
+        points.
+
+    Returns
+    -------
+    tuple of float
+        The coefficients, lowest order first.
+
+    """
+
+    indices = np.asarray(indices, dtype=np.float64)
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    if len(indices) < 2:
+        raise ValueError("At least 2 reference points are needed.")
+    degree = min(degree, len(indices) - 1)
+    coeffs = polynomial.polyfit(indices / num_points, wavelengths, degree)
+    return tuple(float(coeff) for coeff in coeffs)
+
+
+class WavelengthModel():
+    """The wavelength calibration for spectra of one length.
+
+    Parameters
+    ----------
+    coeffs : tuple of float
+        The calibration polynomial, lowest order first.  See cal_coeffs().
+    num_points : int
+        The length of the absorbance spectrum.
+
+    """
+
+    def __init__(self, coeffs, num_points):
+        self.coeffs = tuple(coeffs)
+        self.num_points = num_points
+        self.wavelengths = self.at(np.arange(num_points))
+        self.wavelengths.flags.writeable = False
+        self.increasing = bool(np.all(np.diff(self.wavelengths) > 0))
+        self._resample_table = None
+
+    def at(self, indices):
+        """Return the wavelength at positions (which needn't be whole numbers)
+        in the spectrum."""
+
+        return polynomial.polyval(np.asarray(indices, dtype=np.float64) / self.num_points,
+                                  self.coeffs)
+
+    def index_of(self, wavelengths):
+        """Return the (fractional) positions in the spectrum of wavelengths.
+        The calibration must be increasing."""
+
+        if not self.increasing:
+            raise ValueError("The calibration doesn't increase with position.")
+        return np.interp(wavelengths, self.wavelengths, np.arange(self.num_points),
+                         left=np.nan, right=np.nan)
+
+    def _get_resample_table(self):
+        if self._resample_table is None:
+            positions = self.index_of(COMMON_GRID)
+            inside = np.isfinite(positions)
+            left = np.zeros(len(COMMON_GRID), dtype=np.intp)
+            left[inside] = np.minimum(np.floor(positions[inside]), self.num_points - 2)
+            frac = np.where(inside, positions - left, 0.0)
+            self._resample_table = (inside, left, frac)
+        return self._resample_table
+
+    def resample(self, data):
+        """Linearly interpolate data onto COMMON_GRID.
+
+        Parameters
+        ----------
+        data : numpy array
+            A spectrum, or a stack of spectra along the last axis.
+
+        Returns
+        -------
+        numpy array
+            The same shape as data, except that the last axis is
+            len(COMMON_GRID) long.  Wavelengths outside the calibration are NaN.
+
+        """
+
+        inside, left, frac = self._get_resample_table()
+        data = np.asarray(data, dtype=np.float64)
+        result = data[..., left] * (1 - frac) + data[..., left + 1] * frac
+        result[..., ~inside] = np.nan
+        return result
+
+    def common_grid_range(self):
+        """Return a slice of COMMON_GRID covering this calibration's range."""
+
+        inside, _, _ = self._get_resample_table()
+        indices = np.flatnonzero(inside)
+        if len(indices) == 0:
+            return slice(0, 0)
+        return slice(indices[0], indices[-1] + 1)
+
+
+_model_cache = {}
+
+
+def get_model(cal, num_points):
+    """Return the WavelengthModel for a calibration dictionary and a spectrum
+    length.  It is only computed the first time they are used."""
+
+    key = (cal_coeffs(cal), num_points)
+    model = _model_cache.get(key)
+    if model is None:
+        if len(_model_cache) > 16:
+            _model_cache.clear()
+        model = WavelengthModel(key[0], num_points)
+        _model_cache[key] = model
+    return model
@@ -0,0 +1,143 @@
+"""This code runs slow jobs (captures and processing) on a background thread,
+so the GUI doesn't freeze.  It is used by gui.py.
+
+All jobs run on one thread, in the order they were submitted, so two jobs
+never use the camera at the same time.  Results, errors and progress reports
+are passed back through a queue, which the GUI polls with after(); the
+callbacks therefore always run on the tkinter thread.
+
+This software is licensed under the MIT license.
+
+"""
+
+import queue
+import threading
+import traceback
+
+__author__ = "Daniel James Evans"
+__copyright__ = "Copyright 2019, Daniel James Evans"
+__license__ = "MIT"
+
+
+class Task():
+    """A job submitted to a TaskRunner.
+
+    The job's function is called with two extra keyword arguments:
+    progress(fraction, message), which reports how far along it is, and cancel,
+    a threading.Event that is set when the user cancels the task.  Long jobs
+    should check cancel regularly and stop (e.g. by raising
+    get_image.CaptureCancelled) when it is set.
+
+    """
+
+    def __init__(self, function, args, kwargs, on_done, on_error, on_progress):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancel_event = threading.Event()
+        self.finished = False
+
+    def cancel(self):
+        """Ask the task to stop.  If it hasn't started, it never will."""
+
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class TaskRunner():
+    """Runs Tasks on a background thread and reports back to tkinter.
+
+    Parameters
+    ----------
+    widget : tkinter widget
+        Used to schedule the polling with after().  Usually the main window.
+    poll_ms : int
+        How often to check for results while tasks are running.
+
+    """
+
+    def __init__(self, widget, poll_ms=50):
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._pending = 0
+        self._polling = False
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args, on_done=None, on_error=None, on_progress=None,
+               **kwargs):
+        """Queue function(*args, progress=..., cancel=..., **kwargs) to run in the
+        background and return its Task.
+
+        on_done(result), on_error(exception) and on_progress(fraction, message)
+        are called on the tkinter thread.
+
+        """
+
+        task = Task(function, args, kwargs, on_done, on_error, on_progress)
+        self._pending += 1
+        self._jobs.put(task)
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_ms, self._poll)
+        return task
+
+    @property
+    def busy(self):
+        """True if any tasks are waiting or running."""
+
+        return self._pending > 0
+
+    def _work(self):
+        while True:
+            task = self._jobs.get()
+            if task.cancelled:
+                from get_image import CaptureCancelled
+                self._events.put((task, "error", CaptureCancelled()))
+                continue
+
+            def progress(fraction, message="", task=task):
+                self._events.put((task, "progress", (fraction, message)))
+
+            try:
+                result = task.function(*task.args, progress=progress,
+                                       cancel=task.cancel_event, **task.kwargs)
+            except Exception as error:
+                self._events.put((task, "error", error))
+            else:
+                self._events.put((task, "done", result))
+
+    def _poll(self):
+        """Deliver everything the worker has reported, then check again later
+        if there is more to come."""
+
+        while True:
+            try:
+                task, kind, value = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                if task.on_progress is not None:
+                    task.on_progress(*value)
+                continue
+            task.finished = True
+            self._pending -= 1
+            if kind == "done" and task.on_done is not None:
+                task.on_done(value)
+            elif kind == "error":
+                if task.on_error is not None:
+                    task.on_error(value)
+                else:
+                    traceback.print_exception(type(value), value, value.__traceback__)
+        if self._pending > 0:
+            self.widget.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False